@@ -1,19 +1,231 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, asdict
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
 import aiohttp
-import json
 import time
 import asyncio
+import logging
 import sys
-from typing import List, Optional, Dict, Any, ClassVar
-from pathlib import Path
-from 配置类 import 配置类
-from threading import Lock
+from typing import List, Optional, Dict, Any, ClassVar, AsyncIterator, Tuple
+from 指标类 import UpstreamCall, decode_tps
+from SSE解析类 import iter_content, iter_relay
+
+logger = logging.getLogger(__name__)
 
 @dataclass
 class AIConfig:
+    """一个 [[ai]] 上游条目"""
     url: str
     key: str
     model: str
+    pool: str = "default"                  # 所属的模型池,同一池的上游单独做负载均衡,请求可按池名指定
+    weight: float = 1.0                    # 仅在 weighted 策略下生效
+    max_concurrency: Optional[int] = None  # 该上游的并发上限,不设置时使用 [admission] 的默认值
+    rpm: Optional[int] = None              # 服务商对该 key + 模型的每分钟请求数额度
+    tpm: Optional[int] = None              # 服务商对该 key + 模型的每分钟token数额度
+    connect_timeout: Optional[float] = None     # 以下三项为该上游的超时(秒),不设置时使用 [http] 的默认值
+    first_byte_timeout: Optional[float] = None
+    idle_timeout: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AIConfig":
+        """校验并转换一个 [[ai]] 条目,不合法时抛出 ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError(f"上游配置应为表,实际为 {type(data).__name__}")
+        for 字段 in ("url", "key", "model"):
+            if not isinstance(data.get(字段), str) or not data[字段].strip():
+                raise ValueError(f"缺少字段 {字段} 或不是非空字符串")
+        if "pool" in data and (not isinstance(data["pool"], str) or not data["pool"].strip()):
+            raise ValueError(f"pool 必须是非空字符串: {data['pool']!r}")
+        if urlsplit(data["url"]).scheme not in ("http", "https"):
+            raise ValueError(f"url 必须以 http:// 或 https:// 开头: {data['url']}")
+        weight = data.get("weight", 1)
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+            raise ValueError(f"weight 必须是正数: {weight!r}")
+        for 字段 in ("max_concurrency", "rpm", "tpm"):
+            值 = data.get(字段)
+            if 值 is not None and (isinstance(值, bool) or not isinstance(值, int) or 值 <= 0):
+                raise ValueError(f"{字段} 必须是正整数: {值!r}")
+        for 字段 in ("connect_timeout", "first_byte_timeout", "idle_timeout"):
+            值 = data.get(字段)
+            if 值 is not None and (isinstance(值, bool) or not isinstance(值, (int, float)) or 值 <= 0):
+                raise ValueError(f"{字段} 必须是正数: {值!r}")
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{**{k: v for k, v in data.items() if k in 已知字段}, "weight": float(weight)})
+
+    @classmethod
+    def from_list(cls, items: Any) -> List["AIConfig"]:
+        """校验整个 [[ai]] 列表,错误信息带上条目序号"""
+        if not isinstance(items, list) or not items:
+            raise ValueError("[[ai]] 上游列表为空")
+        结果 = []
+        for 序号, 条目 in enumerate(items):
+            try:
+                结果.append(cls.from_dict(条目))
+            except ValueError as e:
+                raise ValueError(f"第 {序号 + 1} 个 [[ai]] 条目不合法: {e}") from None
+        return 结果
+
+    def identity(self) -> Tuple[str, str, str]:
+        """判断热加载前后是否为同一上游的依据"""
+        return (self.url, self.key, self.model)
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant. Use Chinese to respond."
+
+@dataclass
+class Timeouts:
+    """单个请求指定的超时(秒),未指定的项使用上游配置或 [http] 的默认值
+
+    total 为整个请求(含排队和换上游重试)的截止时间;connect、first_byte、idle
+    分别限制每次上游调用的建立连接、发出请求到收到首个数据块、两个数据块之间的间隔。
+
+    Example:
+        >>> Timeouts.parse("30")
+        Timeouts(total=30.0, connect=None, first_byte=None, idle=None)
+        >>> Timeouts.parse("total=30, first_byte=5, idle=10")
+        Timeouts(total=30.0, connect=None, first_byte=5.0, idle=10.0)
+    """
+    total: Optional[float] = None
+    connect: Optional[float] = None
+    first_byte: Optional[float] = None
+    idle: Optional[float] = None
+
+    @classmethod
+    def parse(cls, value: Any) -> "Timeouts":
+        """解析请求头或请求体中的超时:一个数字(即 total),"键=秒" 的逗号分隔列表或字典;不合法时抛出 ValueError"""
+        if value is None or value == "":
+            return cls()
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                项 = [片.split("=", 1) for 片 in value.replace(";", ",").split(",") if 片.strip()]
+                if any(len(键值) != 2 for 键值 in 项):
+                    raise ValueError(f"超时格式应为秒数或 键=秒 列表: {value!r}") from None
+                value = {键.strip(): 值.strip() for 键, 值 in 项}
+        if not isinstance(value, dict):
+            value = {"total": value}
+        已知字段 = {f.name for f in fields(cls)}
+        结果 = {}
+        for 键, 值 in value.items():
+            if 键 not in 已知字段:
+                raise ValueError(f"未知的超时项 {键!r},可选: {', '.join(sorted(已知字段))}")
+            try:
+                秒数 = float(值) if not isinstance(值, bool) else None
+            except (TypeError, ValueError):
+                秒数 = None
+            if 秒数 is None or not 秒数 > 0:
+                raise ValueError(f"超时 {键} 必须是正数: {值!r}")
+            结果[键] = 秒数
+        return cls(**结果)
+
+@dataclass
+class ChatPayload:
+    """发往上游的一次对话请求
+
+    params 中的采样参数(temperature、max_tokens、stop、tools 等)原样发给上游;
+    raw 为 True 时流式调用产出原样的 SSE 字节块(RelayChunk),否则产出解析后的回答增量;
+    include_usage 为 None 时按 AIClient.request_usage 决定是否请求上游返回用量;
+    timeouts 为请求指定的超时,为 None 时全部使用上游配置的默认值。
+    """
+    messages: List[Dict[str, Any]]
+    params: Dict[str, Any] = field(default_factory=dict)
+    raw: bool = False
+    include_usage: Optional[bool] = None
+    timeouts: Optional[Timeouts] = None
+    tenant: Optional[str] = None  # 发起请求的调用方名称,用于准入控制的公平排队,不发给上游
+    model: Optional[str] = None   # 请求指定的模型池名或模型名,由调度器据此限定上游范围,不发给上游
+    slots: Optional[Any] = None   # 按上游限制并发的名额表(准入控制类.UpstreamSlots,例如批处理),不发给上游
+
+    @classmethod
+    def from_question(cls, question: str, system_prompt: Optional[str] = None,
+                      timeouts: Optional[Timeouts] = None) -> "ChatPayload":
+        """单轮提问:系统提示词 + 问题,使用默认采样参数"""
+        return cls(
+            messages=[
+                {"role": "system", "content": system_prompt if system_prompt is not None else DEFAULT_SYSTEM_PROMPT},
+                {"role": "user", "content": question},
+            ],
+            params=dict(AIClient.sampling_params),
+            timeouts=timeouts,
+        )
+
+    def max_output_tokens(self) -> Optional[int]:
+        """请求中限制的回答token数上限,没有设置时为 None"""
+        return self.params.get("max_completion_tokens") or self.params.get("max_tokens")
+
+    def prompt_chars(self) -> int:
+        """消息中文本内容的总字数(多模态消息只计文本部分),用于估算提示词token数"""
+        字数 = 0
+        for 消息 in self.messages:
+            内容 = 消息.get("content")
+            if isinstance(内容, str):
+                字数 += len(内容)
+            elif isinstance(内容, list):
+                字数 += sum(len(部分.get("text") or "") for 部分 in 内容 if isinstance(部分, dict))
+        return 字数
+
+class UpstreamError(Exception):
+    """上游调用失败
+
+    Attributes:
+        status (Optional[int]): 上游返回的HTTP状态码,连接类错误为None
+        retry_after (Optional[float]): 上游通过 Retry-After 要求等待的秒数
+        retryable (bool): 是否可以换一个上游重试,仅限尚未收到响应时的连接错误、5xx和429
+        timed_out (bool): 是否因连接、首字节或空闲超时而失败
+    """
+
+    def __init__(self, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None, retryable: bool = False, timed_out: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
+        self.timed_out = timed_out
+
+@dataclass
+class HTTPConfig:
+    """上游HTTP连接池配置,对应 ai_configs.toml 中的 [http] 段"""
+    limit: int = 100                  # 连接池总连接数上限
+    limit_per_host: int = 32          # 单个上游主机的连接数上限
+    keepalive_timeout: float = 60     # 空闲连接保活时间(秒)
+    ttl_dns_cache: int = 300          # DNS缓存时间(秒)
+    connect_timeout: float = 10       # 从连接池取连接+建立连接的超时(秒)
+    sock_connect_timeout: float = 5   # TCP/TLS握手超时(秒)
+    sock_read_timeout: float = 120    # 两次读取之间的最长间隔(秒),作为下面两项之外的兜底
+    total_timeout: Optional[float] = None  # 整个请求的总超时(秒),None为不限制
+    first_byte_timeout: Optional[float] = 60  # 发出请求到收到首个数据块的超时(秒),None为不限制
+    idle_timeout: Optional[float] = 60        # 收到首个数据块后两个数据块之间的最长间隔(秒),None为不限制
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "HTTPConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+    def client_timeout(self, connect: Optional[float] = None) -> aiohttp.ClientTimeout:
+        """connect 为单个上游或请求指定的连接超时,握手超时不超过它"""
+        connect = connect or self.connect_timeout
+        return aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            connect=connect,
+            sock_connect=min(self.sock_connect_timeout, connect),
+            sock_read=self.sock_read_timeout,
+        )
+
+@dataclass
+class SessionStats:
+    """单个上游主机会话的连接复用统计"""
+    requests: int = 0
+    connections_created: int = 0
+    connections_reused: int = 0
+    dns_cache_hits: int = 0
+    dns_cache_misses: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        数据 = asdict(self)
+        总连接 = self.connections_created + self.connections_reused
+        数据["reuse_ratio"] = round(self.connections_reused / 总连接, 4) if 总连接 else 0.0
+        return 数据
 
 @dataclass
 class APIResponse:
@@ -22,22 +234,181 @@ class APIResponse:
     message: Optional[str] = None
     message_length: int = 0
 
+# aiohttp 3.10 起区分连接超时和读取超时,更早的版本只有 ServerTimeoutError
+_CONNECT_TIMEOUT_ERRORS = getattr(aiohttp, "ConnectionTimeoutError", aiohttp.ServerTimeoutError)
+
+class _ReadWatchdog:
+    """上游读取看门狗:首个数据块或两个数据块之间超时未到达时关闭响应,等待中的读取随即以连接错误结束
+
+    每个数据块只记下到达时刻,定时器到期时再按最后到达时刻判断是否真的空闲,不为每个数据块重建定时器。
+    """
+    __slots__ = ("_loop", "_response", "_idle", "_last", "_handle", "expired")
+
+    def __init__(self, response: aiohttp.ClientResponse, first_byte: Optional[float], idle: Optional[float]):
+        self._loop = asyncio.get_running_loop()
+        self._response = response
+        self._idle = idle
+        self._last: Optional[float] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self.expired: Optional[str] = None  # 超时的阶段: first_byte 或 idle
+        if first_byte is not None:
+            self._handle = self._loop.call_later(max(0.0, first_byte), self._check)
+
+    def _check(self) -> None:
+        self._handle = None
+        if self._last is None:
+            self._expire("first_byte")
+            return
+        剩余 = self._last + self._idle - self._loop.time()
+        if 剩余 <= 0:
+            self._expire("idle")
+        else:
+            self._handle = self._loop.call_later(剩余, self._check)
+
+    def _expire(self, phase: str) -> None:
+        self.expired = phase
+        self._response.close()
+
+    async def watch(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for 块 in chunks:
+            if self._last is None:
+                # 收到首个数据块后改为空闲计时
+                self.cancel()
+                if self._idle is not None:
+                    self._handle = self._loop.call_later(self._idle, self._check)
+            self._last = self._loop.time()
+            yield 块
+
+    def cancel(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
 @dataclass
 class AIClient:
+    # 每个上游主机一个长连接会话,在 startup 中创建,在 shutdown 中关闭
+    _http_config: ClassVar[HTTPConfig] = HTTPConfig()
+    _sessions: ClassVar[Dict[str, aiohttp.ClientSession]] = {}
+    _session_stats: ClassVar[Dict[str, SessionStats]] = {}
+    # 默认采样参数,同时作为响应缓存键的一部分
+    sampling_params: ClassVar[Dict[str, Any]] = {
+        "temperature": 0.2,
+        "presence_penalty": 0,
+        "frequency_penalty": 0,
+        "top_p": 1,
+    }
+    # 请求上游在流的最后一个事件中返回 token 用量(stream_options.include_usage)
+    request_usage: ClassVar[bool] = True
+
+    @classmethod
+    async def startup(cls, http_config: Optional[HTTPConfig] = None, urls: List[str] = ()) -> None:
+        """应用启动时调用:保存连接池配置并为已知上游预先创建会话"""
+        if http_config is not None:
+            cls._http_config = http_config
+        for url in urls:
+            cls._get_session(url)
+
+    @classmethod
+    async def shutdown(cls) -> None:
+        """应用关闭时调用:关闭所有上游会话"""
+        sessions, cls._sessions = cls._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+    @classmethod
+    def session_stats(cls) -> Dict[str, Dict[str, Any]]:
+        return {host: stats.to_dict() for host, stats in cls._session_stats.items()}
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        return f"{parts.scheme}://{parts.hostname}:{port}"
+
+    @classmethod
+    def _get_session(cls, url: str) -> aiohttp.ClientSession:
+        host = cls._host_key(url)
+        session = cls._sessions.get(host)
+        if session is None or session.closed:
+            session = cls._create_session(host)
+            cls._sessions[host] = session
+        return session
+
+    @classmethod
+    def _create_session(cls, host: str) -> aiohttp.ClientSession:
+        http_config = cls._http_config
+        stats = cls._session_stats.setdefault(host, SessionStats())
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            stats.requests += 1
+        async def on_connection_create_end(session, ctx, params):
+            stats.connections_created += 1
+        async def on_connection_reuseconn(session, ctx, params):
+            stats.connections_reused += 1
+        async def on_dns_cache_hit(session, ctx, params):
+            stats.dns_cache_hits += 1
+        async def on_dns_cache_miss(session, ctx, params):
+            stats.dns_cache_misses += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+
+        connector = aiohttp.TCPConnector(
+            limit=http_config.limit,
+            limit_per_host=http_config.limit_per_host,
+            keepalive_timeout=http_config.keepalive_timeout,
+            ttl_dns_cache=http_config.ttl_dns_cache,
+            use_dns_cache=True,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=http_config.client_timeout(),
+            trace_configs=[trace_config],
+        )
+
+    @classmethod
+    async def async_timed_ask(cls,config:AIConfig,question: str, system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+                              upstream_label: str = "-") -> dict:
+        """与 async_plus_ask 返回相同结构,但失败时抛出 UpstreamError 而不是返回错误字典
+
+        另外返回首token延迟 ttft、上游返回的 token 用量 usage 和解码速度 tokens_per_second(token/秒),
+        上游没有返回用量时后两者为 None。
+        """
+        return await cls.async_timed_chat(config, ChatPayload.from_question(question, system_prompt), upstream_label)
     @classmethod
-    async def async_plus_ask(cls,config:AIConfig,question: str, system_prompt: str = "You are a helpful assistant. Use Chinese to respond.") -> str:
+    async def async_timed_chat(cls,config:AIConfig,payload:ChatPayload,upstream_label: str = "-") -> dict:
+        """以完整的消息列表和采样参数调用上游,返回结构与 async_timed_ask 相同"""
         start_time = time.time()
+        usage: Dict[str, Any] = {}
+        first_token_at = None
+        parts = []
+        async for content in cls.async_stream_chat(config,payload,upstream_label,usage):
+            if first_token_at is None:
+                first_token_at = time.time()
+            parts.append(content)
+        end_time = time.time()
+        response = "".join(parts)
+        tps = decode_tps(usage.get("completion_tokens"), first_token_at, end_time)
+        return {
+            "status": "success",
+            "time": round(end_time - start_time, 2),
+            "message": response,
+            "message_length": len(response) if response else 0,
+            "ttft": round(first_token_at - start_time, 3) if first_token_at is not None else None,
+            "usage": usage or None,
+            "tokens_per_second": round(tps, 1) if tps is not None else None,
+        }
+    @classmethod
+    async def async_plus_ask(cls,config:AIConfig,question: str, system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+                             upstream_label: str = "-") -> str:
         try:
-            response = await cls.async_normal_ask(config,question,system_prompt)
-            elapsed_time = time.time() - start_time
-            return {
-                "status": "success",
-                "time": round(elapsed_time, 2),
-                "message": response,
-                "message_length": len(response) if response else 0
-            }
+            return await cls.async_timed_ask(config,question,system_prompt,upstream_label)
         except Exception as e:
-            print(f"测试接口出错: {str(e)}")
+            logger.warning(f"测试接口出错: {str(e)}")
             return {
                 "status": "error",
                 "time": -1,
@@ -45,57 +416,157 @@ class AIClient:
                 "message_length": 0
             }
     @classmethod
-    async def async_normal_ask(cls,config:AIConfig,question: str, system_prompt: str = "You are a helpful assistant. Use Chinese to respond.") -> str:
-        url,payload,headers = cls._construct_requestall(config,system_prompt,question)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status != 200:
-                    raise Exception(f"API请求失败: {await response.text()}")
-                return await cls._process_stream_response(response)
+    async def async_normal_ask(cls,config:AIConfig,question: str, system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+                               upstream_label: str = "-") -> str:
+        return "".join([content async for content in cls.async_stream_ask(config,question,system_prompt,upstream_label)])
     @classmethod
-    async def _process_stream_response(cls,response) -> str:
-        full_response = ""
-        async for line in response.content:
-            if line:
-                line = line.decode('utf-8').strip()
-                if line.startswith('data: '):
-                    data = line[6:]
-                    if data == '[DONE]':
-                        continue
+    def async_stream_ask(cls,config:AIConfig,question: str, system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+                         upstream_label: str = "-", usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """流式提问:上游每到达一个增量就立即产出,调用方关闭生成器即中断上游读取
+
+        upstream_label 为指标中的 upstream 标签(通常是上游索引);
+        传入 usage 字典时,上游返回的 token 用量(prompt_tokens、completion_tokens 等)会写入其中。
+        """
+        return cls.async_stream_chat(config, ChatPayload.from_question(question, system_prompt), upstream_label, usage)
+    @classmethod
+    async def async_stream_chat(cls,config:AIConfig,payload:ChatPayload,
+                                upstream_label: str = "-", usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[Any]:
+        """以完整的消息列表和采样参数流式调用上游
+
+        payload.raw 为 True 时产出 RelayChunk(原样字节 + 窥视到的回答文本),否则产出回答增量字符串。
+        连接、首字节和空闲三个阶段分别计时(见 _phase_timeouts);首字节超时和产出增量之前的空闲超时可换上游重试。
+        """
+        url,body,headers = cls._construct_chat(config,payload)
+        session = cls._get_session(url)
+        连接超时, 首字节超时, 空闲超时 = cls._phase_timeouts(config, payload.timeouts)
+        指标 = UpstreamCall(upstream_label, config.model)
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                发送时刻 = loop.time()
+                try:
+                    response = await asyncio.wait_for(
+                        session.post(url, headers=headers, json=body,
+                                     timeout=cls._http_config.client_timeout(连接超时)),
+                        首字节超时)
+                except asyncio.TimeoutError as e:
+                    if isinstance(e, _CONNECT_TIMEOUT_ERRORS):
+                        指标.finish("error", "timeout_connect")
+                        raise UpstreamError(f"连接上游超时({连接超时} 秒): {e!r}", retryable=True, timed_out=True) from e
+                    指标.finish("error", "timeout_first_byte")
+                    raise UpstreamError(f"上游 {首字节超时} 秒内没有返回响应头", retryable=True, timed_out=True) from e
+                async with response:
+                    await cls._raise_for_status(response)
+                    剩余 = None if 首字节超时 is None else 首字节超时 - (loop.time() - 发送时刻)
+                    看门狗 = _ReadWatchdog(response, 剩余, 空闲超时)
+                    已产出 = False
                     try:
-                        json_data = json.loads(data)
-                        content = json_data['choices'][0]['delta'].get('content', '')
-                        full_response += content
-                    except json.JSONDecodeError:
-                        print(f"JSON解析错误: {data}")
-        return full_response
-    @classmethod
-    def _construct_requestall(cls,config,system_prompt,question):
-        url=config['url']
-        payload = {
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question},
-            ],
+                        if payload.raw:
+                            async for 片段 in iter_relay(看门狗.watch(response.content.iter_any()), usage):
+                                指标.on_delta(片段.deltas)
+                                已产出 = 已产出 or bool(片段.deltas)
+                                yield 片段
+                        else:
+                            async for content in iter_content(看门狗.watch(response.content.iter_any()), usage):
+                                指标.on_delta()
+                                已产出 = True
+                                yield content
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        if 看门狗.expired is not None:
+                            指标.finish("error", f"timeout_{看门狗.expired}")
+                            说明 = (f"上游 {首字节超时} 秒内没有返回数据" if 看门狗.expired == "first_byte"
+                                    else f"上游超过 {空闲超时} 秒没有返回新的数据")
+                            raise UpstreamError(说明, retryable=not 已产出, timed_out=True) from e
+                        指标.finish("error", "read")
+                        raise UpstreamError(f"读取上游响应中断: {e!r}") from e
+                    finally:
+                        看门狗.cancel()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                指标.finish("error", "timeout_connect" if isinstance(e, asyncio.TimeoutError) else "connect")
+                raise UpstreamError(f"连接上游失败: {e!r}", retryable=True,
+                                    timed_out=isinstance(e, asyncio.TimeoutError)) from e
+        except UpstreamError as e:
+            指标.finish("error", f"http_{e.status}" if e.status else "upstream")
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            指标.finish("cancelled")
+            raise
+        except BaseException:
+            指标.finish("error", "internal")
+            raise
+        指标.finish("success", completion_tokens=usage.get("completion_tokens") if usage else None)
+    @classmethod
+    def _phase_timeouts(cls, config: AIConfig,
+                        timeouts: Optional[Timeouts] = None) -> Tuple[float, Optional[float], Optional[float]]:
+        """返回 (连接, 首字节, 空闲) 超时秒数:请求指定的优先,其次是该上游的配置,最后是 [http] 的默认值"""
+        请求 = timeouts or Timeouts()
+        http = cls._http_config
+        return (
+            请求.connect or config.connect_timeout or http.connect_timeout,
+            请求.first_byte or config.first_byte_timeout or http.first_byte_timeout,
+            请求.idle or config.idle_timeout or http.idle_timeout,
+        )
+    @classmethod
+    async def _raise_for_status(cls,response) -> None:
+        if response.status == 200:
+            return
+        retryable = response.status == 429 or response.status >= 500
+        raise UpstreamError(
+            f"API请求失败({response.status}): {await response.text()}",
+            status=response.status,
+            retry_after=cls._parse_retry_after(response.headers.get('Retry-After')),
+            retryable=retryable,
+        )
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    @classmethod
+    async def _process_stream_response(cls,response) -> str:
+        return "".join([content async for content in cls._iter_stream_response(response)])
+    @classmethod
+    async def _iter_stream_response(cls,response,usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        # 按到达的字节块增量解析,不假设每块恰好是完整的一行
+        async for content in iter_content(response.content.iter_any(), usage):
+            yield content
+    @classmethod
+    def _construct_requestall(cls,config:AIConfig,system_prompt,question):
+        return cls._construct_chat(config, ChatPayload.from_question(question, system_prompt))
+    @classmethod
+    def _construct_chat(cls,config:AIConfig,payload:ChatPayload):
+        url=config.url
+        body = {
+            **payload.params,
+            "messages": payload.messages,
             "stream": True,
-            "model": config['model'],
-            "temperature": 0.2,
-            "presence_penalty": 0,
-            "frequency_penalty": 0,
-            "top_p": 1,
+            "model": config.model,
         }
+        if cls.request_usage if payload.include_usage is None else payload.include_usage:
+            body["stream_options"] = {"include_usage": True}
         headers = {
             'accept': 'application/json, text/event-stream',
-            'authorization': f'Bearer {config["key"]}',
+            'authorization': f'Bearer {config.key}',
             'content-type': 'application/json',
             'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
-        return url,payload,headers
+        return url,body,headers
 
 if __name__ == "__main__":
     async def run_test():
-        result = await AIClient.async_plus_ask(AIConfig(url='https://api.openai.com/v1/chat/completions',key='sk-proj-1234567890',model='gpt-3.5-turbo'),'你好')
-        print(f"测试结果：{result}")
+        try:
+            result = await AIClient.async_plus_ask(AIConfig(url='https://api.openai.com/v1/chat/completions',key='sk-proj-1234567890',model='gpt-3.5-turbo'),'你好')
+            print(f"测试结果：{result}")
+            print(f"连接统计：{AIClient.session_stats()}")
+        finally:
+            await AIClient.shutdown()
 
     if sys.platform.startswith('win'):
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -1,62 +1,313 @@
-from fastapi import FastAPI, HTTPException, Depends
+import sys
+if __name__ == '__main__':
+    # 直接运行本文件时转交给命令行入口(启动服务器.py),由 uvicorn 按导入字符串加载本模块;
+    # 在新进程中运行入口,多进程启动时工作进程不会把本文件当作主模块再执行一遍
+    import subprocess
+    from pathlib import Path
+    try:
+        sys.exit(subprocess.call([sys.executable, str(Path(__file__).with_name('启动服务器.py')), *sys.argv[1:]]))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+from fastapi import FastAPI, HTTPException, Query, Header, Body, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
+from starlette.requests import ClientDisconnect
 from datetime import datetime
 import asyncio
+import json
+import os
 import time
-import sys
-from typing import List, Dict, Tuple
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from typing import Any, Awaitable, List, Dict, Optional, Union
 from 日志类 import LoggerManager
-from itertools import cycle
-from dataclasses import dataclass
-from AIClass import AIClient
+from AIClass import AIClient, AIConfig, HTTPConfig, Timeouts, UpstreamError
+from 负载均衡类 import LoadBalancer
+from 熔断器类 import BreakerConfig
+from 调度器类 import Dispatcher, DispatchError, RetryConfig, HedgeConfig
+from 缓存类 import ResponseCache, CacheConfig
+from 近似缓存类 import ApproxCache, ApproxCacheConfig
+from 探测类 import UpstreamProber, ProbeConfig
+from 模型池类 import ModelRouter, RoutingConfig
+from 准入控制类 import AdmissionController, AdmissionConfig
+from 租户类 import FairnessConfig, TenantConfig, TenantRegistry, TenantRejected
+from 限流类 import RateLimiter, RateLimitConfig
+from 配置重载类 import ConfigWatcher, ReloadConfig
+from 批处理类 import BatchManager, BatchConfig, BatchRejected, parse_batch_input
+from OpenAI兼容类 import parse_chat_completion, completion_response, error_response, error_event
+from 指标类 import REGISTRY, observe_route
+from 多进程共享类 import (SharedState, WorkersConfig, WORKERS_ENV, split_upstream_limits,
+                         split_admission_limits, split_tenant_limits)
 from 配置类 import 配置类
 from pydantic import BaseModel
 配置类.切换到脚本所在目录()
-ai_configs = 配置类.读取toml文件('ai_configs.toml')
+# 环境变量 AI_CONFIGS 可指定其他配置文件(相对路径以本脚本所在目录为准),例如压测时使用模拟上游的配置
+配置文件路径 = os.environ.get('AI_CONFIGS', 'ai_configs.toml')
+ai_configs = 配置类.读取toml文件(配置文件路径)
+
+# 多进程部署:由 __main__ 以 uvicorn --workers 启动时,每个工作进程在导入时领取一个槽位,
+# 负载均衡的在途数、延迟、熔断和冷却状态通过共享内存在进程间汇总
+多进程配置 = WorkersConfig.from_dict(ai_configs.get('workers'))
+工作进程数 = int(os.environ.get(WORKERS_ENV, '1'))
+共享状态 = SharedState(replace(多进程配置, workers=工作进程数)) if 工作进程数 > 1 else None
+
+# 初始化日志系统(异步模式下由后台线程写文件和控制台,不阻塞事件循环);多进程时每个进程写各自的日志文件
+日志配置 = ai_configs.get('logging', {})
+日志管理器 = LoggerManager(
+    name="AI服务器自定义接口" if 共享状态 is None else f"AI服务器自定义接口_w{共享状态.worker_id}",
+    async_mode=日志配置.get('async_mode', False),
+    queue_size=日志配置.get('queue_size', 10000),
+    full_policy=日志配置.get('full_policy', 'drop'),
+)
+logger = 日志管理器.get_logger()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时为每个上游主机建立长连接会话,关闭时统一释放
+    await AIClient.startup(
+        HTTPConfig.from_dict(ai_configs.get('http')),
+        [上游.config.url for 上游 in 负载均衡器.upstreams],
+    )
+    # 监视配置文件,修改 [[ai]] 后无需重启即可生效
+    重载配置 = ReloadConfig.from_dict(ai_configs.get('reload'))
+    监视器 = ConfigWatcher(配置文件路径, 重新加载上游配置, 重载配置.interval) if 重载配置.watch else None
+    if 监视器 is not None:
+        监视器.start()
+    if 共享状态 is not None:
+        # 其他进程通过管理接口修改上游配置后,本进程重新读取配置文件
+        共享状态.start(重新加载上游配置)
+    探测器.start()
+    yield
+    await 探测器.stop()
+    if 监视器 is not None:
+        await 监视器.stop()
+    await 批处理.close()
+    await AIClient.shutdown()
+    if 响应缓存 is not None:
+        响应缓存.close()
+    if 共享状态 is not None:
+        await 共享状态.stop()
+    日志管理器.stop()
 
-# 初始化日志系统
-logger = LoggerManager(name="AI服务器自定义接口").get_logger()
 # 创建 FastAPI 应用
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # 创建一个 AIClient 实例
 ai_client = AIClient()
 
-@dataclass
-class LoadBalancer:
-    current: cycle
-    def __init__(self, api_configs: List[Dict]):
-        global ai_configs
-        self.current = cycle(list(enumerate(ai_configs['ai'])))
-    def get_next_api(self) -> Tuple[int, Dict]:
-        return next(self.current) 
+限流配置 = RateLimitConfig.from_dict(ai_configs.get('rate_limit'))
+限流器 = RateLimiter(限流配置) if 限流配置.enabled else None
+
+def 解析上游配置(上游列表) -> List[AIConfig]:
+    """解析 [[ai]] 列表;多进程部署时 rpm/tpm 额度和并发上限按进程数平分"""
+    return split_upstream_limits(AIConfig.from_list(上游列表), 工作进程数)
+
+负载配置 = ai_configs.get('balancer', {})
+路由配置 = RoutingConfig.from_dict(ai_configs.get('routing'))
+负载均衡器 = LoadBalancer(
+    解析上游配置(ai_configs.get('ai')),
+    strategy=负载配置.get('strategy', 'round_robin'),
+    ewma_alpha=负载配置.get('ewma_alpha', 0.3),
+    breaker_config=BreakerConfig.from_dict(ai_configs.get('breaker')),
+    rate_limiter=限流器,
+    shared=共享状态,
+    throughput_window=负载配置.get('throughput_window', 600),
+    throughput_samples=负载配置.get('throughput_samples', 64),
+    expected_output_tokens=负载配置.get('expected_output_tokens', 限流配置.estimated_output_tokens),
+    pool_strategies=路由配置.strategies,
+)
+模型路由 = ModelRouter(路由配置, 负载均衡器)
+
+缓存配置 = CacheConfig.from_dict(ai_configs.get('cache'))
+if 共享状态 is not None and 缓存配置.sqlite_path is None:
+    # 各进程的内存层互不相通,多进程时通过共享的磁盘层互相命中
+    缓存配置 = replace(缓存配置, sqlite_path=多进程配置.shared_cache_path)
+响应缓存 = ResponseCache(缓存配置) if 缓存配置.enabled else None
+
+近似缓存配置 = ApproxCacheConfig.from_dict(ai_configs.get('approx_cache'))
+近似缓存 = ApproxCache(近似缓存配置) if 近似缓存配置.enabled else None
+
+公平配置 = FairnessConfig.from_dict(ai_configs.get('fairness'))
+调用方登记表 = TenantRegistry(公平配置, split_tenant_limits(TenantConfig.from_list(ai_configs.get('tenant')), 工作进程数))
+
+准入配置 = split_admission_limits(AdmissionConfig.from_dict(ai_configs.get('admission')), 工作进程数)
+准入控制 = AdmissionController(
+    准入配置,
+    {上游.index: 上游.config.max_concurrency for 上游 in 负载均衡器.upstreams},
+    调用方登记表 if 公平配置.enabled else None,
+) if 准入配置.enabled else None
+if 公平配置.enabled and 准入控制 is None:
+    logger.warning("[fairness] 已启用但 [admission] 未启用:只识别调用方,不做公平排队和并发配额")
 
-负载均衡器 = LoadBalancer(ai_configs)
+调度器 = Dispatcher(
+    负载均衡器,
+    RetryConfig.from_dict(ai_configs.get('retry')),
+    HedgeConfig.from_dict(ai_configs.get('hedge')),
+    响应缓存,
+    准入控制,
+    限流器,
+    近似缓存,
+    模型路由,
+)
 
-async def get_api_config():
-    return 负载均衡器.get_next_api()
+批处理 = BatchManager(调度器, BatchConfig.from_dict(ai_configs.get('batch')))
+
+探测配置 = ProbeConfig.from_dict(ai_configs.get('probe'))
+if 共享状态 is not None and 探测配置.snapshot_path is None:
+    探测配置 = replace(探测配置, snapshot_path=str(共享状态.dir / "probe.json"))
+# 多进程时只由 0 号进程在后台探测,其他进程从共享文件读取结果,避免探测次数成倍增加
+探测器 = UpstreamProber(探测配置, lambda: 负载均衡器.upstreams,
+                        background=共享状态 is None or 共享状态.worker_id == 0)
+
+重载锁 = asyncio.Lock()
+
+async def 应用上游配置(上游配置: List[AIConfig]) -> Dict:
+    """原子替换负载均衡器的上游列表,并同步准入控制的并发上限"""
+    变更 = 负载均衡器.reload(上游配置)
+    if 准入控制 is not None:
+        准入控制.update_limits({上游.index: 上游.config.max_concurrency for 上游 in 负载均衡器.upstreams})
+    logger.info(
+        f"上游配置已更新: 新增 {变更['added']} 删除 {变更['removed']} 保留 {变更['kept']}\n"
+        f"{'='*50}"
+    )
+    return 变更
+
+async def 重新加载上游配置() -> Dict:
+    """重新读取配置文件中的 [[ai]] 列表;文件不合法时抛出 ValueError,当前配置保持不变
+
+    其他配置段(连接池、策略、熔断等)仍需重启才能生效。
+    """
+    async with 重载锁:
+        try:
+            新配置 = await asyncio.to_thread(配置类.读取toml文件, 配置文件路径)
+            上游配置 = 解析上游配置(新配置.get('ai'))
+        except ValueError as e:
+            logger.error(f"配置文件不合法,继续使用当前配置: {e}\n{'='*50}")
+            raise
+        ai_configs['ai'] = 新配置['ai']
+        return await 应用上游配置(上游配置)
 
 class ChatRequest(BaseModel):
     问题: str
+    对冲: Optional[bool] = None  # 是否对冲请求,不传时使用 [hedge] enabled 的全局设置
+    超时: Optional[Union[float, Dict[str, float]]] = None  # 秒数(整个请求)或 {total, connect, first_byte, idle},优先于 X-Request-Timeout 请求头
+    模型: Optional[str] = None  # 模型池名(如 lite)或具体模型名,不传或为 auto 时由 [routing] 决定
+
+def 格式化尝试记录(尝试记录: List[Dict]) -> str:
+    """例如 0(error) -> 2(success, ttft 0.412s, 35 tokens, 41.3 tok/s)"""
+    def 格式化(记录: Dict) -> str:
+        详情 = [记录['status']]
+        if 记录.get('ttft') is not None:
+            详情.append(f"ttft {记录['ttft']}s")
+        if 记录.get('tokens') is not None:
+            详情.append(f"{记录['tokens']} tokens")
+        if 记录.get('tps') is not None:
+            详情.append(f"{记录['tps']} tok/s")
+        return f"{记录['index']}({', '.join(详情)})"
+    return " -> ".join(格式化(记录) for 记录 in 尝试记录) or "无"
+
+def 选中接口(尝试记录: List[Dict]):
+    """返回最终给出回答的上游索引(对冲落败者和失败的尝试不算)"""
+    for 记录 in reversed(尝试记录):
+        if 记录["status"] == "success":
+            return 记录["index"]
+    return "无"
+
+def 跳过缓存(cache_control: Optional[str], x_cache_bypass: Optional[str]) -> bool:
+    if x_cache_bypass and x_cache_bypass.lower() not in ("0", "false", "no"):
+        return True
+    return bool(cache_control) and "no-cache" in cache_control.lower()
+
+def 解析超时(x_request_timeout: Optional[str], 请求体超时: Any = None) -> Timeouts:
+    """请求指定的超时:请求体字段优先,其次是 X-Request-Timeout 请求头(如 "30" 或 "total=30,first_byte=5,idle=10")"""
+    try:
+        return Timeouts.parse(请求体超时 if 请求体超时 is not None else x_request_timeout)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def 识别调用方(http_request: Request) -> Optional[str]:
+    """[fairness] 启用时按请求头识别调用方,返回 [[tenant]] 名称或 anonymous;要求 key 而未通过时返回 401"""
+    if not 公平配置.enabled:
+        return None
+    try:
+        return 调用方登记表.identify(http_request.headers)
+    except TenantRejected as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+async def 客户端断开时取消(http_request: Request, 可等待对象: Awaitable) -> Any:
+    """等待可等待对象完成;客户端先断开时立即取消它并抛出 ClientDisconnect
+
+    非流式接口,以及流式接口返回响应之前等待首个增量时,Starlette 不会察觉客户端断开,
+    这里同时监听 http.disconnect,免得客户端已经放弃后仍把上游的回答完整读完。
+    """
+    任务 = asyncio.ensure_future(可等待对象)
+
+    async def 等待断开():
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+
+    监听 = asyncio.ensure_future(等待断开())
+    try:
+        await asyncio.wait((任务, 监听), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        监听.cancel()
+        if not 任务.done():
+            任务.cancel()
+            await asyncio.wait((任务,))
+    if 任务.cancelled():
+        raise ClientDisconnect()
+    return 任务.result()
 
 @app.post("/chat")
-async def chat(request: ChatRequest, api_config: tuple = Depends(get_api_config)):
+async def chat(request: ChatRequest, http_request: Request, cache_control: Optional[str] = Header(None),
+               x_cache_bypass: Optional[str] = Header(None), x_request_timeout: Optional[str] = Header(None)):
     请求时间 = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    接口标识, 选中的配置 = api_config
+    计时 = time.perf_counter()
+    超时 = 解析超时(x_request_timeout, request.超时)
+    调用方 = 识别调用方(http_request)
     try:
-        结果 = await ai_client.async_plus_ask(选中的配置, request.问题)
+        结果, 尝试记录 = await 客户端断开时取消(http_request, 调度器.ask(
+            request.问题, hedge=request.对冲, bypass_cache=跳过缓存(cache_control, x_cache_bypass), timeouts=超时,
+            tenant=调用方, model=request.模型))
         # 记录成功的请求和响应
         logger.info(
             f"请求时间: {请求时间}\n"
-            f"接口ID: {接口标识}\n"
+            f"接口ID: {选中接口(尝试记录)}\n"
+            f"负载策略: {负载均衡器.strategy.name}\n"
+            f"尝试记录: {格式化尝试记录(尝试记录)}\n"
             f"请求内容: {request.问题}\n"
             f"响应内容: {结果}\n"
             f"状态: 成功\n"
             f"{'='*50}"
         )
-        
-        return {"data": 结果}
+        observe_route("/chat", 200, 计时)
+        return {"data": 结果, "attempts": 尝试记录}
     
+    except ClientDisconnect:
+        # 客户端已断开,上游请求已被取消;状态码只用于指标和访问日志
+        observe_route("/chat", 499, 计时)
+        logger.info(
+            f"请求时间: {请求时间}\n"
+            f"请求内容: {request.问题}\n"
+            f"状态: 客户端断开\n"
+            f"{'='*50}"
+        )
+        return Response(status_code=499)
+    except DispatchError as e:
+        observe_route("/chat", e.status_code, 计时)
+        # 记录失败的请求、每次尝试和错误信息
+        logger.error(
+            f"请求时间: {请求时间}\n"
+            f"尝试记录: {格式化尝试记录(e.attempts)}\n"
+            f"请求内容: {request.问题}\n"
+            f"错误信息: {str(e)}\n"
+            f"状态: 失败\n"
+            f"{'='*50}"
+        )
+        raise HTTPException(status_code=e.status_code, detail={"message": str(e), "attempts": e.attempts},
+                            headers=e.headers())
     except Exception as e:
+        observe_route("/chat", 500, 计时)
         # 记录失败的请求和错误信息
         logger.error(
             f"请求时间: {请求时间}\n"
@@ -67,32 +318,407 @@ async def chat(request: ChatRequest, api_config: tuple = Depends(get_api_config)
         )
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/test_all")
-async def test_all(request: ChatRequest):
-    global ai_client
-    global ai_configs
-    async def 测试单个(索引: int, 配置: dict) -> dict:
-        结果 = await ai_client.async_plus_ask(配置, request.问题)
-        return {
-            "api_index": 索引,
-            "api_url": 配置["url"],
-            "api_model": 配置["model"],
-            "test_result": 结果
-        }
-    
-    任务列表 = [测试单个(i, 配置) for i, 配置 in enumerate(ai_configs['ai'])]
+def 编码流式事件(格式: str, 数据: dict, 事件: str = None) -> str:
+    内容 = json.dumps(数据, ensure_ascii=False)
+    if 格式 == "ndjson":
+        return 内容 + "\n"
+    return (f"event: {事件}\n" if 事件 else "") + f"data: {内容}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, 格式: str = Query("sse", pattern="^(sse|ndjson)$"),
+                      x_request_timeout: Optional[str] = Header(None)):
+    请求时间 = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     开始时间 = time.time()
-    结果 = await asyncio.gather(*任务列表)
-    总用时 = time.time() - 开始时间
+    计时 = time.perf_counter()
+    尝试记录: List[Dict] = []
+    上游流 = 调度器.stream(request.问题, 尝试记录, hedge=request.对冲, timeouts=解析超时(x_request_timeout, request.超时),
+                          tenant=识别调用方(http_request), model=request.模型)
+    # 先取到第一个增量再返回响应,这样首字节前的失败(含重试耗尽)仍能以正确的状态码返回
+    try:
+        首个增量 = await 客户端断开时取消(http_request, 上游流.__anext__())
+    except StopAsyncIteration:
+        首个增量 = None
+    except ClientDisconnect:
+        await 上游流.aclose()
+        observe_route("/chat/stream", 499, 计时)
+        return Response(status_code=499)
+    except DispatchError as e:
+        observe_route("/chat/stream", e.status_code, 计时)
+        logger.error(
+            f"请求时间: {请求时间}\n"
+            f"尝试记录: {格式化尝试记录(e.attempts)}\n"
+            f"请求内容: {request.问题}\n"
+            f"错误信息: {str(e)}\n"
+            f"状态: 失败\n"
+            f"{'='*50}"
+        )
+        raise HTTPException(status_code=e.status_code, detail={"message": str(e), "attempts": e.attempts},
+                            headers=e.headers())
 
-    return {
-        "总用时": round(总用时, 2),
-        "接口数量": len(ai_configs['ai']),
-        "详细结果": sorted(结果, key=lambda x: x["test_result"]["time"])
-    }
+    async def 转发上游():
+        片段列表 = []
+        状态 = "成功"
+        try:
+            if 首个增量 is not None:
+                片段列表.append(首个增量)
+                yield 编码流式事件(格式, {"delta": 首个增量})
+            async for 片段 in 上游流:
+                片段列表.append(片段)
+                yield 编码流式事件(格式, {"delta": 片段})
+            yield 编码流式事件(格式, {"done": True, "接口ID": 选中接口(尝试记录),
+                                      "time": round(time.time() - 开始时间, 2), "attempts": 尝试记录})
+            if 格式 == "sse":
+                yield "data: [DONE]\n\n"
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开:关闭上游流,不再继续读取和解析
+            状态 = "客户端断开"
+            raise
+        except Exception as e:
+            状态 = f"失败: {e}"
+            yield 编码流式事件(格式, {"error": str(e)}, 事件="error")
+        finally:
+            await 上游流.aclose()
+            observe_route("/chat/stream", 200 if 状态 == "成功" else 499 if 状态 == "客户端断开" else 502, 计时)
+            完整响应 = "".join(片段列表)
+            logger.info(
+                f"请求时间: {请求时间}\n"
+                f"接口ID: {选中接口(尝试记录)}\n"
+                f"负载策略: {负载均衡器.strategy.name}\n"
+                f"尝试记录: {格式化尝试记录(尝试记录)}\n"
+                f"请求内容: {request.问题}\n"
+                f"响应内容: {完整响应}\n"
+                f"状态: {状态}\n"
+                f"{'='*50}"
+            )
 
-if __name__ == '__main__':
-    import uvicorn
-    if sys.platform.startswith('win'):
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    媒体类型 = "application/x-ndjson" if 格式 == "ndjson" else "text/event-stream"
+    return StreamingResponse(转发上游(), media_type=媒体类型, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def 最终模型(尝试记录: List[Dict]) -> str:
+    for 记录 in reversed(尝试记录):
+        if 记录["status"] == "success":
+            return 记录["model"]
+    return ""
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    """OpenAI 兼容接口:接受完整的 messages 和采样参数,经负载均衡器转发
+
+    流式请求把上游的 SSE 字节原样转发给客户端,只窥视事件用于指标和日志;
+    非流式请求汇总回答,返回标准的 chat.completion 结构(含 usage)。
+    请求中的 model 为模型池名或已配置的模型名时按它路由,其他值(客户端默认的模型名)由 [routing] 决定。
+    """
+    请求时间 = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    计时 = time.perf_counter()
+    try:
+        载荷, 流式 = parse_chat_completion(json.loads(await request.body()))
+        载荷 = replace(载荷, timeouts=Timeouts.parse(request.headers.get("x-request-timeout")),
+                       tenant=调用方登记表.identify(request.headers) if 公平配置.enabled else None,
+                       model=载荷.model if 模型路由.knows(载荷.model) else None)
+    except ValueError as e:
+        observe_route("/v1/chat/completions", 400, 计时)
+        return error_response(str(e), 400)
+    except TenantRejected as e:
+        observe_route("/v1/chat/completions", 401, 计时)
+        return error_response(str(e), 401)
+    请求内容 = json.dumps(载荷.messages, ensure_ascii=False)
+    尝试记录: List[Dict] = []
+    上游流 = 调度器.relay(载荷, 尝试记录)
+    # 先取到第一块再返回响应,这样首字节前的失败(含重试耗尽)仍能以正确的状态码返回
+    try:
+        首块 = await 客户端断开时取消(request, 上游流.__anext__())
+    except StopAsyncIteration:
+        首块 = None
+    except ClientDisconnect:
+        await 上游流.aclose()
+        observe_route("/v1/chat/completions", 499, 计时)
+        return Response(status_code=499)
+    except DispatchError as e:
+        observe_route("/v1/chat/completions", e.status_code, 计时)
+        logger.error(
+            f"请求时间: {请求时间}\n"
+            f"尝试记录: {格式化尝试记录(e.attempts)}\n"
+            f"请求内容: {请求内容}\n"
+            f"错误信息: {str(e)}\n"
+            f"状态: 失败\n"
+            f"{'='*50}"
+        )
+        return error_response(str(e), e.status_code, e.headers())
+
+    片段列表 = []
+    用量 = None
+    结束原因 = None
+
+    def 窥视(块) -> None:
+        nonlocal 用量, 结束原因
+        if 块.text:
+            片段列表.append(块.text)
+        用量 = 块.usage or 用量
+        结束原因 = 块.finish_reason or 结束原因
+
+    def 记录日志(状态: str) -> None:
+        logger.info(
+            f"请求时间: {请求时间}\n"
+            f"接口ID: {选中接口(尝试记录)}\n"
+            f"负载策略: {负载均衡器.strategy.name}\n"
+            f"尝试记录: {格式化尝试记录(尝试记录)}\n"
+            f"请求内容: {请求内容}\n"
+            f"响应内容: {''.join(片段列表)}\n"
+            f"用量: {用量}\n"
+            f"状态: {状态}\n"
+            f"{'='*50}"
+        )
+
+    if not 流式:
+        async def 读完():
+            if 首块 is not None:
+                窥视(首块)
+                async for 块 in 上游流:
+                    窥视(块)
+
+        try:
+            await 客户端断开时取消(request, 读完())
+        except ClientDisconnect:
+            observe_route("/v1/chat/completions", 499, 计时)
+            记录日志("客户端断开")
+            return Response(status_code=499)
+        except (DispatchError, UpstreamError) as e:
+            状态码 = getattr(e, "status_code", 502)
+            observe_route("/v1/chat/completions", 状态码, 计时)
+            记录日志(f"失败: {e}")
+            return error_response(str(e), 状态码)
+        finally:
+            await 上游流.aclose()
+        observe_route("/v1/chat/completions", 200, 计时)
+        记录日志("成功")
+        return completion_response("".join(片段列表), 最终模型(尝试记录), 结束原因, 用量)
+
+    async def 转发上游():
+        状态 = "成功"
+        try:
+            if 首块 is not None:
+                窥视(首块)
+                yield 首块.raw
+            async for 块 in 上游流:
+                窥视(块)
+                yield 块.raw
+        except (asyncio.CancelledError, GeneratorExit):
+            状态 = "客户端断开"
+            raise
+        except Exception as e:
+            状态 = f"失败: {e}"
+            yield error_event(str(e))
+        finally:
+            await 上游流.aclose()
+            observe_route("/v1/chat/completions", 200 if 状态 == "成功" else 499 if 状态 == "客户端断开" else 502, 计时)
+            记录日志(状态)
+
+    return StreamingResponse(转发上游(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def 批次结果流(批次, offset: int = 0, 开头: Optional[dict] = None):
+    """以 NDJSON 逐行输出批次结果(按完成顺序),最后一行为进度汇总;客户端断开不影响批次继续执行"""
+    async def 生成():
+        if 开头 is not None:
+            yield json.dumps(开头, ensure_ascii=False) + "\n"
+        async for 结果 in 批次.stream(offset):
+            yield json.dumps(结果, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, **批次.progress()}, ensure_ascii=False) + "\n"
+    return StreamingResponse(生成(), media_type="application/x-ndjson",
+                             headers={"X-Batch-Id": 批次.id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/chat/batch")
+async def chat_batch(request: Request):
+    """批量提问:请求体为 {"问题列表": [...]},或直接上传 JSONL 文件(每行一个问题)
+
+    例: curl -X POST localhost:5000/chat/batch -H "Content-Type: application/x-ndjson" --data-binary @问题.jsonl
+    """
+    计时 = time.perf_counter()
+    try:
+        问题列表 = parse_batch_input(await request.body(), request.headers.get("content-type", ""))
+        批次 = 批处理.submit(问题列表, 识别调用方(request))
+    except BatchRejected as e:
+        observe_route("/chat/batch", e.status_code, 计时)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    observe_route("/chat/batch", 200, 计时)
+    logger.info(
+        f"请求时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"批次ID: {批次.id}\n"
+        f"问题数: {len(问题列表)}\n"
+        f"{'='*50}"
+    )
+    批次.task.add_done_callback(lambda _: logger.info(f"批次完成: {批次.progress()}\n{'='*50}"))
+    return 批次结果流(批次, 开头={"batch_id": 批次.id, "total": len(问题列表)})
+
+def 查找批次(batch_id: str):
+    批次 = 批处理.get(batch_id)
+    if 批次 is None:
+        raise HTTPException(status_code=404, detail=f"批次不存在或已过期: {batch_id}")
+    return 批次
+
+@app.get("/chat/batch/{batch_id}")
+async def batch_progress(batch_id: str):
+    return {"data": 查找批次(batch_id).progress()}
+
+@app.get("/chat/batch/{batch_id}/results")
+async def batch_results(batch_id: str, offset: int = Query(0, ge=0)):
+    """断线续传:offset 为已经收到的结果条数(即下一条的 seq)"""
+    return 批次结果流(查找批次(batch_id), offset)
+
+@app.delete("/chat/batch/{batch_id}")
+async def batch_cancel(batch_id: str):
+    查找批次(batch_id)
+    return {"data": 批处理.cancel(batch_id).progress()}
+
+@app.api_route("/test_all", methods=["GET", "POST"])
+async def test_all(live: bool = Query(False), request: Optional[ChatRequest] = Body(None)):
+    """上游记分板:默认立即返回后台探测的最近结果(耗时、首token延迟、状态、最近的错误、成功率)
+
+    live=1 时立即探测一轮,以 NDJSON 按完成顺序逐行返回每个上游的结果,最后一行为汇总;
+    POST 请求体中的 问题 只在 live 探测时使用,代替 [probe] 配置的探测提问。
+    """
+    计时 = time.perf_counter()
+    if not live:
+        observe_route("/test_all", 200, 计时)
+        return 探测器.scoreboard()
+
+    问题 = request.问题 if request is not None else None
+
+    async def 逐个返回():
+        开始时间 = time.time()
+        数量 = 0
+        状态码 = 200
+        try:
+            async for 行 in 探测器.probe_all(问题):
+                数量 += 1
+                yield json.dumps(行, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "总用时": round(time.time() - 开始时间, 2), "接口数量": 数量},
+                             ensure_ascii=False) + "\n"
+        except (asyncio.CancelledError, GeneratorExit):
+            状态码 = 499
+            raise
+        finally:
+            observe_route("/test_all", 状态码, 计时)
+
+    return StreamingResponse(逐个返回(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def 上游状态指标():
+    """抓取 /metrics 时生成熔断器状态和负载均衡在途数"""
+    yield "# HELP ai_breaker_open Whether the upstream circuit breaker is open (1) or half-open (0.5)"
+    yield "# TYPE ai_breaker_open gauge"
+    for 上游 in 负载均衡器.upstreams:
+        状态值 = {"open": 1, "half_open": 0.5}.get(上游.breaker.state, 0)
+        yield f'ai_breaker_open{{upstream="{上游.index}",model="{上游.config.model}"}} {状态值}'
+    yield "# HELP ai_balancer_in_flight Requests the balancer has outstanding per upstream"
+    yield "# TYPE ai_balancer_in_flight gauge"
+    for 上游 in 负载均衡器.upstreams:
+        yield f'ai_balancer_in_flight{{upstream="{上游.index}",model="{上游.config.model}"}} {上游.stats.in_flight}'
+
+REGISTRY.add_collector(上游状态指标)
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/upstreams")
+async def upstream_stats():
+    return {"data": 负载均衡器.stats()}
+
+@app.post("/admin/reload")
+async def reload_config():
+    """重新读取配置文件中的 [[ai]] 列表;多进程部署时其他进程在下一次心跳时跟随重新读取"""
+    try:
+        变更 = await 重新加载上游配置()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if 共享状态 is not None:
+        共享状态.announce_reload()
+    return {"data": 变更}
+
+@app.put("/admin/upstreams")
+async def replace_upstreams(上游列表: List[Dict] = Body(..., embed=True, alias="ai")):
+    """用请求体中的 ai 列表替换上游配置并写回配置文件(配置文件中的注释会丢失)
+
+    多进程部署时其他进程在下一次心跳时从配置文件读取新的列表。
+    值为 null 的字段视为未设置(toml 没有 null),不写入配置文件。
+    """
+    上游列表 = [{k: v for k, v in 条目.items() if v is not None} for 条目 in 上游列表]
+    async with 重载锁:
+        try:
+            上游配置 = 解析上游配置(上游列表)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        新配置 = {**ai_configs, 'ai': 上游列表}
+        try:
+            await asyncio.to_thread(配置类.写入toml文件, 配置文件路径, 新配置)
+        except TypeError as e:
+            raise HTTPException(status_code=400, detail=f"上游配置无法写入配置文件: {e}")
+        ai_configs['ai'] = 上游列表
+        变更 = await 应用上游配置(上游配置)
+    if 共享状态 is not None:
+        共享状态.announce_reload()
+    return {"data": 变更}
+
+@app.get("/admin/tenants")
+async def tenant_stats():
+    """每个调用方的权重、并发配额、在途和排队数、排队时间分位数和最近窗口内的吞吐"""
+    if not 公平配置.enabled:
+        return {"data": {"enabled": False}}
+    return {"data": {
+        "enabled": True,
+        "header": 公平配置.header,
+        "require_key": 公平配置.require_key,
+        "window": 公平配置.window,
+        "tenants": 准入控制.tenant_stats() if 准入控制 is not None else {},
+    }}
+
+@app.get("/admin/pools")
+async def pool_stats():
+    """各模型池的上游、策略和 fallback 顺序,以及按池和路由原因统计的请求数、改用 fallback 池的次数"""
+    return {"data": 模型路由.stats()}
+
+@app.get("/admin/throughput")
+async def throughput_stats():
+    """每个上游最近窗口内的首token延迟、解码速度中位数和累计用量"""
+    return {"data": {"strategy": 负载均衡器.strategy.name, "upstreams": 负载均衡器.throughput_stats()}}
+
+@app.get("/admin/breakers")
+async def breaker_stats():
+    return {"data": 负载均衡器.breaker_stats()}
+
+@app.get("/admin/hedging")
+async def hedge_stats():
+    return {"data": 调度器.hedge_stats()}
+
+@app.get("/admin/cache")
+async def cache_stats():
+    近似 = {"enabled": False} if 近似缓存 is None else {"enabled": True, **近似缓存.stats()}
+    if 响应缓存 is None:
+        return {"data": {"enabled": False, "approx": 近似}}
+    return {"data": {"enabled": True, **(await 响应缓存.stats()), "approx": 近似}}
+
+@app.get("/admin/admission")
+async def admission_stats():
+    if 准入控制 is None:
+        return {"data": {"enabled": False}}
+    return {"data": {"enabled": True, **准入控制.stats()}}
+
+@app.get("/admin/rate_limits")
+async def rate_limit_stats():
+    if 限流器 is None:
+        return {"data": {"enabled": False}}
+    return {"data": {"enabled": True, **限流器.stats()}}
+
+@app.get("/admin/logging")
+async def logging_stats():
+    return {"data": 日志管理器.queue_stats()}
+
+@app.get("/admin/sessions")
+async def session_stats():
+    return {"data": AIClient.session_stats()}
+
+@app.get("/admin/workers")
+async def worker_stats():
+    if 共享状态 is None:
+        return {"data": {"enabled": False, "pid": os.getpid()}}
+    return {"data": {"enabled": True, **共享状态.stats()}}
@@ -0,0 +1,81 @@
+import json
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+from AIClass import ChatPayload
+
+# 由服务器决定、不透传给上游的字段
+_SERVER_FIELDS = ("model", "messages", "stream", "stream_options")
+
+_ERROR_TYPES = {400: "invalid_request_error", 429: "rate_limit_error", 503: "overloaded_error", 504: "timeout_error"}
+
+
+def parse_chat_completion(body: Any) -> Tuple[ChatPayload, bool]:
+    """校验 OpenAI 格式的 /v1/chat/completions 请求体,返回 (载荷, 是否流式);不合法时抛出 ValueError
+
+    请求中的 model 记入载荷供模型池路由使用,发给上游的模型由选中的上游决定;
+    其余字段(temperature、max_tokens、stop、tools 等)原样透传。
+    流式请求的 stream_options 也原样透传、不额外请求用量,客户端收到的事件与直连上游一致;
+    非流式请求总是向上游请求用量,用于响应中的 usage。
+
+    Example:
+        >>> 载荷, 流式 = parse_chat_completion({"messages": [{"role": "user", "content": "你好"}], "stream": True})
+    """
+    if not isinstance(body, dict):
+        raise ValueError("请求体应为 JSON 对象")
+    消息列表 = body.get("messages")
+    if not isinstance(消息列表, list) or not 消息列表:
+        raise ValueError("messages 应为非空列表")
+    for 序号, 消息 in enumerate(消息列表):
+        if not isinstance(消息, dict) or not isinstance(消息.get("role"), str):
+            raise ValueError(f"messages[{序号}] 应为包含 role 字段的对象")
+    流式 = body.get("stream", False)
+    if not isinstance(流式, bool):
+        raise ValueError("stream 应为布尔值")
+    if not 流式 and body.get("n", 1) != 1:
+        raise ValueError("非流式请求暂不支持 n > 1")
+    参数 = {k: v for k, v in body.items() if k not in _SERVER_FIELDS}
+    if 流式 and "stream_options" in body:
+        参数["stream_options"] = body["stream_options"]
+    模型 = body.get("model")
+    if 模型 is not None and not isinstance(模型, str):
+        raise ValueError("model 应为字符串")
+    return ChatPayload(消息列表, 参数, raw=True, include_usage=not 流式, model=模型), 流式
+
+
+def completion_response(text: str, model: str, finish_reason: Optional[str] = None,
+                        usage: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """非流式响应(chat.completion);上游没有返回用量时 usage 为 None"""
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": finish_reason or "stop",
+        }],
+        "usage": usage,
+    }
+
+
+def error_body(message: str, status_code: int) -> Dict[str, Any]:
+    return {"error": {
+        "message": message,
+        "type": _ERROR_TYPES.get(status_code, "api_error"),
+        "code": status_code,
+    }}
+
+
+def error_response(message: str, status_code: int, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    """OpenAI 格式的错误响应,兼容按 error.message 读取错误的客户端"""
+    return JSONResponse(error_body(message, status_code), status_code=status_code, headers=headers)
+
+
+def error_event(message: str, status_code: int = 502) -> bytes:
+    """已经开始转发后出错时,以一个 data 事件告知客户端(之后不再发送 [DONE])"""
+    return b"data: " + json.dumps(error_body(message, status_code), ensure_ascii=False).encode("utf-8") + b"\n\n"
@@ -0,0 +1,216 @@
+import json
+import logging
+import re
+from typing import Any, AsyncIterable, Dict, List, NamedTuple, Optional
+
+from 日志类 import LogThrottle
+
+logger = logging.getLogger(__name__)
+
+try:  # orjson 可选,安装后解码快数倍,未安装时回退到标准库
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+_CONTENT_KEY = b'"content"'
+_CONTENT_STRINGS = (b'"content":"', b'"content": "')
+_USAGE_OBJECTS = (b'"usage":{', b'"usage": {')
+_FINISH_REASON = re.compile(rb'"finish_reason"\s*:\s*"([^"]*)"')
+_DONE = b"[DONE]"
+_PARSE_ERROR_LOG = LogThrottle(60)  # 上游持续返回坏数据时,解析错误最多每分钟记录一次
+
+
+class SSEParser:
+    """增量式 SSE 解析器,直接处理字节块
+
+    网络分块可以在任意位置切开(包括一行中间或多字节字符中间),未完整的行留在缓冲区里等下一块;
+    同一事件的多个 data: 行按规范用换行连接,遇到空行时产出该事件的数据。
+    只支持 \\n 和 \\r\\n 换行,不支持单独的 \\r。
+
+    Example:
+        >>> parser = SSEParser()
+        >>> parser.feed(b'data: {"a"')
+        []
+        >>> parser.feed(b': 1}\\n\\n')
+        [b'{"a": 1}']
+    """
+    __slots__ = ("_buffer", "_data")
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """输入一个字节块,返回本次完整到达的事件数据列表"""
+        self._buffer += chunk
+        结尾 = self._buffer.rfind(b"\n")
+        if 结尾 < 0:
+            return []
+        行列表 = bytes(self._buffer[:结尾]).split(b"\n")
+        del self._buffer[:结尾 + 1]
+        return self._parse_lines(行列表)
+
+    def flush(self) -> List[bytes]:
+        """流结束时调用,产出缓冲区中最后一个没有以空行结尾的事件"""
+        行列表 = [bytes(self._buffer)] if self._buffer else []
+        self._buffer.clear()
+        事件列表 = self._parse_lines(行列表)
+        if self._data:
+            事件列表.append(b"\n".join(self._data))
+            self._data = []
+        return 事件列表
+
+    def _parse_lines(self, lines: List[bytes]) -> List[bytes]:
+        事件列表 = []
+        数据 = self._data
+        for 行 in lines:
+            if 行[-1:] == b"\r":
+                行 = 行[:-1]
+            if not 行:
+                if 数据:
+                    事件列表.append(数据[0] if len(数据) == 1 else b"\n".join(数据))
+                    数据 = []
+            elif 行.startswith(b"data:"):
+                数据.append(行[6:] if 行[5:6] == b" " else 行[5:])
+            # 注释行(:开头)和 event/id/retry 字段不影响回答内容,直接跳过
+        self._data = 数据
+        return 事件列表
+
+
+def extract_content(data: bytes) -> Optional[str]:
+    """从一个 chat.completion.chunk 事件中取出 delta.content
+
+    不含 "content" 字段的事件(角色、结束原因、心跳、[DONE])不做 JSON 解码直接跳过;
+    事件中只有一个 "content" 字段且其值不含转义时,直接切出字符串的字节解码,不构造整个 JSON 对象。
+    解码失败时抛出 ValueError;多行数据整体解码失败时逐行重试,兼容不发送空行分隔的上游。
+    """
+    位置 = data.find(_CONTENT_KEY)
+    if 位置 < 0 or data == _DONE:
+        return None
+    for 前缀 in _CONTENT_STRINGS:
+        if data.startswith(前缀, 位置):
+            if data.find(_CONTENT_KEY, 位置 + len(前缀)) >= 0:
+                break
+            开始 = 位置 + len(前缀)
+            结束 = data.find(b'"', 开始)
+            if 结束 >= 0 and data.find(b"\\", 开始, 结束) < 0:
+                return data[开始:结束].decode("utf-8") or None
+            break
+    try:
+        事件 = _loads(data)
+    except ValueError:
+        if b"\n" not in data:
+            raise
+        内容列表 = [extract_content(行) for 行 in data.split(b"\n")]
+        return "".join(内容 for 内容 in 内容列表 if 内容) or None
+    try:
+        return 事件["choices"][0]["delta"].get("content") or None
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def extract_finish_reason(data: bytes) -> Optional[str]:
+    """取出事件中的 finish_reason(stop、length、tool_calls 等),普通增量事件中为 null 时返回 None"""
+    if b'"finish_reason"' not in data:
+        return None
+    匹配 = _FINISH_REASON.search(data)
+    return 匹配.group(1).decode("utf-8") if 匹配 else None
+
+
+def extract_usage(data: bytes) -> Optional[Dict[str, Any]]:
+    """取出事件中的 usage 对象(开启 stream_options.include_usage 后由最后一个事件携带)
+
+    普通增量事件中的 "usage":null 不做 JSON 解码直接跳过。
+    """
+    if not any(键 in data for 键 in _USAGE_OBJECTS):
+        return None
+    try:
+        事件 = _loads(data)
+    except ValueError:
+        return None
+    用量 = 事件.get("usage") if isinstance(事件, dict) else None
+    return 用量 if isinstance(用量, dict) else None
+
+
+async def iter_content(chunks: AsyncIterable[bytes], usage: Optional[Dict[str, Any]] = None) -> AsyncIterable[str]:
+    """把上游的字节块流转换为回答增量流;传入 usage 字典时,把流中的用量数据写入其中"""
+    parser = SSEParser()
+    async for chunk in chunks:
+        for 数据 in parser.feed(chunk):
+            内容 = _safe_extract(数据)
+            if 内容:
+                yield 内容
+            if usage is not None:
+                _update_usage(usage, 数据)
+    for 数据 in parser.flush():
+        内容 = _safe_extract(数据)
+        if 内容:
+            yield 内容
+        if usage is not None:
+            _update_usage(usage, 数据)
+
+
+class RelayChunk(NamedTuple):
+    """原样转发的一段上游字节,附带从中窥视到的信息(供指标、日志和非流式响应使用)"""
+    raw: bytes
+    text: str = ""                          # 其中各事件的回答增量拼接
+    deltas: int = 0                         # 其中含回答增量的事件数
+    finish_reason: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+
+
+async def iter_relay(chunks: AsyncIterable[bytes], usage: Optional[Dict[str, Any]] = None) -> AsyncIterable[RelayChunk]:
+    """原样产出上游的字节块,不重新编码;只窥视其中的事件以取得回答文本、结束原因和用量
+
+    首个含回答增量(或结束原因)的事件到达之前的字节块(角色事件、心跳注释等)先暂存,
+    与该事件所在的块合并产出,因此第一次产出即代表首token到达,在此之前的失败仍可换上游重试。
+    传入 usage 字典时,把流中的用量数据写入其中。
+    """
+    parser = SSEParser()
+    暂存: List[bytes] = []
+    已开始 = False
+
+    def 窥视(raw: bytes, 事件列表: List[bytes]) -> RelayChunk:
+        文本列表 = []
+        结束原因 = 用量 = None
+        for 数据 in 事件列表:
+            内容 = _safe_extract(数据)
+            if 内容:
+                文本列表.append(内容)
+            结束原因 = extract_finish_reason(数据) or 结束原因
+            用量 = extract_usage(数据) or 用量
+        if 用量 and usage is not None:
+            usage.update(用量)
+        return RelayChunk(raw, "".join(文本列表), len(文本列表), 结束原因, 用量)
+
+    async for chunk in chunks:
+        块 = 窥视(chunk, parser.feed(chunk))
+        if not 已开始:
+            暂存.append(chunk)
+            if not 块.deltas and 块.finish_reason is None:
+                continue
+            已开始 = True
+            块 = 块._replace(raw=b"".join(暂存))
+            暂存 = []
+        yield 块
+    块 = 窥视(b"".join(暂存), parser.flush())
+    if 块.raw or 块.deltas or 块.finish_reason or 块.usage:
+        yield 块
+
+
+def _update_usage(usage: Dict[str, Any], data: bytes) -> None:
+    用量 = extract_usage(data)
+    if 用量:
+        usage.update(用量)
+
+
+def _safe_extract(data: bytes) -> Optional[str]:
+    try:
+        return extract_content(data)
+    except ValueError:
+        被压下 = _PARSE_ERROR_LOG.allow()
+        if 被压下 is not None:
+            logger.warning(f"JSON解析错误: {data[:200]!r}" + (f"(此前另有 {被压下} 条未记录)" if 被压下 else ""))
+        return None
@@ -0,0 +1,45 @@
+"""测试共用的工具:在当前事件循环中启动 基准测试/模拟上游.py 的模拟上游"""
+import argparse
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Tuple
+
+import pytest
+from aiohttp import web
+
+from AIClass import AIClient, AIConfig
+from 模拟上游 import 模拟上游
+
+
+def 模拟参数(**overrides) -> argparse.Namespace:
+    """模拟上游的命令行参数;默认立即回答 3 个token、不注入错误"""
+    参数 = dict(ttft_ms=0, ttft_dist="fixed", ttft_sigma=0.5, token_rate=0, tokens_min=3, tokens_max=3,
+                error_rate=0.0, rate_limit_rate=0.0, retry_after=1, abort_rate=0.0, seed=0)
+    参数.update(overrides)
+    return argparse.Namespace(**参数)
+
+
+@asynccontextmanager
+async def 启动模拟上游(**overrides) -> AsyncIterator[Tuple[str, 模拟上游]]:
+    """在随机端口启动模拟上游,返回 (接口地址, 模拟上游);退出时关闭上游和 AIClient 的会话"""
+    上游 = 模拟上游(模拟参数(**overrides))
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", 上游.chat)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    站点 = web.TCPSite(runner, "127.0.0.1", 0)
+    await 站点.start()
+    端口 = 站点._server.sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{端口}/v1/chat/completions", 上游
+    finally:
+        await AIClient.shutdown()
+        await runner.cleanup()
+
+
+def 上游配置(url: str, count: int = 3, **fields) -> List[AIConfig]:
+    return [AIConfig(url=url, key="sk-test", model=f"mock-{i}", **fields) for i in range(count)]
+
+
+@pytest.fixture
+def mock_upstream():
+    return 启动模拟上游
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+
+import pytest
+
+from conftest import 启动模拟上游, 上游配置
+from AIClass import AIClient, AIConfig, ChatPayload, Timeouts, UpstreamError
+
+
+def test_同一主机复用会话和连接():
+    async def 运行():
+        async with 启动模拟上游() as (url, 上游):
+            配置 = 上游配置(url, count=2)
+            回答 = [await AIClient.async_normal_ask(配置[i % 2], "你好") for i in range(3)]
+            主机 = AIClient._host_key(url)
+            return 回答, len([键 for 键 in AIClient._sessions if 键 == 主机]), AIClient.session_stats()[主机]
+
+    回答, 会话数, 统计 = asyncio.run(运行())
+    assert all(回答)
+    assert 会话数 == 1
+    assert 统计["requests"] == 3
+    assert 统计["connections_created"] == 1
+    assert 统计["connections_reused"] == 2
+
+
+def test_主机键补全默认端口():
+    assert AIClient._host_key("https://api.example.com/v1/chat/completions") == "https://api.example.com:443"
+    assert AIClient._host_key("http://127.0.0.1:8999/v1") == "http://127.0.0.1:8999"
+
+
+def test_关闭后重新创建会话():
+    async def 运行():
+        async with 启动模拟上游() as (url, _):
+            await AIClient.startup(urls=[url])
+            旧会话 = AIClient._get_session(url)
+            await AIClient.shutdown()
+            return 旧会话, AIClient._get_session(url)
+
+    旧会话, 新会话 = asyncio.run(运行())
+    assert 旧会话.closed
+    assert 新会话 is not 旧会话
+
+
+def test_上游错误可重试并带等待时间():
+    async def 运行():
+        async with 启动模拟上游(rate_limit_rate=1.0, retry_after=7) as (url, _):
+            with pytest.raises(UpstreamError) as 错误:
+                await AIClient.async_normal_ask(上游配置(url, count=1)[0], "你好")
+            return 错误.value
+
+    错误 = asyncio.run(运行())
+    assert (错误.status, 错误.retryable, 错误.retry_after) == (429, True, 7.0)
+
+
+def test_测试接口失败时返回错误并记录日志(caplog):
+    async def 运行():
+        # 没有服务监听的端口:连接失败
+        return await AIClient.async_plus_ask(AIConfig(url="http://127.0.0.1:9/v1/chat/completions", key="k", model="m"),
+                                             "你好")
+
+    with caplog.at_level(logging.WARNING, logger="AIClass"):
+        结果 = asyncio.run(运行())
+    asyncio.run(AIClient.shutdown())
+    assert 结果["status"] == "error"
+    assert any("测试接口出错" in 记录.getMessage() for 记录 in caplog.records)
+
+
+@pytest.mark.parametrize("值, 结果", [
+    (None, Timeouts()),
+    ("30", Timeouts(total=30.0)),
+    (12, Timeouts(total=12.0)),
+    ("total=30; first_byte=5, idle=10", Timeouts(total=30.0, first_byte=5.0, idle=10.0)),
+    ({"connect": 2}, Timeouts(connect=2.0)),
+])
+def test_解析请求指定的超时(值, 结果):
+    assert Timeouts.parse(值) == 结果
+
+
+@pytest.mark.parametrize("值", ["abc", "total=", "speed=3", "-1", {"idle": True}, {"total": 0}])
+def test_不合法的超时(值):
+    with pytest.raises(ValueError):
+        Timeouts.parse(值)
+
+
+def test_各阶段超时按请求上游默认值的顺序取值():
+    配置 = AIConfig(url="http://127.0.0.1:9/v1", key="k", model="m", first_byte_timeout=20)
+    默认 = AIClient._http_config
+    assert AIClient._phase_timeouts(配置) == (默认.connect_timeout, 20, 默认.idle_timeout)
+    assert AIClient._phase_timeouts(配置, Timeouts(connect=1, first_byte=2, idle=3)) == (1, 2, 3)
+
+
+def 流式调用(配置: AIConfig, timeouts: Timeouts):
+    async def 读取():
+        载荷 = ChatPayload.from_question("你好", timeouts=timeouts)
+        return [增量 async for 增量 in AIClient.async_stream_chat(配置, 载荷)]
+    return 读取()
+
+
+def test_首字节超时可换上游重试():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=500) as (url, _):
+            with pytest.raises(UpstreamError) as 错误:
+                await 流式调用(上游配置(url, count=1)[0], Timeouts(first_byte=0.1))
+            return 错误.value
+
+    错误 = asyncio.run(运行())
+    assert (错误.timed_out, 错误.retryable) == (True, True)
+    assert "0.1 秒内没有返回" in str(错误)
+
+
+def test_产出增量后的空闲超时不可重试():
+    async def 运行():
+        async with 启动模拟上游(token_rate=2) as (url, _):
+            with pytest.raises(UpstreamError) as 错误:
+                await 流式调用(上游配置(url, count=1)[0], Timeouts(idle=0.1))
+            return 错误.value
+
+    错误 = asyncio.run(运行())
+    assert (错误.timed_out, 错误.retryable) == (True, False)
+    assert "没有返回新的数据" in str(错误)
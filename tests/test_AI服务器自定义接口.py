@@ -0,0 +1,207 @@
+"""服务器接口测试:以临时配置导入服务器,上游换成模拟上游,通过 ASGI 直接调用接口"""
+import asyncio
+import importlib
+import json
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import pytest
+
+from conftest import 启动模拟上游
+
+httpx = pytest.importorskip("httpx")
+
+临时配置 = """
+[reload]
+watch = false
+
+[cache]
+enabled = false
+
+[retry]
+max_attempts = 3
+deadline = 10
+
+[[ai]]
+url = "http://127.0.0.1:9/v1/chat/completions"
+key = "sk-test"
+model = "placeholder"
+"""
+
+
+@pytest.fixture(scope="module")
+def 服务器(tmp_path_factory):
+    配置文件 = tmp_path_factory.mktemp("server") / "ai_configs.toml"
+    配置文件.write_text(临时配置, encoding="utf-8")
+    原环境 = {键: os.environ.get(键) for 键 in ("AI_CONFIGS", "AI_SERVER_WORKERS")}
+    os.environ["AI_CONFIGS"] = str(配置文件)
+    os.environ.pop("AI_SERVER_WORKERS", None)
+    sys.modules.pop("AI服务器自定义接口", None)
+    try:
+        yield importlib.import_module("AI服务器自定义接口")
+    finally:
+        sys.modules.pop("AI服务器自定义接口", None)
+        for 键, 值 in 原环境.items():
+            if 值 is None:
+                os.environ.pop(键, None)
+            else:
+                os.environ[键] = 值
+
+
+@asynccontextmanager
+async def 接口客户端(服务器, count: int = 2, **overrides):
+    """启动模拟上游并把服务器的上游换成它,返回 (客户端, 模拟上游)"""
+    async with 启动模拟上游(**overrides) as (url, 上游):
+        上游列表 = [{"url": url, "key": "sk-test", "model": f"mock-{i}"} for i in range(count)]
+        await 服务器.应用上游配置(服务器.解析上游配置(上游列表))
+        async with 服务器.lifespan(服务器.app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=服务器.app), base_url="http://test",
+                                         timeout=10) as 客户端:
+                yield 客户端, 上游
+
+
+def test_流式接口以SSE逐个返回增量(服务器):
+    async def 运行():
+        async with 接口客户端(服务器, tokens_min=4, tokens_max=4) as (客户端, _):
+            响应 = await 客户端.post("/chat/stream", json={"问题": "你好"})
+            return 响应.status_code, 响应.headers["content-type"], 响应.text
+
+    状态码, 类型, 正文 = asyncio.run(运行())
+    assert 状态码 == 200
+    assert 类型.startswith("text/event-stream")
+    数据行 = [行[len("data: "):] for 行 in 正文.splitlines() if 行.startswith("data: ")]
+    assert 数据行[-1] == "[DONE]"
+    事件 = [json.loads(行) for 行 in 数据行[:-1]]
+    assert len([e for e in 事件 if "delta" in e]) == 4
+    assert 事件[-1]["done"] is True and 事件[-1]["attempts"][-1]["status"] == "success"
+
+
+def test_流式接口支持NDJSON(服务器):
+    async def 运行():
+        async with 接口客户端(服务器) as (客户端, _):
+            响应 = await 客户端.post("/chat/stream?格式=ndjson", json={"问题": "你好"})
+            return 响应.status_code, [json.loads(行) for 行 in 响应.text.splitlines() if 行]
+
+    状态码, 事件 = asyncio.run(运行())
+    assert 状态码 == 200
+    assert "".join(e.get("delta", "") for e in 事件)
+    assert 事件[-1]["done"] is True
+
+
+def test_首个增量之前全部失败时返回错误状态码(服务器):
+    async def 运行():
+        async with 接口客户端(服务器, error_rate=1.0) as (客户端, 上游):
+            响应 = await 客户端.post("/chat/stream", json={"问题": "你好"})
+            return 响应.status_code, 响应.json(), 上游.统计["requests"]
+
+    状态码, 正文, 请求数 = asyncio.run(运行())
+    assert 状态码 == 502
+    assert len(正文["detail"]["attempts"]) == 请求数 == 2
+
+
+def test_指标接口输出请求计数和上游状态(服务器):
+    async def 运行():
+        async with 接口客户端(服务器) as (客户端, _):
+            await 客户端.post("/chat", json={"问题": "你好"})
+            响应 = await 客户端.get("/metrics")
+            return 响应.status_code, 响应.headers["content-type"], 响应.text.splitlines()
+
+    状态码, 类型, 行列表 = asyncio.run(运行())
+    assert 状态码 == 200
+    assert 类型.startswith("text/plain")
+    assert any(行.startswith('ai_http_requests_total{route="/chat",code="200"}') for 行 in 行列表)
+    assert any(行.startswith("ai_breaker_open{") for 行 in 行列表)
+    assert "# TYPE ai_upstream_ttft_seconds histogram" in 行列表
+
+
+def test_替换上游列表并写回配置文件(服务器):
+    async def 运行():
+        async with 接口客户端(服务器, count=2) as (客户端, _):
+            原列表 = [{"url": 上游.config.url, "key": 上游.config.key, "model": 上游.config.model}
+                      for 上游 in 服务器.负载均衡器.upstreams]
+            不合法 = await 客户端.put("/admin/upstreams", json={"ai": [{"url": "ftp://x", "key": "k", "model": "m"}]})
+            原文件 = 服务器.配置类.读取toml文件(服务器.配置文件路径)
+            新列表 = 原列表[1:] + [{**原列表[0], "model": "mock-new", "weight": 2}]
+            响应 = await 客户端.put("/admin/upstreams", json={"ai": 新列表})
+            文件 = 服务器.配置类.读取toml文件(服务器.配置文件路径)
+            重新加载 = await 客户端.post("/admin/reload")
+            return 不合法, 原文件, 响应, 文件, 新列表, 重新加载.json()["data"]
+
+    不合法, 原文件, 响应, 文件, 新列表, 重新加载 = asyncio.run(运行())
+    assert 不合法.status_code == 400 and "第 1 个 [[ai]] 条目不合法" in 不合法.json()["detail"]
+    assert 原文件["ai"][0]["model"] == "placeholder"
+    assert 响应.status_code == 200
+    变更 = 响应.json()["data"]
+    assert len(变更["kept"]) == len(变更["added"]) == len(变更["removed"]) == 1
+    assert 文件["ai"] == 新列表 and 文件["retry"] == {"max_attempts": 3, "deadline": 10}
+    assert 重新加载 == {"added": [], "removed": [], "kept": 变更["kept"] + 变更["added"]}
+
+
+def test_替换上游列表时null字段视为未设置(服务器):
+    async def 运行():
+        async with 接口客户端(服务器, count=1) as (客户端, _):
+            上游 = 服务器.负载均衡器.upstreams[0].config
+            条目 = {"url": 上游.url, "key": 上游.key, "model": 上游.model, "max_concurrency": None, "rpm": None}
+            响应 = await 客户端.put("/admin/upstreams", json={"ai": [条目]})
+            return 响应, 服务器.配置类.读取toml文件(服务器.配置文件路径), 服务器.负载均衡器.upstreams[0].config
+
+    响应, 文件, 配置 = asyncio.run(运行())
+    assert 响应.status_code == 200
+    assert set(文件["ai"][0]) == {"url", "key", "model"}
+    assert (配置.max_concurrency, 配置.rpm) == (None, None)
+
+
+def test_OpenAI兼容接口非流式返回完整回答和用量(服务器):
+    async def 运行():
+        async with 接口客户端(服务器, tokens_min=4, tokens_max=4) as (客户端, _):
+            响应 = await 客户端.post("/v1/chat/completions", json={
+                "model": "gpt-4o", "messages": [{"role": "user", "content": "你好"}], "temperature": 0})
+            return 响应.status_code, 响应.json()
+
+    状态码, 正文 = asyncio.run(运行())
+    assert 状态码 == 200
+    assert 正文["object"] == "chat.completion" and 正文["model"].startswith("mock-")
+    assert len(正文["choices"][0]["message"]["content"]) == 4
+    assert 正文["usage"]["completion_tokens"] == 4
+
+
+def test_OpenAI兼容接口流式原样转发上游事件(服务器):
+    async def 运行():
+        async with 接口客户端(服务器, tokens_min=3, tokens_max=3) as (客户端, _):
+            响应 = await 客户端.post("/v1/chat/completions", json={
+                "messages": [{"role": "user", "content": "你好"}], "stream": True})
+            return 响应.status_code, 响应.text
+
+    状态码, 正文 = asyncio.run(运行())
+    assert 状态码 == 200
+    数据行 = [行[len("data: "):] for 行 in 正文.splitlines() if 行.startswith("data: ")]
+    assert 数据行[-1] == "[DONE]"
+    事件 = [json.loads(行) for 行 in 数据行[:-1]]
+    assert all(e["object"] == "chat.completion.chunk" for e in 事件)
+    assert 事件[0]["choices"][0]["delta"]["role"] == "assistant"
+    assert 事件[-1]["choices"][0]["finish_reason"] == "stop"
+    assert not any("usage" in e for e in 事件)  # 客户端没有请求用量
+
+
+def test_OpenAI兼容接口以OpenAI格式返回错误(服务器):
+    async def 运行():
+        async with 接口客户端(服务器, error_rate=1.0) as (客户端, _):
+            不合法 = await 客户端.post("/v1/chat/completions", json={"messages": []})
+            失败 = await 客户端.post("/v1/chat/completions", json={"messages": [{"role": "user", "content": "x"}]})
+            return (不合法.status_code, 不合法.json()), (失败.status_code, 失败.json())
+
+    (状态码, 正文), (失败状态码, 失败正文) = asyncio.run(运行())
+    assert 状态码 == 400 and 正文["error"]["type"] == "invalid_request_error"
+    assert 失败状态码 == 502 and 失败正文["error"]["code"] == 502
+
+
+def test_请求指定的超时(服务器):
+    async def 运行():
+        async with 接口客户端(服务器, count=1, ttft_ms=1000) as (客户端, _):
+            不合法 = await 客户端.post("/chat", json={"问题": "你好"}, headers={"X-Request-Timeout": "speed=3"})
+            超时 = await 客户端.post("/chat", json={"问题": "你好", "超时": {"total": 0.2}},
+                                     headers={"X-Request-Timeout": "60"})
+            return 不合法.status_code, 超时.status_code
+
+    assert asyncio.run(运行()) == (400, 504)
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from OpenAI兼容类 import completion_response, error_body, error_event, parse_chat_completion
+
+消息 = [{"role": "system", "content": "s"}, {"role": "user", "content": "你好"}]
+
+
+def test_采样参数透传而服务器字段不透传():
+    载荷, 流式 = parse_chat_completion({"model": "lite", "messages": 消息, "temperature": 0.2,
+                                        "tools": [{"type": "function"}], "stream": False})
+    assert 流式 is False
+    assert 载荷.messages == 消息 and 载荷.model == "lite"
+    assert 载荷.params == {"temperature": 0.2, "tools": [{"type": "function"}]}
+    assert 载荷.raw is True and 载荷.include_usage is True
+
+
+def test_流式请求原样透传stream_options且不额外请求用量():
+    载荷, 流式 = parse_chat_completion({"messages": 消息, "stream": True, "n": 2,
+                                        "stream_options": {"include_usage": True}})
+    assert 流式 is True
+    assert 载荷.params == {"n": 2, "stream_options": {"include_usage": True}}
+    assert 载荷.include_usage is False and 载荷.model is None
+
+
+@pytest.mark.parametrize("请求体, 错误", [
+    ([], "JSON 对象"),
+    ({"messages": []}, "messages"),
+    ({"messages": [{"content": "x"}]}, "messages[0]"),
+    ({"messages": 消息, "stream": "yes"}, "stream"),
+    ({"messages": 消息, "n": 2}, "n > 1"),
+    ({"messages": 消息, "model": 1}, "model"),
+])
+def test_不合法的请求体(请求体, 错误):
+    with pytest.raises(ValueError, match=错误.replace("[", r"\[").replace("]", r"\]")):
+        parse_chat_completion(请求体)
+
+
+def test_非流式响应结构():
+    响应 = completion_response("回答", "mock-0", usage={"total_tokens": 3})
+    assert 响应["object"] == "chat.completion" and 响应["id"].startswith("chatcmpl-")
+    assert 响应["choices"] == [{"index": 0, "message": {"role": "assistant", "content": "回答"},
+                                "finish_reason": "stop"}]
+    assert 响应["usage"] == {"total_tokens": 3}
+    assert completion_response("", "m", "length")["choices"][0]["finish_reason"] == "length"
+
+
+def test_错误结构():
+    assert error_body("额度用尽", 429) == {"error": {"message": "额度用尽", "type": "rate_limit_error", "code": 429}}
+    assert error_body("x", 502)["error"]["type"] == "api_error"
+    事件 = error_event("中断")
+    assert 事件.startswith(b"data: ") and 事件.endswith(b"\n\n")
+    assert json.loads(事件[6:])["error"]["message"] == "中断"
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import pytest
+
+import SSE解析类
+from SSE解析类 import SSEParser, extract_content, extract_finish_reason, extract_usage, iter_content, iter_relay
+
+
+def 事件(内容=None, 结束原因=None, 用量=None) -> bytes:
+    数据 = {"choices": [{"delta": {} if 内容 is None else {"content": 内容}, "finish_reason": 结束原因}],
+            "usage": 用量}
+    return b"data: " + json.dumps(数据, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+async def 逐块(*块):
+    for 字节 in 块:
+        yield 字节
+
+
+def 收集(异步迭代):
+    async def 运行():
+        return [项 async for 项 in 异步迭代]
+    return asyncio.run(运行())
+
+
+@pytest.mark.parametrize("切分", [1, 2, 3, 7, 1000])
+def test_任意位置切开的字节块解析结果相同(切分):
+    流 = 事件("你好") + ": 心跳\n\n".encode() + 事件("世界\n") + b"data: [DONE]\n\n"
+    解析器 = SSEParser()
+    结果 = []
+    for 开始 in range(0, len(流), 切分):
+        结果 += 解析器.feed(流[开始:开始 + 切分])
+    结果 += 解析器.flush()
+    assert [extract_content(数据) for 数据 in 结果] == ["你好", "世界\n", None]
+
+
+def test_多行数据和CRLF():
+    解析器 = SSEParser()
+    assert 解析器.feed(b"event: x\r\ndata: a\r\ndata:b\r\n\r\n") == [b"a\nb"]
+    assert 解析器.feed(b"data: tail") == []
+    assert 解析器.flush() == [b"tail"]
+
+
+def test_快速路径与完整解码一致():
+    assert extract_content('{"choices":[{"delta":{"content":"你"}}]}'.encode()) == "你"
+    assert extract_content(b'{"choices":[{"delta":{"content":"a\\"b\\u4e16"}}]}') == 'a"b世'
+    assert extract_content(b'{"choices":[{"delta":{"role":"assistant"}}]}') is None
+    assert extract_content(b'{"choices":[{"delta":{"content":""}}]}') is None
+    assert extract_content(b"[DONE]") is None
+    # 工具调用参数中也有 content 字段时走完整解码
+    assert extract_content(b'{"choices":[{"delta":{"content":"x","tool":{"content":"y"}}}]}') == "x"
+
+
+def test_没有空行分隔的多行数据逐行解码():
+    数据 = b'{"choices":[{"delta":{"content":"a"}}]}\n{"choices":[{"delta":{"content":"b"}}]}'
+    assert extract_content(数据) == "ab"
+
+
+def test_不合法的JSON抛出ValueError():
+    with pytest.raises(ValueError):
+        extract_content(b'{"choices": [{"delta": {"content": "x\\n", ')
+
+
+def test_流中的坏数据跳过并限频记录警告(monkeypatch, caplog):
+    monkeypatch.setattr(SSE解析类, "_PARSE_ERROR_LOG", SSE解析类.LogThrottle(60))
+    坏数据 = b'data: {"content": oops}\n\n'
+    assert 收集(iter_content(逐块(坏数据, 事件("你"), 坏数据, 坏数据))) == ["你"]
+    assert [(记录.name, 记录.levelname) for 记录 in caplog.records] == [("SSE解析类", "WARNING")]
+    assert "oops" in caplog.records[0].getMessage()
+
+
+def test_结束原因和用量():
+    assert extract_finish_reason(事件(结束原因="length")) == "length"
+    assert extract_finish_reason(事件("x")) is None
+    assert extract_usage(b'{"usage": null}') is None
+    assert extract_usage(b'{"usage":{"completion_tokens":3}}') == {"completion_tokens": 3}
+
+
+def test_回答增量流并收集用量():
+    用量 = {}
+    流 = 逐块(事件("你"), 事件("好")[:9], 事件("好")[9:], 事件(结束原因="stop", 用量={"completion_tokens": 2}))
+    assert 收集(iter_content(流, 用量)) == ["你", "好"]
+    assert 用量 == {"completion_tokens": 2}
+
+
+def test_转发原样字节并暂存首个增量之前的块():
+    角色 = b'data: {"choices":[{"delta":{"role":"assistant"}}]}\n\n'
+    块列表 = [角色, 事件("你"), 事件("好"), 事件(结束原因="stop"), b"data: [DONE]\n\n"]
+    结果 = 收集(iter_relay(逐块(*块列表)))
+    assert b"".join(块.raw for 块 in 结果) == b"".join(块列表)
+    assert 结果[0].raw == 角色 + 事件("你") and 结果[0].text == "你"
+    assert [块.finish_reason for 块 in 结果] == [None, None, "stop", None]
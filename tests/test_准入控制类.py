@@ -0,0 +1,241 @@
+import asyncio
+
+import pytest
+
+from 准入控制类 import AdmissionConfig, AdmissionController, AdmissionRejected
+from 指标类 import TENANT_CALLS
+from 租户类 import FairnessConfig, TenantConfig, TenantRegistry
+
+
+def 准入控制(**config) -> AdmissionController:
+    return AdmissionController(AdmissionConfig(**{"max_concurrency": None, **config}), {0: 2, 1: None})
+
+
+def test_上游名额用满后排队并按先来后到放行():
+    async def 运行():
+        控制 = 准入控制()
+        for _ in range(2):
+            assert await 控制.acquire(0, timeout=1) == 0.0
+        放行顺序 = []
+
+        async def 排队(编号):
+            await 控制.acquire(0, timeout=1)
+            放行顺序.append(编号)
+
+        任务 = [asyncio.ensure_future(排队(i)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        已满 = 控制.saturated()
+        for _ in range(3):
+            控制.release(0)
+            await asyncio.sleep(0)
+        await asyncio.gather(*任务)
+        return 已满, 放行顺序, 控制.stats()
+
+    已满, 放行顺序, 统计 = asyncio.run(运行())
+    assert 已满 == {0}
+    assert 放行顺序 == [0, 1, 2]
+    assert (统计["queued"], 统计["in_flight"], 统计["queue_depth"]) == (3, 2, 0)
+
+
+def test_名额直接移交给排队者不被新请求插队():
+    async def 运行():
+        控制 = 准入控制()
+        for _ in range(2):
+            await 控制.acquire(0, timeout=1)
+        排队者 = asyncio.ensure_future(控制.acquire(0, timeout=1))
+        await asyncio.sleep(0.01)
+        控制.release(0)
+        return 控制.has_capacity(0), await 排队者
+
+    没有空位, 等待 = asyncio.run(运行())
+    assert 没有空位 is False
+    assert 等待 > 0
+
+
+def test_全局上限():
+    async def 运行():
+        控制 = 准入控制(max_concurrency=1)
+        await 控制.acquire(1, timeout=1)
+        return 控制.has_capacity(1), 控制.saturated()
+
+    assert asyncio.run(运行()) == (False, {0, 1})
+
+
+def test_排队已满以429拒绝():
+    async def 运行():
+        控制 = 准入控制(max_queue=1)
+        for _ in range(2):
+            await 控制.acquire(0, timeout=1)
+        排队者 = asyncio.ensure_future(控制.acquire(0, timeout=1))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as 拒绝:
+            await 控制.acquire(0, timeout=1)
+        排队者.cancel()
+        return 拒绝.value
+
+    拒绝 = asyncio.run(运行())
+    assert (拒绝.reason, 拒绝.status_code) == ("queue_full", 429)
+
+
+def test_排队超时以503拒绝并离开队列():
+    async def 运行():
+        控制 = 准入控制(queue_timeout=0.05, retry_after=2)
+        for _ in range(2):
+            await 控制.acquire(0, timeout=1)
+        with pytest.raises(AdmissionRejected) as 拒绝:
+            await 控制.acquire(0, timeout=1)
+        return 拒绝.value, 控制.stats()
+
+    拒绝, 统计 = asyncio.run(运行())
+    assert (拒绝.reason, 拒绝.status_code, 拒绝.retry_after) == ("timeout", 503, 2)
+    assert (统计["rejected_timeout"], 统计["queue_depth"]) == (1, 0)
+
+
+def test_排队中取消不占用名额():
+    async def 运行():
+        控制 = 准入控制()
+        for _ in range(2):
+            await 控制.acquire(0, timeout=1)
+        甲 = asyncio.ensure_future(控制.acquire(0, timeout=1))
+        乙 = asyncio.ensure_future(控制.acquire(0, timeout=1))
+        await asyncio.sleep(0.01)
+        甲.cancel()
+        await asyncio.gather(甲, return_exceptions=True)
+        深度 = 控制.stats()["queue_depth"]
+        控制.release(0)
+        await asyncio.wait_for(乙, 1)
+        return 深度, 控制.stats()["upstreams"][0]["in_flight"]
+
+    assert asyncio.run(运行()) == (1, 2)
+
+
+def test_名额移交后才取消也不会泄漏名额():
+    async def 运行():
+        控制 = 准入控制()
+        for _ in range(2):
+            await 控制.acquire(0, timeout=1)
+        甲 = asyncio.ensure_future(控制.acquire(0, timeout=1))
+        乙 = asyncio.ensure_future(控制.acquire(0, timeout=1))
+        await asyncio.sleep(0.01)
+        控制.release(0)  # 名额移交给甲,甲还没来得及运行就被取消
+        甲.cancel()
+        await asyncio.gather(甲, return_exceptions=True)
+        if not 甲.cancelled():
+            控制.release(0)  # 取消被吞掉时调用方照常拿到名额,用完归还
+        await asyncio.wait_for(乙, 1)
+        return 控制.stats()["upstreams"][0]["in_flight"]
+
+    assert asyncio.run(运行()) == 2
+
+
+def test_热加载提高上限后放行排队者():
+    async def 运行():
+        控制 = 准入控制()
+        for _ in range(2):
+            await 控制.acquire(0, timeout=1)
+        排队者 = asyncio.ensure_future(控制.acquire(0, timeout=1))
+        await asyncio.sleep(0.01)
+        控制.update_limits({0: 3})
+        return await asyncio.wait_for(排队者, 1)
+
+    assert asyncio.run(运行()) >= 0
+
+
+def 公平准入控制(上游并发: int, *调用方: TenantConfig, **config) -> AdmissionController:
+    return AdmissionController(AdmissionConfig(**{"max_concurrency": None, **config}), {0: 上游并发},
+                               TenantRegistry(FairnessConfig(enabled=True), list(调用方)))
+
+
+def test_积压的调用方按权重分享释放的名额():
+    async def 运行():
+        控制 = 公平准入控制(1, TenantConfig("heavy", "k1", weight=3), TenantConfig("light", "k2", weight=1))
+        await 控制.acquire(0, timeout=5)
+        放行顺序 = []
+
+        async def 排队(调用方):
+            await 控制.acquire(0, timeout=5, tenant=调用方)
+            放行顺序.append(调用方)
+
+        任务 = []
+        for _ in range(6):
+            任务 += [asyncio.ensure_future(排队("light")), asyncio.ensure_future(排队("heavy"))]
+        await asyncio.sleep(0.01)
+        控制.release(0)
+        for 已放行 in range(12):
+            while len(放行顺序) <= 已放行:
+                await asyncio.sleep(0)
+            控制.release(0, tenant=放行顺序[已放行])
+        await asyncio.gather(*任务)
+        return 放行顺序
+
+    放行顺序 = asyncio.run(运行())
+    assert 放行顺序[:8].count("heavy") == 6
+    assert sorted(放行顺序) == ["heavy"] * 6 + ["light"] * 6
+
+
+def test_调用方并发配额用尽时排队而名额留给其他调用方():
+    async def 运行():
+        控制 = 公平准入控制(5, TenantConfig("a", "k1", max_concurrency=1), TenantConfig("b", "k2"))
+        await 控制.acquire(0, timeout=1, tenant="a")
+        甲 = asyncio.ensure_future(控制.acquire(0, timeout=1, tenant="a"))
+        await asyncio.sleep(0.01)
+        乙等待 = await 控制.acquire(0, timeout=1, tenant="b")
+        排队中 = not 甲.done()
+        控制.release(0, tenant="a", output_tokens=120)
+        await asyncio.wait_for(甲, 1)
+        return 排队中, 乙等待, 控制.tenant_stats()
+
+    排队中, 乙等待, 统计 = asyncio.run(运行())
+    assert 排队中 and 乙等待 == 0.0
+    assert (统计["a"]["in_flight"], 统计["a"]["queued"], 统计["a"]["output_tokens"]) == (1, 1, 120)
+    assert 统计["a"]["max_concurrency"] == 1 and 统计["b"]["in_flight"] == 1
+
+
+def test_调用方自己的排队上限和排队时间():
+    async def 运行():
+        控制 = 公平准入控制(1, TenantConfig("a", "k1", max_queue=1), TenantConfig("b", "k2", queue_timeout=0.05))
+        await 控制.acquire(0, timeout=1)
+        排队者 = asyncio.ensure_future(控制.acquire(0, timeout=1, tenant="a"))
+        await asyncio.sleep(0.01)
+        拒绝 = []
+        for 调用方 in ("a", "b"):
+            try:
+                await 控制.acquire(0, timeout=1, tenant=调用方)
+            except AdmissionRejected as e:
+                拒绝.append(e.reason)
+        排队者.cancel()
+        return 拒绝, 控制.tenant_stats()
+
+    拒绝, 统计 = asyncio.run(运行())
+    assert 拒绝 == ["queue_full", "timeout"]
+    assert 统计["a"]["rejected"] == 统计["b"]["rejected"] == 1
+
+
+def test_名额移交后被取消时转交下一个等待者且不计为完成(monkeypatch):
+    原等待 = asyncio.wait_for
+    已取消 = []
+
+    async def 移交后取消(future, timeout):
+        await 原等待(future, timeout)
+        if not 已取消:  # 第一个拿到名额的等待者在恢复运行前被取消
+            已取消.append(True)
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(asyncio, "wait_for", 移交后取消)
+
+    async def 运行():
+        控制 = 公平准入控制(1, TenantConfig("a", "k1"))
+        await 控制.acquire(0, timeout=1, tenant="a")
+        甲 = asyncio.ensure_future(控制.acquire(0, timeout=1, tenant="a"))
+        乙 = asyncio.ensure_future(控制.acquire(0, timeout=1, tenant="a"))
+        await asyncio.sleep(0.01)
+        调用数 = TENANT_CALLS._values.get(("a",), 0)
+        控制.release(0, tenant="a")
+        await asyncio.gather(甲, return_exceptions=True)
+        await 原等待(乙, 1)
+        return 甲.cancelled(), TENANT_CALLS._values.get(("a",), 0) - 调用数, 控制.tenant_stats()["a"], 控制.stats()
+
+    甲被取消, 新增调用数, 调用方统计, 统计 = asyncio.run(运行())
+    assert 甲被取消 and 新增调用数 == 1
+    assert (调用方统计["completed"], 调用方统计["admitted"], 调用方统计["in_flight"]) == (1, 2, 1)
+    assert (统计["admitted"], 统计["in_flight"], 统计["queue_depth"]) == (2, 1, 0)
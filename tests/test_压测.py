@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+import tomli
+
+from conftest import 启动模拟上游
+from 压测 import HDR直方图, 压测, 对比
+from 模拟上游 import 写入模拟配置
+
+
+def 压测参数(url: str, **overrides) -> argparse.Namespace:
+    参数 = dict(url=url, route="/v1/chat/completions", rps=50, arrival="constant", concurrency=0, duration=0.2,
+                warmup=0, max_outstanding=10000, timeout=10, question="压测问题", same_question=False,
+                no_stream=False, seed=0)
+    参数.update(overrides)
+    return argparse.Namespace(**参数)
+
+
+def test_直方图分位数的相对误差在有效数字以内():
+    直方图 = HDR直方图(有效数字=3)
+    for 微秒 in range(1, 100_001):
+        直方图.记录秒(微秒 / 1_000_000)
+    for p in (0.5, 0.9, 0.99, 0.999):
+        assert 直方图.分位数毫秒(p) == pytest.approx(p * 100, rel=1e-3)
+    汇总 = 直方图.汇总()
+    assert (汇总["count"], 汇总["min_ms"], 汇总["max_ms"]) == (100_000, 0.001, 100.0)
+    assert 汇总["p99.9_ms"] == 直方图.分位数毫秒(0.999)
+    assert sum(直方图.导出()["buckets"].values()) == 100_000
+
+
+def test_空直方图():
+    assert HDR直方图().汇总()["p50_ms"] == 0.0
+
+
+def test_开环按时间表发出请求并记录延迟():
+    async def 运行():
+        async with 启动模拟上游() as (url, 上游):
+            结果 = await 压测(压测参数(url.removesuffix("/v1/chat/completions"))).运行()
+            return 结果, 上游.统计["requests"]
+
+    结果, 请求数 = asyncio.run(运行())
+    汇总 = 结果["summary"]
+    assert 汇总["sent"] == 汇总["succeeded"] == 请求数 in (10, 11)  # 0.2 秒 × 50 RPS,计划时刻的浮点累加可能多出一个
+    assert 结果["status_codes"] == {"200": 请求数}
+    assert 结果["ttft"]["count"] == 结果["latency"]["count"] == 请求数
+
+
+def test_闭环保持并发数并统计错误():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=20, error_rate=1.0) as (url, _):
+            return await 压测(压测参数(url.removesuffix("/v1/chat/completions"), concurrency=3)).运行()
+
+    结果 = asyncio.run(运行())
+    assert 结果["summary"]["max_outstanding"] == 3
+    assert 结果["summary"]["succeeded"] == 0
+    assert set(结果["errors"]) == {"500"}
+
+
+def test_对比两次结果(tmp_path, capsys):
+    旧 = {"summary": {"throughput_rps": 10, "success_rate": 1.0}, "ttft": {"p50_ms": 100}, "latency": {}}
+    新 = {"summary": {"throughput_rps": 12, "success_rate": 1.0}, "ttft": {"p50_ms": 50}, "latency": {}}
+    for 名称, 结果 in (("旧.json", 旧), ("新.json", 新)):
+        (tmp_path / 名称).write_text(json.dumps(结果), encoding="utf-8")
+    对比(str(tmp_path / "旧.json"), str(tmp_path / "新.json"))
+    输出 = capsys.readouterr().out
+    assert "+20.0%" in 输出 and "-50.0%" in 输出
+
+
+def test_写入模拟配置替换上游列表(tmp_path):
+    路径 = tmp_path / "ai_configs.toml"
+    写入模拟配置(str(路径), 9000, 2)
+    配置 = tomli.loads(路径.read_text(encoding="utf-8"))
+    assert [项["model"] for 项 in 配置["ai"]] == ["mock-0", "mock-1"]
+    assert 配置["ai"][0]["url"] == "http://127.0.0.1:9000/v1/chat/completions"
+    assert "balancer" in 配置
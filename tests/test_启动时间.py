@@ -0,0 +1,15 @@
+import os
+import statistics
+
+from 启动时间 import 已导入的禁止模块, 运行一轮, 默认禁止模块, 默认预算毫秒
+
+
+def test_服务器导入不加载浏览器自动化且不超出预算():
+    环境 = dict(os.environ)
+    环境.pop("AI_SERVER_WORKERS", None)
+    环境.pop("AI_CONFIGS", None)
+    轮次 = [运行一轮(环境, importtime=False)[0] for _ in range(3)]
+
+    assert 已导入的禁止模块(轮次[0]["loaded"], 默认禁止模块) == []
+    合计 = statistics.median(r["import_ms"] for r in 轮次) + statistics.median(r["startup_ms"] for r in 轮次)
+    assert 合计 < 默认预算毫秒, f"导入+启动中位数 {合计:.1f} ms 超出预算 {默认预算毫秒} ms"
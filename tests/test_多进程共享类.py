@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from conftest import 上游配置
+from 负载均衡类 import LoadBalancer
+from 多进程共享类 import SharedState, WorkersConfig, split_upstream_limits
+
+
+@pytest.fixture
+def 两个进程(tmp_path):
+    """同一目录下的两个共享状态,相当于两个工作进程"""
+    配置 = WorkersConfig(workers=2, state_dir=str(tmp_path), max_upstreams=4)
+    甲, 乙 = SharedState(配置), SharedState(配置)
+    yield 甲, 乙
+    甲.release()
+    乙.release()
+
+
+def test_各进程取得不同的槽位(两个进程, tmp_path):
+    甲, 乙 = 两个进程
+    assert {甲.worker_id, 乙.worker_id} == {0, 1}
+    with pytest.raises(RuntimeError):
+        SharedState(WorkersConfig(workers=2, state_dir=str(tmp_path), max_upstreams=4))
+
+
+def test_释放的槽位可被新进程接管(两个进程, tmp_path):
+    甲, _ = 两个进程
+    槽位 = 甲.worker_id
+    甲.release()
+    丙 = SharedState(WorkersConfig(workers=2, state_dir=str(tmp_path), max_upstreams=4))
+    assert 丙.worker_id == 槽位
+    丙.release()
+
+
+def test_汇总其他进程的在途数和熔断(两个进程):
+    甲, 乙 = 两个进程
+    甲方 = LoadBalancer(上游配置("http://127.0.0.1:1/v1/chat/completions", count=2))
+    乙方 = LoadBalancer(上游配置("http://127.0.0.1:1/v1/chat/completions", count=2))
+    乙方.upstreams[1].stats.in_flight = 3
+    乙方.upstreams[0].cool_down(30)
+    乙.sync(乙方.upstreams)
+    甲.sync(甲方.upstreams)
+    assert 甲方.upstreams[1].stats.peer_in_flight == 3
+    assert 甲方.upstreams[1].stats.total_in_flight == 3
+    assert 甲方.upstreams[0].peer_cooldown_until > time.time() + 20
+    assert 甲方.upstreams[1].peer_cooldown_until <= time.time()
+
+
+def test_配置不同的同编号上游不互相汇总(两个进程):
+    甲, 乙 = 两个进程
+    甲方 = LoadBalancer(上游配置("http://127.0.0.1:1/v1/chat/completions", count=1))
+    乙方 = LoadBalancer(上游配置("http://127.0.0.1:2/v1/chat/completions", count=1))
+    乙方.upstreams[0].stats.in_flight = 2
+    乙.sync(乙方.upstreams)
+    甲.sync(甲方.upstreams)
+    assert 甲方.upstreams[0].stats.peer_in_flight == 0
+
+
+def test_轮询序号在进程间共享(两个进程):
+    甲, 乙 = 两个进程
+    序号 = [甲.next_ticket(), 乙.next_ticket(), 甲.next_ticket(), 乙.next_ticket()]
+    assert 序号 == [0, 1, 2, 3]
+
+
+def test_其他进程修改上游配置后跟随重新加载(两个进程):
+    甲, 乙 = 两个进程
+    调用次数 = {"甲": 0, "乙": 0}
+
+    async def 运行():
+        async def 甲重新加载():
+            调用次数["甲"] += 1
+
+        async def 乙重新加载():
+            调用次数["乙"] += 1
+
+        甲.start(甲重新加载)
+        乙.start(乙重新加载)
+        try:
+            甲.announce_reload()
+            return await 甲.follow_reload(), await 乙.follow_reload(), await 乙.follow_reload()
+        finally:
+            await asyncio.gather(甲.stop(), 乙.stop())
+
+    assert asyncio.run(运行()) == (False, True, False)
+    assert 调用次数 == {"甲": 0, "乙": 1}
+
+
+def test_跟随重新加载失败时记录警告并继续(两个进程, caplog):
+    甲, 乙 = 两个进程
+
+    async def 运行():
+        async def 重新加载失败():
+            raise ValueError("配置文件不合法")
+
+        乙.start(重新加载失败)
+        try:
+            甲.announce_reload()
+            return await 乙.follow_reload()
+        finally:
+            await 乙.stop()
+
+    assert asyncio.run(运行()) is True
+    assert [(记录.name, 记录.levelname) for 记录 in caplog.records] == [("多进程共享类", "WARNING")]
+    assert "配置文件不合法" in caplog.records[0].getMessage()
+
+
+def test_按进程数平分额度():
+    配置 = 上游配置("http://127.0.0.1:1/v1/chat/completions", count=1, rpm=100, tpm=None, max_concurrency=5)
+    平分 = split_upstream_limits(配置, 4)[0]
+    assert (平分.rpm, 平分.tpm, 平分.max_concurrency) == (25, None, 2)
+    assert split_upstream_limits(配置, 1) is 配置
@@ -0,0 +1,38 @@
+import asyncio
+
+from 微基准 import 测量项, 对比基线, 内存, 计时, 阶段测量项
+
+
+def test_各阶段测量项都能运行():
+    循环 = asyncio.new_event_loop()
+    try:
+        for 项 in 阶段测量项():
+            结果 = 循环.run_until_complete(项.函数()) if 项.异步 else 项.函数()
+            assert 结果 is not None or 项.名称.startswith("选择上游+记录"), 项.名称
+    finally:
+        循环.close()
+
+
+def test_计时和内存测量():
+    循环 = asyncio.new_event_loop()
+    try:
+        项 = 测量项("列表", lambda: [0] * 1000)
+        耗时 = 计时(项, 循环, 最短时间=0.01, 轮数=2)
+        分配 = 内存(项, 循环, 次数=5)
+    finally:
+        循环.close()
+    assert 耗时["ops_per_sec"] > 0 and 耗时["us_per_op"] > 0
+    assert 分配["alloc_peak_bytes"] >= 8000
+    assert set(分配) == {"alloc_peak_bytes", "retained_blocks"}
+
+
+def test_对比基线标出退化项(capsys):
+    基线 = {"甲": {"ops_per_sec": 100, "alloc_peak_bytes": 1000},
+            "乙": {"ops_per_sec": 100, "alloc_peak_bytes": 1000},
+            "丙": {"ops_per_sec": 100, "alloc_peak_bytes": 1000}}
+    结果 = {"甲": {"ops_per_sec": 95, "alloc_peak_bytes": 1050},
+            "乙": {"ops_per_sec": 80, "alloc_peak_bytes": 1000},
+            "丙": {"ops_per_sec": 100, "alloc_peak_bytes": 1300},
+            "丁": {"ops_per_sec": 1, "alloc_peak_bytes": 1}}
+    assert 对比基线(结果, 基线, 阈值=0.1) == ["乙", "丙"]
+    assert "(新增)" in capsys.readouterr().out
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from conftest import 启动模拟上游, 上游配置
+from 负载均衡类 import LoadBalancer
+from 调度器类 import Dispatcher
+from 批处理类 import BatchConfig, BatchManager, BatchRejected, parse_batch_input
+
+
+def test_每个上游的批处理并发不超过上限():
+    async def 运行():
+        # throughput 策略在没有样本时总选第一个上游,没有按上游的名额时所有问题都会压到它上面
+        async with 启动模拟上游(ttft_ms=30) as (url, 上游):
+            批处理 = BatchManager(Dispatcher(LoadBalancer(上游配置(url), strategy="throughput")),
+                                 BatchConfig(concurrency_per_upstream=2))
+            批次 = 批处理.submit([f"问题{i}" for i in range(12)])
+            结果列表 = [结果 async for 结果 in 批次.stream()]
+            return 结果列表, 批处理.slots.stats(), 上游.统计["max_in_flight"]
+
+    结果列表, 名额, 上游最大并发 = asyncio.run(运行())
+    assert all(结果["status"] == "success" for 结果 in 结果列表)
+    assert sorted(结果["index"] for 结果 in 结果列表) == list(range(12))
+    assert set(名额["peak"]) == {0, 1, 2}
+    assert max(名额["peak"].values()) == 2
+    assert 名额["in_flight"] == {}
+    assert 上游最大并发 <= 6
+
+
+def test_断开后按偏移续传():
+    async def 运行():
+        async with 启动模拟上游() as (url, _):
+            批处理 = BatchManager(Dispatcher(LoadBalancer(上游配置(url, count=1))), BatchConfig(concurrency_per_upstream=1))
+            批次 = 批处理.submit(["甲", "乙", "丙"])
+            前两条 = []
+            async for 结果 in 批次.stream():
+                前两条.append(结果)
+                if len(前两条) == 2:
+                    break
+            await 批次.task
+            续传 = [结果 async for 结果 in 批处理.get(批次.id).stream(offset=2)]
+            return 前两条, 续传, 批次.progress()
+
+    前两条, 续传, 进度 = asyncio.run(运行())
+    assert [结果["seq"] for 结果 in 前两条 + 续传] == [0, 1, 2]
+    assert 进度["done"] and 进度["succeeded"] == 3
+
+
+def test_取消批次():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=200) as (url, _):
+            批处理 = BatchManager(Dispatcher(LoadBalancer(上游配置(url, count=1))), BatchConfig(concurrency_per_upstream=1))
+            批次 = 批处理.submit(["甲", "乙", "丙"])
+            await asyncio.sleep(0.05)
+            批处理.cancel(批次.id)
+            await asyncio.gather(批次.task, return_exceptions=True)
+            return 批次.progress(), 批处理.slots.stats()
+
+    进度, 名额 = asyncio.run(运行())
+    assert 进度["cancelled"] and 进度["done"]
+    assert 进度["completed"] == 0
+    assert 名额["in_flight"] == {}
+
+
+def test_解析批量输入():
+    assert parse_batch_input('{"问题列表": ["a", "b"]}'.encode(), "application/json") == ["a", "b"]
+    assert parse_batch_input('"a"\n\n{"问题": "b"}\n'.encode()) == ["a", "b"]
+    with pytest.raises(BatchRejected):
+        parse_batch_input(b'["a", ""]', "application/json")
+    with pytest.raises(BatchRejected):
+        parse_batch_input(b"not json")
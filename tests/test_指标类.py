@@ -0,0 +1,54 @@
+import asyncio
+
+from conftest import 启动模拟上游, 上游配置
+from AIClass import AIClient
+from 指标类 import (UPSTREAM_IN_FLIGHT, UPSTREAM_REQUESTS, UPSTREAM_TTFT, MetricsRegistry, decode_tps)
+
+
+def test_直方图按累计桶输出():
+    注册表 = MetricsRegistry()
+    直方图 = 注册表.histogram("t_seconds", "测试", ("route",), buckets=(0.1, 1))
+    for 值 in (0.05, 0.1, 0.5, 3):
+        直方图.observe(("/chat",), 值)
+    行列表 = 注册表.render().splitlines()
+    assert 行列表[:2] == ["# HELP t_seconds 测试", "# TYPE t_seconds histogram"]
+    assert 行列表[2:] == [
+        't_seconds_bucket{route="/chat",le="0.1"} 2',
+        't_seconds_bucket{route="/chat",le="1"} 3',
+        't_seconds_bucket{route="/chat",le="+Inf"} 4',
+        't_seconds_sum{route="/chat"} 3.65',
+        't_seconds_count{route="/chat"} 4',
+    ]
+
+
+def test_计数器转义标签值并附加收集器():
+    注册表 = MetricsRegistry()
+    注册表.counter("t_total", "测试", ("model",)).inc(('a"b\\c\nd',), 2)
+    注册表.gauge("t_gauge", "测试").set((), 1.5)
+    注册表.add_collector(lambda: ["t_extra 1"])
+    行列表 = 注册表.render().splitlines()
+    assert 't_total{model="a\\"b\\\\c\\nd"} 2' in 行列表
+    assert "t_gauge 1.5" in 行列表
+    assert 行列表[-1] == "t_extra 1"
+
+
+def test_解码速度不计首token():
+    assert decode_tps(11, 1.0, 2.0) == 10.0
+    assert decode_tps(1, 1.0, 2.0) is None
+    assert decode_tps(None, 1.0, 2.0) is None
+    assert decode_tps(10, None, 2.0) is None
+
+
+def test_上游调用记录请求数首token延迟和在途数():
+    async def 运行():
+        async with 启动模拟上游() as (url, _):
+            配置 = 上游配置(url, count=1)[0]
+            配置.model = "mock-metrics"
+            await AIClient.async_normal_ask(配置, "你好", upstream_label="m0")
+
+    asyncio.run(运行())
+    标签 = ("m0", "mock-metrics")
+    assert UPSTREAM_REQUESTS._values[标签 + ("success",)] == 1
+    assert UPSTREAM_IN_FLIGHT._values[标签] == 0
+    assert UPSTREAM_TTFT._values[标签][-2] == 0  # 没有落入 +Inf 桶
+    assert sum(UPSTREAM_TTFT._values[标签][:-1]) == 1
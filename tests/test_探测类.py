@@ -0,0 +1,85 @@
+import asyncio
+
+from conftest import 启动模拟上游, 上游配置
+from 负载均衡类 import LoadBalancer
+from 探测类 import ProbeConfig, UpstreamProber
+
+
+def test_默认不在后台探测():
+    探测器 = UpstreamProber(ProbeConfig.from_dict({}))
+    assert not 探测器.background
+
+
+def test_探测一轮并更新记分板():
+    async def 运行():
+        async with 启动模拟上游() as (url, 上游):
+            负载均衡器 = LoadBalancer(上游配置(url))
+            探测器 = UpstreamProber(ProbeConfig(), lambda: 负载均衡器.upstreams)
+            未探测 = 探测器.scoreboard()
+            结果列表 = [行 async for 行 in 探测器.probe_all()]
+            return 未探测, 结果列表, 探测器.scoreboard(), 上游.统计["requests"]
+
+    未探测, 结果列表, 记分板, 请求数 = asyncio.run(运行())
+    assert {行["test_result"]["status"] for 行 in 未探测["详细结果"]} == {"pending"}
+    assert sorted(行["api_index"] for 行 in 结果列表) == [0, 1, 2]
+    assert 请求数 == 3
+    assert all(行["test_result"]["status"] == "success" and 行["success_rate"] == 1.0 for 行 in 记分板["详细结果"])
+    assert 记分板["探测"]["rounds"] == 1
+
+
+def test_同一上游进行中的探测被复用():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=100) as (url, 上游):
+            负载均衡器 = LoadBalancer(上游配置(url, count=1))
+            探测器 = UpstreamProber(ProbeConfig(), lambda: 负载均衡器.upstreams)
+            await asyncio.gather(*[探测器.probe(负载均衡器.upstreams[0]) for _ in range(3)])
+            return 上游.统计["requests"], 探测器.counts["shared"]
+
+    assert asyncio.run(运行()) == (1, 2)
+
+
+def test_失败计入连续失败次数():
+    async def 运行():
+        async with 启动模拟上游(error_rate=1.0) as (url, _):
+            负载均衡器 = LoadBalancer(上游配置(url, count=1))
+            探测器 = UpstreamProber(ProbeConfig(), lambda: 负载均衡器.upstreams)
+            for _ in range(2):
+                行 = await 探测器.probe(负载均衡器.upstreams[0])
+            return 行
+
+    行 = asyncio.run(运行())
+    assert 行["test_result"]["status"] == "error"
+    assert 行["consecutive_failures"] == 2
+    assert 行["success_rate"] == 0.0
+    assert 行["last_error"]
+
+
+def test_其他进程的结果通过快照合并(tmp_path):
+    async def 运行():
+        async with 启动模拟上游() as (url, _):
+            负载均衡器 = LoadBalancer(上游配置(url, count=2))
+            配置 = ProbeConfig(snapshot_path=str(tmp_path / "probe.json"))
+            探测进程 = UpstreamProber(配置, lambda: 负载均衡器.upstreams)
+            读取进程 = UpstreamProber(配置, lambda: 负载均衡器.upstreams, background=False)
+            async for _ in 探测进程.probe_all():
+                pass
+            return 读取进程.scoreboard()
+
+    记分板 = asyncio.run(运行())
+    assert [行["test_result"]["status"] for 行 in 记分板["详细结果"]] == ["success", "success"]
+
+
+def test_后台探测持续失败时限频记录警告(caplog):
+    async def 运行():
+        def 上游列表():
+            raise RuntimeError("读取上游列表失败")
+
+        探测器 = UpstreamProber(ProbeConfig(enabled=True, initial_delay=0, interval=0.01), 上游列表)
+        探测器.start()
+        await asyncio.sleep(0.1)
+        await 探测器.stop()
+
+    asyncio.run(运行())
+    警告 = [记录 for 记录 in caplog.records if 记录.name == "探测类"]
+    assert len(警告) == 1 and 警告[0].levelname == "WARNING"
+    assert "读取上游列表失败" in 警告[0].getMessage()
@@ -0,0 +1,60 @@
+import logging
+
+from 日志类 import BoundedQueueHandler, LogThrottle, LoggerManager
+
+
+def _日志内容(管理器: LoggerManager) -> str:
+    return "".join(f.read_text(encoding="utf-8") for f in 管理器.log_dir.glob(f"{管理器.name}_*.log"))
+
+
+def _关闭(管理器: LoggerManager) -> None:
+    for handler in list(管理器.logger.handlers):
+        handler.close()
+        管理器.logger.removeHandler(handler)
+
+
+def test_异步模式停止时写完队列并改为同步写入(tmp_path):
+    管理器 = LoggerManager(name="test_async_stop", log_dir=tmp_path, console_output=False, async_mode=True)
+    logger = 管理器.get_logger()
+    try:
+        for i in range(100):
+            logger.info(f"停止前 {i}")
+        管理器.stop()
+        assert 管理器.queue_handler not in logger.handlers
+        logger.info("停止后")
+        内容 = _日志内容(管理器)
+        assert "停止前 99" in 内容
+        assert "停止后" in 内容
+        assert 管理器.queue_stats()["running"] is False
+        管理器.stop()  # 可重复调用
+    finally:
+        _关闭(管理器)
+
+
+def test_队列处理器不在调用线程中格式化():
+    处理器 = BoundedQueueHandler(10)
+    记录 = logging.LogRecord("t", logging.INFO, __file__, 1, "回答 %s", ("内容",), None)
+    处理器.handle(记录)
+    取出 = 处理器.queue.get_nowait()
+    assert 取出 is 记录
+    assert 取出.getMessage() == "回答 内容"
+
+
+def test_队列已满时丢弃并计数():
+    处理器 = BoundedQueueHandler(1, full_policy="drop")
+    for i in range(3):
+        处理器.handle(logging.LogRecord("t", logging.INFO, __file__, 1, f"第 {i} 条", None, None))
+    assert 处理器.dropped == 2
+    assert 处理器.queue.qsize() == 1
+
+
+def test_日志节流在间隔内只放行一条并报告被压下的条数(monkeypatch):
+    import 日志类
+    现在 = [100.0]
+    monkeypatch.setattr(日志类.time, "monotonic", lambda: 现在[0])
+    节流 = LogThrottle(60)
+    assert 节流.allow() == 0
+    assert [节流.allow() for _ in range(3)] == [None] * 3
+    现在[0] += 60
+    assert 节流.allow() == 3
+    assert 节流.allow() is None
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from conftest import 启动模拟上游, 上游配置
+from 模型池类 import ModelRouter, Route, RoutingConfig, UnknownModel
+from 负载均衡类 import LoadBalancer
+from 调度器类 import Dispatcher, DispatchError
+
+地址 = "http://127.0.0.1:1/v1/chat/completions"
+
+
+def 分池上游(轻量地址: str = 地址, 主力地址: str = 地址):
+    轻量 = 上游配置(轻量地址, count=2, pool="lite")
+    主力 = 上游配置(主力地址, count=1, pool="pro")
+    主力[0].model = "mock-pro"
+    return 轻量 + 主力
+
+
+def 路由器(**config) -> ModelRouter:
+    return ModelRouter(RoutingConfig(**config), LoadBalancer(分池上游()))
+
+
+def test_按请求的池名或模型名路由():
+    路由 = 路由器(fallback={"lite": ["pro", "lite", "gone"]})
+    assert 路由.route("lite", 10) == Route(("lite", "pro"), reason="requested")
+    assert 路由.route("pro", 10) == Route(("pro",), reason="requested")
+    assert 路由.route("mock-pro", 10) == Route(("pro",), model="mock-pro", reason="model")
+    with pytest.raises(UnknownModel):
+        路由.route("gpt-4o", 10)
+    assert 路由.knows("auto") and 路由.knows(None) and 路由.knows("mock-0") and not 路由.knows("gpt-4o")
+
+
+def test_未指定模型时按提问长度和默认池路由():
+    路由 = 路由器(default_pool="pro", cheap_router=True, cheap_max_chars=100)
+    assert 路由.route(None, 100) == Route(("lite",), reason="cheap")
+    assert 路由.route("auto", 101) == Route(("pro",))
+    assert 路由器().route(None, 10) == Route()
+    assert 路由器(default_pool="missing").route(None, 10) == Route()
+
+
+def test_缓存范围只与路由范围有关():
+    assert Route().cache_scope == "*"
+    assert Route(("lite", "pro")).cache_scope == "pool:lite+pro"
+    assert Route(("pro",), model="mock-pro").cache_scope == "mock-pro"
+    assert Route(("lite", "pro")).label == "lite" and Route().label == "all"
+
+
+def test_池内上游都失败时改用fallback池():
+    async def 运行():
+        async with 启动模拟上游(error_rate=1.0) as (坏地址, _), 启动模拟上游() as (好地址, _):
+            负载均衡器 = LoadBalancer(分池上游(坏地址, 好地址))
+            路由 = ModelRouter(RoutingConfig(fallback={"lite": ["pro"]}), 负载均衡器)
+            调度器 = Dispatcher(负载均衡器, router=路由)
+            结果, 尝试记录 = await 调度器.ask("你好", model="lite")
+            with pytest.raises(DispatchError) as 指定模型:
+                await 调度器.ask("你好", model="mock-0")  # 指定具体模型时不改用其他模型
+            with pytest.raises(DispatchError) as 未知:
+                await 调度器.ask("你好", model="gpt-4o")
+            return 结果, 尝试记录, 指定模型.value, 未知.value, 路由.stats()
+
+    结果, 尝试记录, 指定模型, 未知, 统计 = asyncio.run(运行())
+    assert 结果["status"] == "success"
+    assert [(记录["model"], 记录["status"]) for 记录 in 尝试记录] == [
+        ("mock-0", "error"), ("mock-1", "error"), ("mock-pro", "success")]
+    assert {记录["model"] for 记录 in 指定模型.attempts} == {"mock-0"}
+    assert 未知.status_code == 400
+    assert 统计["fallbacks"] == {"lite": {"pro": 1}}
+    assert 统计["requests"]["lite"] == {"requested": 1, "model": 1}
+    assert 统计["pools"]["lite"]["fallback"] == ["pro"]
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+import 熔断器类
+from conftest import 启动模拟上游, 上游配置
+from AIClass import Timeouts
+from 熔断器类 import (CLIENT_ERROR, CLOSED, DEADLINE, HALF_OPEN, OPEN, RATE_LIMITED, BreakerConfig, CircuitBreaker,
+                      failure_kind)
+from 负载均衡类 import LoadBalancer
+from 调度器类 import Dispatcher, DispatchError, RetryConfig
+
+
+class 假时钟:
+    def __init__(self):
+        self.现在 = 1000.0
+
+    def __call__(self) -> float:
+        return self.现在
+
+
+@pytest.fixture
+def 时钟(monkeypatch):
+    时钟 = 假时钟()
+    monkeypatch.setattr(熔断器类.time, "monotonic", 时钟)
+    return 时钟
+
+
+def test_连续失败达到阈值后熔断(时钟):
+    熔断器 = CircuitBreaker(BreakerConfig(failure_threshold=3, min_requests=100))
+    for _ in range(2):
+        熔断器.record_failure("boom")
+    assert 熔断器.state == CLOSED
+    熔断器.record_failure("boom")
+    assert 熔断器.state == OPEN
+    assert not 熔断器.available()
+
+
+def test_错误率过高时熔断(时钟):
+    熔断器 = CircuitBreaker(BreakerConfig(failure_threshold=100, window_size=10, min_requests=4,
+                                          error_rate_threshold=0.5))
+    for 成功 in (True, False, True, False):
+        熔断器.record_success() if 成功 else 熔断器.record_failure()
+    assert 熔断器.state == OPEN
+
+
+def test_半开状态连续成功后恢复_失败则重新熔断(时钟):
+    熔断器 = CircuitBreaker(BreakerConfig(failure_threshold=1, open_duration=30, half_open_max_calls=1,
+                                          half_open_success_threshold=2))
+    熔断器.record_failure()
+    时钟.现在 += 30
+    assert 熔断器.available() and 熔断器.state == HALF_OPEN
+    试探 = 熔断器.before_call()
+    assert 试探 is not None and not 熔断器.available()  # 试探名额已占满
+    熔断器.record_success(试探)
+    熔断器.record_success(熔断器.before_call())
+    assert 熔断器.state == CLOSED
+
+    熔断器.record_failure()
+    时钟.现在 += 30
+    熔断器.record_failure(trial=熔断器.before_call())
+    assert 熔断器.state == OPEN and 熔断器.open_count == 3
+
+
+def test_取消的试探调用释放名额(时钟):
+    熔断器 = CircuitBreaker(BreakerConfig(failure_threshold=1, open_duration=1))
+    熔断器.record_failure()
+    时钟.现在 += 1
+    熔断器.release(熔断器.before_call())
+    assert 熔断器.available()
+
+
+def test_熔断前发出的调用结束时不释放试探名额(时钟):
+    熔断器 = CircuitBreaker(BreakerConfig(failure_threshold=1, open_duration=1, half_open_max_calls=1,
+                                          half_open_success_threshold=2))
+    旧调用 = 熔断器.before_call()
+    assert 旧调用 is None
+    熔断器.record_failure()
+    时钟.现在 += 1
+    试探 = 熔断器.before_call()
+    熔断器.record_success(旧调用)
+    熔断器.release(旧调用)
+    assert 熔断器.state == HALF_OPEN and not 熔断器.available()
+    assert 熔断器.to_dict()["half_open_in_flight"] == 1
+    熔断器.release(试探)
+    assert 熔断器.available()
+
+
+def test_上一个半开期的试探令牌不释放本期名额(时钟):
+    熔断器 = CircuitBreaker(BreakerConfig(failure_threshold=1, open_duration=1, half_open_max_calls=1))
+    熔断器.record_failure()
+    时钟.现在 += 1
+    上期试探 = 熔断器.before_call()
+    熔断器.record_failure()  # 其他调用失败,重新熔断
+    时钟.现在 += 1
+    本期试探 = 熔断器.before_call()
+    熔断器.release(上期试探)
+    assert 本期试探 != 上期试探 and not 熔断器.available()
+
+
+@pytest.mark.parametrize("status, kind", [(429, RATE_LIMITED), (400, CLIENT_ERROR), (401, CLIENT_ERROR),
+                                          (500, "error"), (503, "error"), (None, "error")])
+def test_按状态码区分失败类别(status, kind):
+    assert failure_kind(status) == kind
+
+
+@pytest.mark.parametrize("kind", [RATE_LIMITED, DEADLINE, CLIENT_ERROR])
+def test_限流_请求超时和4xx不计入熔断(时钟, kind):
+    熔断器 = CircuitBreaker(BreakerConfig(failure_threshold=1, min_requests=1))
+    for _ in range(10):
+        熔断器.record_failure("ignored", kind)
+    assert 熔断器.state == CLOSED
+    assert 熔断器.consecutive_failures == 0
+    assert 熔断器.to_dict()["ignored_failures"] == {kind: 10}
+
+
+def test_调用方的时间预算耗尽不熔断健康的上游():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=300) as (url, _):
+            均衡器 = LoadBalancer(上游配置(url, 1), breaker_config=BreakerConfig(failure_threshold=2))
+            调度器 = Dispatcher(均衡器, RetryConfig(max_attempts=1))
+            for _ in range(4):
+                with pytest.raises(DispatchError) as 错误:
+                    await 调度器.ask("问题", timeouts=Timeouts(total=0.05))
+                assert 错误.value.status_code == 504
+            return 均衡器.upstreams[0].breaker
+
+    熔断器 = asyncio.run(运行())
+    assert 熔断器.state == CLOSED
+    assert 熔断器.ignored_failures == {DEADLINE: 4}
+
+
+def test_上游429不熔断():
+    async def 运行():
+        async with 启动模拟上游(rate_limit_rate=1.0, retry_after=0) as (url, _):
+            均衡器 = LoadBalancer(上游配置(url, 1), breaker_config=BreakerConfig(failure_threshold=2))
+            调度器 = Dispatcher(均衡器, RetryConfig(max_attempts=1))
+            for _ in range(4):
+                with pytest.raises(DispatchError) as 错误:
+                    await 调度器.ask("问题")
+                assert 错误.value.status_code == 429
+            return 均衡器.upstreams[0].breaker
+
+    assert asyncio.run(运行()).state == CLOSED
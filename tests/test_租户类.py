@@ -0,0 +1,57 @@
+import pytest
+
+from 租户类 import ANONYMOUS, FairnessConfig, TenantConfig, TenantRegistry, TenantRejected
+
+调用方 = [TenantConfig("web", "sk-web", weight=4), TenantConfig("batch", "sk-batch", max_concurrency=2)]
+
+
+def test_按请求头或Bearer识别调用方():
+    登记表 = TenantRegistry(FairnessConfig(enabled=True), 调用方)
+    assert 登记表.identify({"x-api-key": "sk-web"}) == "web"
+    assert 登记表.identify({"authorization": "Bearer sk-batch"}) == "batch"
+    assert 登记表.identify({"x-api-key": "sk-web", "authorization": "Bearer sk-batch"}) == "web"
+    assert 登记表.identify({"x-api-key": "sk-unknown"}) == ANONYMOUS
+    assert 登记表.identify({}) == ANONYMOUS
+
+
+def test_自定义请求头():
+    登记表 = TenantRegistry(FairnessConfig(enabled=True, header="X-Tenant-Key"), 调用方)
+    assert 登记表.identify({"x-tenant-key": "sk-web"}) == "web"
+    assert 登记表.identify({"x-api-key": "sk-web"}) == ANONYMOUS
+
+
+def test_要求key时拒绝缺少或未知的key():
+    登记表 = TenantRegistry(FairnessConfig(enabled=True, require_key=True), 调用方)
+    with pytest.raises(TenantRejected, match="缺少"):
+        登记表.identify({})
+    with pytest.raises(TenantRejected, match="未知"):
+        登记表.identify({"authorization": "Bearer sk-other"})
+    assert 登记表.identify({"x-api-key": "sk-batch"}) == "batch"
+
+
+def test_未登记的名称按anonymous的配额():
+    登记表 = TenantRegistry(FairnessConfig(anonymous_weight=0.5, anonymous_max_concurrency=3), 调用方)
+    assert 登记表.policy("web").weight == 4
+    assert 登记表.policy(None) is 登记表.policy("nobody") is 登记表.anonymous
+    assert (登记表.anonymous.weight, 登记表.anonymous.max_concurrency) == (0.5, 3)
+
+
+def test_解析调用方列表():
+    assert TenantConfig.from_list(None) == []
+    结果 = TenantConfig.from_list([{"name": "web", "key": "sk-web", "weight": 2, "queue_timeout": 1.5}])
+    assert 结果 == [TenantConfig("web", "sk-web", weight=2, queue_timeout=1.5)]
+
+
+@pytest.mark.parametrize("条目列表, 错误", [
+    ({"name": "web"}, "表数组"),
+    ([{"name": "web"}], "第 1 个 .*key"),
+    ([{"name": ANONYMOUS, "key": "k"}], "保留名称"),
+    ([{"name": "web", "key": "k", "weight": 0}], "weight"),
+    ([{"name": "web", "key": "k", "max_concurrency": 1.5}], "max_concurrency"),
+    ([{"name": "web", "key": "k", "max_queue": True}], "max_queue"),
+    ([{"name": "web", "key": "k1"}, {"name": "web", "key": "k2"}], "name 不能重复"),
+    ([{"name": "a", "key": "k"}, {"name": "b", "key": "k"}], "key 不能重复"),
+])
+def test_不合法的调用方列表(条目列表, 错误):
+    with pytest.raises(ValueError, match=错误):
+        TenantConfig.from_list(条目列表)
@@ -0,0 +1,143 @@
+import asyncio
+
+from 缓存类 import CacheConfig, ResponseCache
+
+
+def 计数请求(值="回答", 可缓存=True, 延迟=0.0):
+    """返回 (fetch, 调用次数列表)"""
+    次数 = [0]
+
+    async def 请求():
+        次数[0] += 1
+        await asyncio.sleep(延迟)
+        return 值, 可缓存
+
+    return 请求, 次数
+
+
+def test_命中内存层():
+    async def 运行():
+        缓存 = ResponseCache(CacheConfig())
+        请求, 次数 = 计数请求()
+        来源 = [(await 缓存.get_or_fetch("k", 请求))[1] for _ in range(3)]
+        return 来源, 次数[0]
+
+    assert asyncio.run(运行()) == (["miss", "memory", "memory"], 1)
+
+
+def test_超出容量时淘汰最久未用的条目():
+    async def 运行():
+        缓存 = ResponseCache(CacheConfig(max_entries=2))
+        for 键 in ("a", "b"):
+            await 缓存.put(键, 键)
+        缓存._memory_get("a")
+        await 缓存.put("c", "c")
+        return list(缓存._memory), 缓存.counts["evictions"]
+
+    assert asyncio.run(运行()) == (["a", "c"], 1)
+
+
+def test_过期后重新请求(monkeypatch):
+    import 缓存类
+    现在 = [100.0]
+    monkeypatch.setattr(缓存类.time, "monotonic", lambda: 现在[0])
+
+    async def 运行():
+        缓存 = ResponseCache(CacheConfig(ttl=10))
+        请求, 次数 = 计数请求()
+        await 缓存.get_or_fetch("k", 请求)
+        现在[0] += 11
+        _, 来源 = await 缓存.get_or_fetch("k", 请求)
+        return 来源, 次数[0], 缓存.counts["expired"]
+
+    assert asyncio.run(运行()) == ("miss", 2, 1)
+
+
+def test_不可缓存的结果不写入():
+    async def 运行():
+        缓存 = ResponseCache(CacheConfig())
+        请求, 次数 = 计数请求(可缓存=False)
+        for _ in range(2):
+            await 缓存.get_or_fetch("k", 请求)
+        return 次数[0]
+
+    assert asyncio.run(运行()) == 2
+
+
+def test_相同请求合并为一次():
+    async def 运行():
+        缓存 = ResponseCache(CacheConfig())
+        请求, 次数 = 计数请求(延迟=0.05)
+        结果 = await asyncio.gather(*[缓存.get_or_fetch("k", 请求) for _ in range(5)])
+        return sorted(来源 for _, 来源 in 结果), 次数[0]
+
+    assert asyncio.run(运行()) == (["miss"] + ["shared"] * 4, 1)
+
+
+def test_所有等待者取消后才取消上游请求():
+    async def 运行():
+        缓存 = ResponseCache(CacheConfig())
+        完成 = []
+
+        async def 请求():
+            await asyncio.sleep(0.1)
+            完成.append(True)
+            return "回答", True
+
+        甲 = asyncio.ensure_future(缓存.get_or_fetch("k", 请求))
+        乙 = asyncio.ensure_future(缓存.get_or_fetch("k", 请求))
+        await asyncio.sleep(0.01)
+        甲.cancel()
+        结果 = await 乙
+        丙 = asyncio.ensure_future(缓存.get_or_fetch("j", 请求))
+        await asyncio.sleep(0.01)
+        丙.cancel()
+        await asyncio.sleep(0.15)
+        return 结果, len(完成), 缓存._inflight
+
+    结果, 完成数, 进行中 = asyncio.run(运行())
+    assert 结果 == ("回答", "shared")
+    assert 完成数 == 1
+    assert 进行中 == {}
+
+
+def test_跳过缓存但写入新结果():
+    async def 运行():
+        缓存 = ResponseCache(CacheConfig())
+        await 缓存.put("k", "旧回答")
+        请求, _ = 计数请求("新回答")
+        绕过 = await 缓存.get_or_fetch("k", 请求, bypass=True)
+        return 绕过, await 缓存.get_or_fetch("k", 请求)
+
+    assert asyncio.run(运行()) == (("新回答", "bypass"), ("新回答", "memory"))
+
+
+def test_磁盘层在重启后仍可命中(tmp_path):
+    路径 = str(tmp_path / "responses.db")
+
+    async def 写入():
+        缓存 = ResponseCache(CacheConfig(sqlite_path=路径))
+        请求, _ = 计数请求({"message": "回答"})
+        await 缓存.get_or_fetch("k", 请求)
+        缓存.close()
+
+    async def 读取():
+        缓存 = ResponseCache(CacheConfig(sqlite_path=路径))
+        请求, 次数 = 计数请求()
+        结果 = [await 缓存.get_or_fetch("k", 请求) for _ in range(2)]
+        统计 = await 缓存.stats()
+        缓存.close()
+        return 结果, 次数[0], 统计["disk_size"]
+
+    asyncio.run(写入())
+    结果, 次数, 磁盘条数 = asyncio.run(读取())
+    assert 结果 == [({"message": "回答"}, "disk"), ({"message": "回答"}, "memory")]
+    assert 次数 == 0
+    assert 磁盘条数 == 1
+
+
+def test_缓存键区分模型和参数():
+    键 = ResponseCache.make_key("m", "s", "q", {"temperature": 0.2, "top_p": 1})
+    assert 键 == ResponseCache.make_key("m", "s", "q", {"top_p": 1, "temperature": 0.2})
+    assert 键 != ResponseCache.make_key("pool:lite", "s", "q", {"temperature": 0.2, "top_p": 1})
+    assert 键 != ResponseCache.make_key("m", "s", "q", {"temperature": 0.7, "top_p": 1})
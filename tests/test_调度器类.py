@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import pytest
+
+from conftest import 启动模拟上游, 上游配置
+from AIClass import Timeouts
+from 负载均衡类 import LoadBalancer
+from 缓存类 import CacheConfig, ResponseCache
+from 近似缓存类 import ApproxCache, ApproxCacheConfig
+from 调度器类 import Dispatcher, DispatchError, HedgeConfig, RetryConfig
+
+
+def test_同时到达的相同提问只调用一次上游():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=50) as (url, 上游):
+            调度器 = Dispatcher(LoadBalancer(上游配置(url), strategy="least_outstanding"),
+                                cache=ResponseCache(CacheConfig(max_entries=16)))
+            结果列表 = await asyncio.gather(*[调度器.ask("同一个问题") for _ in range(6)])
+            return 上游.统计["requests"], sorted(结果["cache"] for 结果, _ in 结果列表)
+
+    请求数, 来源 = asyncio.run(运行())
+    assert 请求数 == 1
+    assert 来源 == ["miss"] + ["shared"] * 5
+
+
+def 两个上游(坏地址: str, 好地址: str):
+    坏, 好 = 上游配置(坏地址, count=1)[0], 上游配置(好地址, count=1)[0]
+    好.model = "mock-good"
+    return [坏, 好]
+
+
+def test_上游出错时换下一个上游():
+    async def 运行():
+        async with 启动模拟上游(error_rate=1.0) as (坏地址, 坏上游), 启动模拟上游() as (好地址, 好上游):
+            调度器 = Dispatcher(LoadBalancer(两个上游(坏地址, 好地址)))
+            结果, 尝试记录 = await 调度器.ask("你好")
+            return 结果, 尝试记录, 坏上游.统计["requests"], 好上游.统计["requests"]
+
+    结果, 尝试记录, 坏请求数, 好请求数 = asyncio.run(运行())
+    assert 结果["status"] == "success" and 结果["message"]
+    assert [(记录["index"], 记录["status"]) for 记录 in 尝试记录] == [(0, "error"), (1, "success")]
+    assert (坏请求数, 好请求数) == (1, 1)
+
+
+def test_限流的上游按RetryAfter冷却():
+    async def 运行():
+        async with 启动模拟上游(rate_limit_rate=1.0, retry_after=30) as (坏地址, _), 启动模拟上游() as (好地址, _):
+            负载均衡器 = LoadBalancer(两个上游(坏地址, 好地址))
+            调度器 = Dispatcher(负载均衡器)
+            await 调度器.ask("你好")
+            第二次 = [await 调度器.ask("你好") for _ in range(2)]
+            return 负载均衡器.upstreams[0].wait_time(), 第二次
+
+    等待, 第二次 = asyncio.run(运行())
+    assert 等待 > 25
+    assert all([记录["index"] for 记录 in 尝试记录] == [1] for _, 尝试记录 in 第二次)
+
+
+def test_重试次数用尽时返回最后的错误():
+    async def 运行():
+        async with 启动模拟上游(error_rate=1.0) as (url, 上游):
+            调度器 = Dispatcher(LoadBalancer(上游配置(url, count=4)), RetryConfig(max_attempts=3))
+            with pytest.raises(DispatchError) as 错误:
+                await 调度器.ask("你好")
+            return 错误.value, 上游.统计["requests"]
+
+    错误, 请求数 = asyncio.run(运行())
+    assert 错误.status_code == 502
+    assert len(错误.attempts) == 请求数 == 3
+    assert len({记录["index"] for 记录 in 错误.attempts}) == 3
+
+
+def test_超出时间预算时返回504():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=1000) as (url, _):
+            调度器 = Dispatcher(LoadBalancer(上游配置(url, count=1)), RetryConfig(deadline=0.2))
+            开始 = time.monotonic()
+            with pytest.raises(DispatchError) as 错误:
+                await 调度器.ask("你好")
+            return 错误.value, time.monotonic() - 开始
+
+    错误, 耗时 = asyncio.run(运行())
+    assert 错误.status_code == 504
+    assert 耗时 < 1.0
+
+
+def test_主上游慢时对冲上游胜出():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=1000) as (慢地址, _), 启动模拟上游() as (快地址, _):
+            调度器 = Dispatcher(LoadBalancer(两个上游(慢地址, 快地址)),
+                                hedge_config=HedgeConfig(enabled=True, delay=0.1, max_ratio=1.0))
+            开始 = time.monotonic()
+            结果, 尝试记录 = await 调度器.ask("你好")
+            return 结果, 尝试记录, time.monotonic() - 开始, 调度器.hedge_stats()
+
+    结果, 尝试记录, 耗时, 统计 = asyncio.run(运行())
+    assert 结果["status"] == "success"
+    assert 耗时 < 0.8
+    assert sorted((记录["index"], 记录["status"]) for 记录 in 尝试记录) == [(0, "cancelled"), (1, "success")]
+    assert (统计["hedged"], 统计["hedge_wins"]) == (1, 1)
+
+
+def test_对冲次数受预算限制():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=200) as (url, 上游):
+            调度器 = Dispatcher(LoadBalancer(上游配置(url, count=2)),
+                                hedge_config=HedgeConfig(enabled=True, delay=0.1, max_ratio=0.1))
+            for _ in range(3):
+                await 调度器.ask("你好")
+            return 调度器.hedge_stats(), 上游.统计["requests"]
+
+    统计, 请求数 = asyncio.run(运行())
+    assert (统计["requests"], 统计["hedged"], 统计["budget_exhausted"]) == (3, 1, 2)
+    assert 请求数 == 4
+
+
+def test_成功调用记录首token延迟解码速度和用量():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=50, token_rate=200, tokens_min=11, tokens_max=11) as (url, _):
+            负载均衡器 = LoadBalancer(上游配置(url, count=1), strategy="throughput")
+            调度器 = Dispatcher(负载均衡器)
+            _, 尝试记录 = await 调度器.ask("你好")
+            return 尝试记录[-1], 负载均衡器.throughput_stats()[0]
+
+    尝试, 统计 = asyncio.run(运行())
+    assert 尝试["ttft"] >= 0.05 and 尝试["tokens"] == 11
+    assert 100 < 尝试["tps"] <= 250
+    assert 统计["samples"] == 1 and 统计["ttft_median"] >= 0.05
+    assert (统计["completion_tokens"], 统计["usage_reported"]) == (11, 1)
+
+
+def test_近似缓存命中时不调用上游且不写入精确缓存():
+    async def 运行():
+        async with 启动模拟上游() as (url, 上游):
+            调度器 = Dispatcher(LoadBalancer(上游配置(url)), cache=ResponseCache(CacheConfig()),
+                                approx_cache=ApproxCache(ApproxCacheConfig(enabled=True)))
+            第一次, _ = await 调度器.ask("怎么用 Python 读取 CSV 文件?")
+            近似, 尝试记录 = await 调度器.ask("怎么用python读取csv文件")
+            再次, _ = await 调度器.ask("怎么用python读取csv文件")
+            绕过, _ = await 调度器.ask("怎么用python读取csv文件", bypass_cache=True)
+            return 第一次, 近似, 尝试记录, 再次, 绕过, 上游.统计["requests"]
+
+    第一次, 近似, 尝试记录, 再次, 绕过, 请求数 = asyncio.run(运行())
+    assert (第一次["cache"], 近似["cache"], 再次["cache"], 绕过["cache"]) == ("miss", "similar", "similar", "bypass")
+    assert 近似["message"] == 第一次["message"] and 近似["similarity"] == 1.0
+    assert 尝试记录 == []
+    assert 请求数 == 2
+
+
+def test_首字节超时后换上游并以请求的总时限为预算():
+    async def 运行():
+        async with 启动模拟上游(ttft_ms=1000) as (慢地址, _), 启动模拟上游() as (快地址, _):
+            调度器 = Dispatcher(LoadBalancer(两个上游(慢地址, 快地址)), RetryConfig(deadline=60))
+            结果, 尝试记录 = await 调度器.ask("你好", timeouts=Timeouts(first_byte=0.1))
+            with pytest.raises(DispatchError) as 错误:
+                await 调度器.ask("你好", timeouts=Timeouts(total=0.2))  # 轮询到慢上游
+            return 结果, 尝试记录, 错误.value
+
+    结果, 尝试记录, 错误 = asyncio.run(运行())
+    assert 结果["status"] == "success"
+    assert [(记录["index"], 记录["status"]) for 记录 in 尝试记录] == [(0, "timeout"), (1, "success")]
+    assert 错误.status_code == 504
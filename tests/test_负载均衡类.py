@@ -0,0 +1,150 @@
+from collections import Counter
+
+import pytest
+
+from conftest import 上游配置
+from 负载均衡类 import LoadBalancer, NoUpstreamAvailable, ThroughputWindow
+
+地址 = "http://127.0.0.1:1/v1/chat/completions"
+
+
+def 选择序列(负载均衡器: LoadBalancer, 次数: int):
+    return [负载均衡器.select().index for _ in range(次数)]
+
+
+def test_轮询依次选择():
+    assert 选择序列(LoadBalancer(上游配置(地址)), 6) == [0, 1, 2, 0, 1, 2]
+
+
+def test_最少在途优先():
+    负载均衡器 = LoadBalancer(上游配置(地址), strategy="least_outstanding")
+    负载均衡器.upstreams[0].stats.in_flight = 2
+    负载均衡器.upstreams[2].stats.in_flight = 1
+    assert 选择序列(负载均衡器, 3) == [1, 1, 1]
+
+
+def test_最少在途相同时轮换():
+    assert set(选择序列(LoadBalancer(上游配置(地址), strategy="least_outstanding"), 3)) == {0, 1, 2}
+
+
+def test_EWMA先探索没有样本的上游再选延迟低的():
+    负载均衡器 = LoadBalancer(上游配置(地址), strategy="ewma", ewma_alpha=0.5)
+    for 上游, 延迟 in zip(负载均衡器.upstreams[:2], (0.2, 1.0)):
+        with 负载均衡器.track(上游) as 记录:
+            记录["success"] = True
+        上游.stats.ewma_latency = 延迟
+    assert 负载均衡器.select().index == 2
+    负载均衡器.upstreams[2].stats.ewma_latency = 0.5
+    assert 负载均衡器.select().index == 0
+    # 在途数放大延迟得分
+    负载均衡器.upstreams[0].stats.in_flight = 4
+    assert 负载均衡器.select().index == 2
+
+
+def test_EWMA平滑更新():
+    负载均衡器 = LoadBalancer(上游配置(地址, count=1), ewma_alpha=0.5)
+    统计 = 负载均衡器.upstreams[0].stats
+    统计.record(1.0, True, 0.5)
+    统计.record(3.0, True, 0.5)
+    统计.record(9.0, False, 0.5)
+    assert 统计.ewma_latency == 2.0
+    assert (统计.requests, 统计.errors) == (3, 1)
+
+
+def test_平滑加权轮询按权重分配且不连续集中():
+    配置 = 上游配置(地址)
+    for 条目, 权重 in zip(配置, (5.0, 1.0, 1.0)):
+        条目.weight = 权重
+    序列 = 选择序列(LoadBalancer(配置, strategy="weighted"), 7)
+    assert Counter(序列) == {0: 5, 1: 1, 2: 1}
+    assert 序列 == [0, 0, 1, 0, 2, 0, 0]
+
+
+def test_两选一选择在途更少的():
+    负载均衡器 = LoadBalancer(上游配置(地址, count=2), strategy="p2c")
+    负载均衡器.upstreams[0].stats.in_flight = 3
+    assert 选择序列(负载均衡器, 5) == [1] * 5
+
+
+def test_跳过排除冷却和熔断的上游():
+    负载均衡器 = LoadBalancer(上游配置(地址))
+    负载均衡器.upstreams[0].cool_down(30)
+    for _ in range(负载均衡器.upstreams[1].breaker.config.failure_threshold):
+        负载均衡器.upstreams[1].breaker.record_failure("上游出错")
+    assert 负载均衡器.select().index == 2
+    with pytest.raises(NoUpstreamAvailable):
+        负载均衡器.select(exclude={2})
+
+
+def test_未知策略():
+    with pytest.raises(ValueError):
+        LoadBalancer(上游配置(地址), strategy="random")
+
+
+def test_记录调用结果():
+    负载均衡器 = LoadBalancer(上游配置(地址, count=1))
+    上游 = 负载均衡器.upstreams[0]
+    with 负载均衡器.track(上游) as 记录:
+        assert 上游.stats.in_flight == 1
+        记录["success"] = True
+    with pytest.raises(RuntimeError):
+        with 负载均衡器.track(上游):
+            raise RuntimeError("上游出错")
+    assert 上游.stats.in_flight == 0
+    assert (上游.stats.requests, 上游.stats.errors) == (2, 1)
+    assert 上游.stats.last_latency is not None
+
+
+def test_热加载保留未变化上游的状态并为新增上游分配新编号():
+    旧配置 = 上游配置(地址)
+    负载均衡器 = LoadBalancer(旧配置)
+    保留的上游 = 负载均衡器.upstreams[1]
+    with 负载均衡器.track(保留的上游) as 记录:
+        记录["success"] = True
+    保留的上游.cool_down(30)
+    新配置 = 上游配置(地址, count=2)[1:] + 上游配置(地址.replace(":1/", ":2/"), count=1)
+    新配置[0].weight = 3
+    变更 = 负载均衡器.reload(新配置)
+    assert 变更 == {"added": [3], "removed": [0, 2], "kept": [1]}
+    assert [上游.index for 上游 in 负载均衡器.upstreams] == [1, 3]
+    assert 负载均衡器.upstreams[0] is 保留的上游
+    assert (保留的上游.weight, 保留的上游.stats.requests, 保留的上游.wait_time() > 25) == (3, 1, True)
+    with pytest.raises(ValueError):
+        负载均衡器.reload([])
+
+
+def test_吞吐窗口取中位数并丢弃过期样本(monkeypatch):
+    import 负载均衡类
+    现在 = [100.0]
+    monkeypatch.setattr(负载均衡类.time, "monotonic", lambda: 现在[0])
+    窗口 = ThroughputWindow(window=10, max_samples=3)
+    for 首token, 速度 in ((0.1, 10.0), (0.3, None), (0.2, 30.0), (0.5, 20.0)):
+        窗口.add(首token, 速度)
+        现在[0] += 1
+    assert len(窗口) == 3  # 最多保留 3 个样本
+    assert (窗口.median_ttft(), 窗口.median_tps()) == (0.3, 30.0)
+    现在[0] += 10
+    assert (len(窗口), 窗口.median_ttft(), 窗口.median_tps()) == (0, None, None)
+
+
+def 吞吐样本(上游, 首token延迟: float, 解码速度: float) -> None:
+    上游.stats.throughput.add(首token延迟, 解码速度)
+
+
+def test_吞吐策略先探索没有样本的上游():
+    负载均衡器 = LoadBalancer(上游配置(地址), strategy="throughput")
+    吞吐样本(负载均衡器.upstreams[0], 0.1, 100)
+    吞吐样本(负载均衡器.upstreams[1], 0.1, 100)
+    assert 负载均衡器.select().index == 2
+
+
+def test_吞吐策略按回答长度权衡首token延迟和解码速度():
+    负载均衡器 = LoadBalancer(上游配置(地址, count=2), strategy="throughput", expected_output_tokens=512)
+    快首token, 快解码 = 负载均衡器.upstreams
+    吞吐样本(快首token, 0.2, 20)   # 短回答更快
+    吞吐样本(快解码, 1.0, 100)     # 长回答更快
+    assert 负载均衡器.select(output_tokens=10).index == 快首token.index
+    assert 负载均衡器.select(output_tokens=1000).index == 快解码.index
+    assert 负载均衡器.select().index == 快解码.index  # 未设置 max_tokens 时按 512 估计
+    快解码.stats.in_flight = 5  # (1 + 1000/100) × 6 > 0.2 + 1000/20
+    assert 负载均衡器.select(output_tokens=1000).index == 快首token.index
@@ -0,0 +1,108 @@
+import pytest
+
+from 近似缓存类 import ApproxCache, ApproxCacheConfig, jaccard, normalize_question, shingles
+
+提示词 = "You are a helpful assistant."
+参数 = {"temperature": 0.2}
+回答 = {"status": "success", "message": "用 csv 模块"}
+
+
+def 近似缓存(**config) -> ApproxCache:
+    return ApproxCache(ApproxCacheConfig(enabled=True, **config))
+
+
+def test_规范化去掉空白标点并转为半角小写():
+    assert normalize_question("怎么用 Ｐｙｔｈｏｎ 读取CSV文件?") == "怎么用python读取csv文件"
+    assert shingles("abcd", 3) == {"abc", "bcd"}
+    assert shingles("ab", 3) == {"ab"}
+    assert jaccard(frozenset("ab"), frozenset("bc")) == pytest.approx(1 / 3)
+    assert jaccard(frozenset(), frozenset("a")) == 0.0
+
+
+def test_只是格式不同的问题命中():
+    缓存 = 近似缓存()
+    缓存.put("m", 提示词, "怎么用 Python 读取 CSV 文件?", 参数, 回答)
+    结果 = 缓存.lookup("m", 提示词, "怎么用python读取csv文件", 参数)
+    assert 结果 == ({**回答, "similarity": 1.0}, 1.0)
+
+
+def test_相似度低于阈值时不命中():
+    缓存 = 近似缓存(threshold=0.9)
+    缓存.put("m", 提示词, "请解释一下负载均衡中的EWMA延迟策略", 参数, 回答)
+    改动少 = 缓存.lookup("m", 提示词, "请解释一下负载均衡中的EWMA延迟策略吧", 参数)
+    改动多 = 缓存.lookup("m", 提示词, "请解释一下负载均衡中的最少连接策略", 参数)
+    assert 改动少 is not None and 0.9 <= 改动少[1] < 1
+    assert 改动多 is None
+    统计 = 缓存.stats()
+    assert (统计["hits"], 统计["misses"], 统计["lookups"]) == (1, 1, 2)
+    assert sum(统计["best_similarity_histogram"].values()) == 2
+
+
+def test_LSH找出高相似度的候选而跳过无关问题():
+    缓存 = 近似缓存(threshold=0.5)
+    for i in range(50):
+        缓存.put("m", 提示词, f"第{i}个完全不同的问题内容{i * 7919}", 参数, 回答)
+    缓存.put("m", 提示词, "如何在Linux上查看端口占用情况", 参数, 回答)
+    候选前 = 缓存.counts["candidates"]
+    assert 缓存.lookup("m", 提示词, "如何在Linux上查看端口的占用情况", 参数) is not None
+    assert 缓存.counts["candidates"] - 候选前 < 10
+
+
+def test_签名位相同的比例接近Jaccard相似度():
+    缓存 = 近似缓存(num_perm=256, bands=16)
+    甲 = "请解释一下负载均衡中的EWMA延迟策略和最少连接策略的区别"
+    乙 = "请解释一下负载均衡中的EWMA延迟策略与轮询策略有什么区别"
+    (集合甲, 签名甲), (集合乙, 签名乙) = 缓存._features(甲), 缓存._features(乙)
+    估计 = sum(x == y for x, y in zip(签名甲, 签名乙)) / len(签名甲)
+    assert 估计 == pytest.approx(jaccard(集合甲, 集合乙), abs=0.1)
+
+
+def test_重复写入相同问题覆盖原条目():
+    缓存 = 近似缓存(max_entries=2)
+    缓存.put("m", 提示词, "如何在Linux上查看端口占用情况", 参数, 回答)
+    for i in range(5):
+        缓存.put("m", 提示词, "怎么用 Python 读取 CSV 文件?", 参数, {**回答, "message": f"第{i}次"})
+    缓存.put("m", 提示词, "怎么用python读取csv文件", {"temperature": 0.9}, 回答)  # 范围不同,另存一条
+    结果 = 缓存.lookup("m", 提示词, "怎么用python读取csv文件", 参数)
+    assert 结果 is not None and 结果[0]["message"] == "第4次"
+    统计 = 缓存.stats()
+    assert (统计["size"], 统计["stores"], 统计["evictions"]) == (2, 7, 1)
+    assert 统计["buckets"] == 2 * 缓存.config.bands
+
+
+def test_模型提示词和参数不同的问题互不匹配():
+    缓存 = 近似缓存()
+    问题 = "怎么用 Python 读取 CSV 文件?"
+    缓存.put("m", 提示词, 问题, 参数, 回答)
+    assert 缓存.lookup("n", 提示词, 问题, 参数) is None
+    assert 缓存.lookup("m", "其他提示词", 问题, 参数) is None
+    assert 缓存.lookup("m", 提示词, 问题, {"temperature": 0.9}) is None
+
+
+def test_过短或过长的问题不参与():
+    缓存 = 近似缓存(min_chars=8, max_chars=20)
+    for 问题 in ("你好", "很长的问题" * 10):
+        缓存.put("m", 提示词, 问题, 参数, 回答)
+        assert 缓存.lookup("m", 提示词, 问题, 参数) is None
+    assert (缓存.counts["skipped"], 缓存.counts["stores"], 缓存.stats()["size"]) == (2, 0, 0)
+
+
+def test_过期和淘汰时清理LSH桶(monkeypatch):
+    import 近似缓存类
+    现在 = [100.0]
+    monkeypatch.setattr(近似缓存类.time, "monotonic", lambda: 现在[0])
+    缓存 = 近似缓存(max_entries=2, ttl=10)
+    问题列表 = ["怎么用Python读取CSV文件", "如何在Linux上查看端口占用", "为什么天空是蓝色的呢"]
+    for 问题 in 问题列表:
+        缓存.put("m", 提示词, 问题, 参数, 回答)
+    assert 缓存.lookup("m", 提示词, 问题列表[0], 参数) is None
+    assert 缓存.counts["evictions"] == 1
+    现在[0] += 11
+    assert 缓存.lookup("m", 提示词, 问题列表[1], 参数) is None
+    assert 缓存.counts["expired"] == 1
+    assert 缓存.stats()["buckets"] == 缓存.config.bands  # 只剩一个条目的桶
+
+
+def test_分段数须整除签名长度():
+    with pytest.raises(ValueError):
+        近似缓存(num_perm=64, bands=10)
@@ -0,0 +1,47 @@
+import datetime
+import math
+
+import pytest
+import tomli
+
+from 配置类 import 配置类, 转toml文本
+
+
+def test_内置实现写出的文本能原样读回():
+    数据 = {
+        "title": '引号"反斜杠\\换行\n制表\t删除\x7f',
+        "整数": -3, "小数": 0.25, "开关": True, "无穷": math.inf,
+        "日期": datetime.date(2026, 1, 2),
+        "列表": [1, "二", [3.5]],
+        "内联": [[{"a": 1}], []],
+        "cache": {"enabled": False, "sub table": {"x": "y"}},
+        "ai": [
+            {"url": "http://a/v1", "key": "sk-1", "model": "m", "extra": {"top_p": 0.9}},
+            {"url": "http://b/v1", "key": "sk-2", "model": "n", "weight": 2.0},
+        ],
+    }
+    文本 = 转toml文本(数据)
+    assert tomli.loads(文本) == 数据
+    assert "[[ai]]" in 文本 and '[cache."sub table"]' in 文本
+
+
+def test_不支持的类型抛出TypeError():
+    with pytest.raises(TypeError):
+        转toml文本({"x": object()})
+
+
+def test_写入替换原文件且不留临时文件(tmp_path):
+    路径 = tmp_path / "ai_configs.toml"
+    路径.write_text("# 注释\n[reload]\nwatch = true\n", encoding="utf-8")
+    配置类.写入toml文件(str(路径), {"reload": {"watch": False}, "ai": [{"url": "http://a", "key": "k", "model": "m"}]})
+    assert 配置类.读取toml文件(str(路径)) == {"reload": {"watch": False},
+                                            "ai": [{"url": "http://a", "key": "k", "model": "m"}]}
+    assert [p.name for p in tmp_path.iterdir()] == ["ai_configs.toml"]
+
+
+def test_写入失败时原文件不变(tmp_path):
+    路径 = tmp_path / "ai_configs.toml"
+    路径.write_text("x = 1\n", encoding="utf-8")
+    with pytest.raises(TypeError):
+        配置类.写入toml文件(str(路径), {"x": {1, 2}})
+    assert 路径.read_text(encoding="utf-8") == "x = 1\n"
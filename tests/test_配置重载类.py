@@ -0,0 +1,57 @@
+import asyncio
+
+from 配置重载类 import ConfigWatcher, ReloadConfig
+
+
+def test_文件变化时调用回调且回调出错不影响后续检查(tmp_path, caplog):
+    路径 = tmp_path / "ai_configs.toml"
+    路径.write_text("a = 1\n", encoding="utf-8")
+
+    async def 运行():
+        调用 = []
+
+        async def 回调():
+            调用.append(路径.read_text(encoding="utf-8"))
+            if len(调用) == 1:
+                raise ValueError("不合法")
+
+        监视器 = ConfigWatcher(str(路径), 回调, interval=0.01)
+        监视器.start()
+        await asyncio.sleep(0.05)
+        没有变化时 = len(调用)
+        for 内容 in ("a = 22\n", "a = 333\n"):
+            路径.write_text(内容, encoding="utf-8")
+            await asyncio.sleep(0.05)
+        await 监视器.stop()
+        return 没有变化时, 调用, 监视器._task
+
+    没有变化时, 调用, 任务 = asyncio.run(运行())
+    assert 没有变化时 == 0
+    assert 调用 == ["a = 22\n", "a = 333\n"]
+    assert 任务 is None
+    assert [(记录.name, 记录.levelname) for 记录 in caplog.records] == [("配置重载类", "WARNING")]
+    assert "重新加载配置失败" in caplog.records[0].getMessage()
+
+
+def test_文件被删除时跳过检查(tmp_path):
+    路径 = tmp_path / "ai_configs.toml"
+    路径.write_text("a = 1\n", encoding="utf-8")
+
+    async def 运行():
+        调用 = []
+
+        async def 回调():
+            调用.append(True)
+
+        监视器 = ConfigWatcher(str(路径), 回调, interval=0.01)
+        监视器.start()
+        路径.unlink()
+        await asyncio.sleep(0.05)
+        await 监视器.stop()
+        return 调用
+
+    assert asyncio.run(运行()) == []
+
+
+def test_配置段只接受已知字段():
+    assert ReloadConfig.from_dict({"watch": False, "unknown": 1}) == ReloadConfig(watch=False)
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from conftest import 启动模拟上游, 上游配置
+from AIClass import AIConfig
+from 负载均衡类 import LoadBalancer
+from 调度器类 import Dispatcher, DispatchError
+from 限流类 import RateLimit, RateLimitConfig, RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def 时钟(monkeypatch):
+    import 限流类
+    现在 = [1000.0]
+    monkeypatch.setattr(限流类.time, "monotonic", lambda: 现在[0])
+    return 现在
+
+
+def 配置(key="sk-a", model="m", **额度) -> AIConfig:
+    return AIConfig(url="http://127.0.0.1:9/v1/chat/completions", key=key, model=model, **额度)
+
+
+def test_令牌桶按每分钟额度匀速补充(时钟):
+    桶 = TokenBucket(60)
+    桶.consume(60)
+    assert not 桶.can_afford(1)
+    assert 桶.time_until(1) == pytest.approx(1.0)
+    时钟[0] += 0.5
+    assert 桶.time_until(1) == pytest.approx(0.5)
+    时钟[0] += 1000
+    assert 桶.to_dict() == {"per_minute": 60.0, "available": 60.0}
+
+
+def test_超过容量的请求只需等到桶满(时钟):
+    桶 = TokenBucket(600)
+    assert 桶.can_afford(5000)
+    桶.consume(5000)
+    assert 桶.tokens == -4400
+    assert 桶.time_until(5000) == pytest.approx(500.0)
+
+
+def test_按实际用量多退少补(时钟):
+    额度 = RateLimit(rpm=10, tpm=1000)
+    预留 = 额度.reserve(300)
+    assert (额度.rpm.tokens, 额度.tpm.tokens) == (9, 700)
+    预留.settle(100)
+    预留.settle(999)  # 只修正一次
+    assert 额度.tpm.tokens == 900
+    额度.reserve(300).settle(None)
+    assert 额度.tpm.tokens == 600
+    assert 额度.counts == {"reserved_requests": 2, "reserved_tokens": 600, "reconciled_tokens": -200}
+
+
+def test_同一key和模型共享额度并取较小值(时钟):
+    限流器 = RateLimiter()
+    甲 = 限流器.for_config(配置(rpm=60, tpm=10000))
+    乙 = 限流器.for_config(配置(rpm=30))
+    assert 甲 is 乙
+    assert (甲.rpm.capacity, 甲.tpm.capacity) == (30, 10000)
+    assert 限流器.for_config(配置(model="n", rpm=60)) is not 甲
+    assert 限流器.for_config(配置()) is None
+
+
+def test_热加载放宽额度并丢弃不再使用的额度(时钟):
+    限流器 = RateLimiter()
+    额度 = 限流器.for_config(配置(rpm=10, tpm=1000))
+    额度.reserve(500)
+    限流器.for_config(配置(key="sk-b", rpm=10))
+    限流器.reconfigure([配置(rpm=120), 配置(rpm=60)])
+    assert 限流器.for_config(配置(rpm=60)) is 额度
+    assert (额度.rpm.capacity, 额度.rpm.tokens, 额度.tpm) == (60, 9, None)
+    assert [项["key"] for 项 in 限流器.stats()["limits"]] == ["…"]
+
+
+def test_估算提示词和回答token数():
+    限流器 = RateLimiter(RateLimitConfig(chars_per_token=2, estimated_output_tokens=100))
+    assert 限流器.estimate("系统" * 5, "问题" * 10) == 15 + 100
+    assert 限流器.estimate_output(30) == 15
+
+
+def test_额度用尽的上游被跳过():
+    async def 运行():
+        async with 启动模拟上游() as (url, 上游):
+            上游列表 = 上游配置(url, count=2)
+            上游列表[0].rpm = 1
+            限流器 = RateLimiter()
+            调度器 = Dispatcher(LoadBalancer(上游列表, rate_limiter=限流器), rate_limiter=限流器)
+            结果 = [await 调度器.ask(f"问题{i}") for i in range(3)]
+            return [[记录["index"] for 记录 in 尝试记录] for _, 尝试记录 in 结果]
+
+    assert asyncio.run(运行()) == [[0], [1], [1]]
+
+
+def test_全部额度用尽时返回429():
+    async def 运行():
+        async with 启动模拟上游() as (url, 上游):
+            上游列表 = 上游配置(url, count=1)
+            上游列表[0].rpm = 1
+            限流器 = RateLimiter()
+            调度器 = Dispatcher(LoadBalancer(上游列表, rate_limiter=限流器), rate_limiter=限流器)
+            await 调度器.ask("问题")
+            with pytest.raises(DispatchError) as 错误:
+                await 调度器.ask("另一个问题")
+            return 错误.value, 上游.统计["requests"]
+
+    错误, 请求数 = asyncio.run(运行())
+    assert (错误.status_code, 请求数) == (429, 1)
+    assert 55 < 错误.retry_after <= 60
@@ -0,0 +1,363 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, fields
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from 指标类 import (ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT, TENANT_CALLS, TENANT_OUTPUT_TOKENS,
+                 TENANT_QUEUE_WAIT)
+from 租户类 import ANONYMOUS, TenantRegistry
+
+
+@dataclass
+class AdmissionConfig:
+    """准入控制配置,对应 ai_configs.toml 中的 [admission] 段"""
+    enabled: bool = True
+    max_concurrency: Optional[int] = 64         # 所有上游合计的并发调用上限,None 为不限制
+    upstream_concurrency: Optional[int] = None  # 每个上游的默认并发上限,[[ai]] 中的 max_concurrency 优先
+    max_queue: int = 100                        # 同时排队等待名额的请求数上限,超出立即以429拒绝
+    queue_timeout: float = 5.0                  # 单个请求最长排队时间(秒),超时以503拒绝
+    retry_after: float = 1.0                    # 拒绝时通过 Retry-After 建议客户端等待的秒数
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "AdmissionConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+class AdmissionRejected(Exception):
+    """排队已满或排队超时,请求未被放行
+
+    Attributes:
+        reason (str): queue_full 或 timeout
+        status_code (int): 应返回给客户端的状态码,排队已满为429,排队超时为503
+        retry_after (float): 建议客户端等待的秒数
+    """
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = 429 if reason == "queue_full" else 503
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("upstream", "future", "tenant", "tag")
+
+    def __init__(self, upstream: int, future: asyncio.Future, tenant: str = ANONYMOUS, tag: float = 0.0):
+        self.upstream = upstream
+        self.future = future
+        self.tenant = tenant
+        self.tag = tag  # 公平排队的虚拟开始时间,越小越先放行
+
+
+class _TenantState:
+    """单个调用方的在途数、排队数和统计"""
+    __slots__ = ("in_flight", "queued", "last_finish", "counts", "waits", "completions")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.queued = 0
+        self.last_finish = 0.0  # 该调用方最后一个排队请求的虚拟结束时间
+        self.counts = {"admitted": 0, "queued": 0, "completed": 0, "rejected": 0, "output_tokens": 0}
+        self.waits: Deque[float] = deque(maxlen=1000)
+        self.completions: Deque[Tuple[float, float]] = deque()  # (完成时刻, 回答token数),用于计算窗口内吞吐
+
+
+class AdmissionController:
+    """准入控制:限制全局和每个上游的并发调用数,超出的请求在有界队列中排队
+
+    名额释放时直接移交给队列中排在最前、其上游也有空闲名额的请求,不会被新来的请求插队;
+    队列已满或等待超过 queue_timeout(以及请求自身的剩余预算)时立即拒绝。
+
+    传入 tenants 时按调用方做加权公平排队(start-time fair queueing):请求入队时获得虚拟开始时间
+    max(当前虚拟时间, 该调用方上一个请求的虚拟结束时间),虚拟结束时间再加 1/权重,放行时选虚拟开始时间最小的。
+    积压的调用方按权重分享释放出的名额,空闲的调用方不积攒额度;只有一个调用方时等同于先来后到。
+    调用方的并发配额用尽时,其请求即使有空闲名额也要排队,名额留给其他调用方。
+
+    Example:
+        >>> 准入控制 = AdmissionController(AdmissionConfig(max_concurrency=32), {0: 8, 1: None})
+        >>> await 准入控制.acquire(0, timeout=5, tenant="web")
+        >>> try:
+        ...     ...  # 调用上游 0
+        ... finally:
+        ...     准入控制.release(0, tenant="web", output_tokens=120)
+    """
+
+    def __init__(self, config: Optional[AdmissionConfig] = None, upstream_limits: Optional[Dict[int, Optional[int]]] = None,
+                 tenants: Optional[TenantRegistry] = None):
+        self.config = config or AdmissionConfig()
+        self.tenants = tenants or TenantRegistry()
+        self._tenant_states: Dict[str, _TenantState] = {}
+        self._virtual_time = 0.0
+        self.upstream_limits: Dict[int, Optional[int]] = {
+            索引: 上限 if 上限 is not None else self.config.upstream_concurrency
+            for 索引, 上限 in (upstream_limits or {}).items()
+        }
+        self._in_flight: Dict[int, int] = {索引: 0 for 索引 in self.upstream_limits}
+        self._total = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self.counts = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    def update_limits(self, upstream_limits: Dict[int, Optional[int]]) -> None:
+        """热加载上游列表后更新每个上游的并发上限;已删除上游的在途调用仍按原编号正常释放"""
+        self.upstream_limits = {
+            索引: 上限 if 上限 is not None else self.config.upstream_concurrency
+            for 索引, 上限 in upstream_limits.items()
+        }
+        for 索引 in self.upstream_limits:
+            self._in_flight.setdefault(索引, 0)
+        self._wake()
+
+    def has_capacity(self, upstream: int, tenant: Optional[str] = None) -> bool:
+        """全局、该上游以及(指定 tenant 时)该调用方的配额都还有空位"""
+        if self.config.max_concurrency is not None and self._total >= self.config.max_concurrency:
+            return False
+        上限 = self.upstream_limits.get(upstream, self.config.upstream_concurrency)
+        if 上限 is not None and self._in_flight.get(upstream, 0) >= 上限:
+            return False
+        if tenant is None:
+            return True
+        配额 = self.tenants.policy(tenant).max_concurrency
+        return 配额 is None or self._tenant(tenant).in_flight < 配额
+
+    def _tenant(self, tenant: str) -> _TenantState:
+        状态 = self._tenant_states.get(tenant)
+        if 状态 is None:
+            状态 = self._tenant_states[tenant] = _TenantState()
+        return 状态
+
+    def saturated(self) -> Set[int]:
+        """并发已满的上游索引(全局已满时为全部上游)"""
+        return {索引 for 索引 in self.upstream_limits if not self.has_capacity(索引)}
+
+    async def acquire(self, upstream: int, timeout: float, tenant: Optional[str] = None) -> float:
+        """为 tenant 的一次上游调用取得名额,返回排队等待的秒数;无法放行时抛出 AdmissionRejected"""
+        tenant = tenant or ANONYMOUS
+        if self.has_capacity(upstream, tenant):
+            self._take(upstream, tenant)
+            self._record_wait(upstream, tenant, 0.0)
+            return 0.0
+        策略 = self.tenants.policy(tenant)
+        状态 = self._tenant(tenant)
+        if len(self._waiters) >= self.config.max_queue or (策略.max_queue is not None and 状态.queued >= 策略.max_queue):
+            self.counts["rejected_queue_full"] += 1
+            状态.counts["rejected"] += 1
+            ADMISSION_REJECTED.inc(("queue_full",))
+            上限 = self.config.max_queue if len(self._waiters) >= self.config.max_queue else 策略.max_queue
+            raise AdmissionRejected(f"排队请求已达上限({上限}),请稍后重试", "queue_full", self.config.retry_after)
+
+        开始时间 = time.monotonic()
+        虚拟开始 = max(self._virtual_time, 状态.last_finish)
+        状态.last_finish = 虚拟开始 + 1.0 / 策略.weight
+        等待者 = _Waiter(upstream, asyncio.get_running_loop().create_future(), tenant, 虚拟开始)
+        self._waiters.append(等待者)
+        状态.queued += 1
+        self.counts["queued"] += 1
+        状态.counts["queued"] += 1
+        ADMISSION_QUEUE_DEPTH.set((), len(self._waiters))
+        排队上限 = 策略.queue_timeout if 策略.queue_timeout is not None else self.config.queue_timeout
+        try:
+            await asyncio.wait_for(等待者.future, timeout=max(0.0, min(timeout, 排队上限)))
+        except asyncio.TimeoutError:
+            if 等待者.future.done() and not 等待者.future.cancelled():
+                return self._record_wait(upstream, tenant, time.monotonic() - 开始时间)
+            self._remove(等待者)
+            self.counts["rejected_timeout"] += 1
+            状态.counts["rejected"] += 1
+            ADMISSION_REJECTED.inc(("timeout",))
+            raise AdmissionRejected(f"排队等待上游名额超时({time.monotonic() - 开始时间:.1f}秒)",
+                                    "timeout", self.config.retry_after)
+        except asyncio.CancelledError:
+            if 等待者.future.done() and not 等待者.future.cancelled():
+                # 名额已经移交过来,但调用方已放弃,转交给下一个等待者
+                self._transfer_slot(upstream, tenant)
+            else:
+                self._remove(等待者)
+            raise
+        return self._record_wait(upstream, tenant, time.monotonic() - 开始时间)
+
+    def release(self, upstream: int, tenant: Optional[str] = None, output_tokens: Optional[float] = None) -> None:
+        """一次上游调用结束;output_tokens 为回答的token数,计入该调用方的吞吐"""
+        tenant = tenant or ANONYMOUS
+        状态 = self._free(upstream, tenant)
+        状态.counts["completed"] += 1
+        TENANT_CALLS.inc((tenant,))
+        if output_tokens:
+            状态.counts["output_tokens"] += round(output_tokens)
+            TENANT_OUTPUT_TOKENS.inc((tenant,), round(output_tokens))
+        现在 = time.monotonic()
+        状态.completions.append((现在, output_tokens or 0))
+        self._trim_completions(状态, 现在)
+        self._wake()
+
+    def _transfer_slot(self, upstream: int, tenant: str) -> None:
+        """移交过来的名额还没用就被调用方放弃:撤销这次放行并转交给下一个等待者,不计为完成的调用"""
+        状态 = self._free(upstream, tenant)
+        self.counts["admitted"] -= 1
+        状态.counts["admitted"] -= 1
+        self._wake()
+
+    def _free(self, upstream: int, tenant: str) -> _TenantState:
+        self._in_flight[upstream] = self._in_flight.get(upstream, 0) - 1
+        if not self._in_flight[upstream] and upstream not in self.upstream_limits:
+            del self._in_flight[upstream]  # 已被热加载删除的上游,最后一个调用结束
+        self._total -= 1
+        状态 = self._tenant(tenant)
+        状态.in_flight -= 1
+        return 状态
+
+    def _take(self, upstream: int, tenant: str) -> None:
+        self._in_flight[upstream] = self._in_flight.get(upstream, 0) + 1
+        self._total += 1
+        self.counts["admitted"] += 1
+        状态 = self._tenant(tenant)
+        状态.in_flight += 1
+        状态.counts["admitted"] += 1
+
+    def _wake(self) -> None:
+        """反复把空闲名额移交给虚拟开始时间最小、其上游和调用方配额都有空位的等待者"""
+        while self._waiters:
+            if self.config.max_concurrency is not None and self._total >= self.config.max_concurrency:
+                break
+            最佳: Optional[_Waiter] = None
+            for 等待者 in list(self._waiters):
+                if 等待者.future.done():
+                    self._discard(等待者)
+                elif (最佳 is None or 等待者.tag < 最佳.tag) and self.has_capacity(等待者.upstream, 等待者.tenant):
+                    最佳 = 等待者
+            if 最佳 is None:
+                break
+            self._discard(最佳)
+            self._virtual_time = max(self._virtual_time, 最佳.tag)
+            self._take(最佳.upstream, 最佳.tenant)
+            最佳.future.set_result(None)
+        ADMISSION_QUEUE_DEPTH.set((), len(self._waiters))
+
+    def _discard(self, waiter: _Waiter) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+        self._tenant(waiter.tenant).queued -= 1
+
+    def _remove(self, waiter: _Waiter) -> None:
+        self._discard(waiter)
+        ADMISSION_QUEUE_DEPTH.set((), len(self._waiters))
+
+    def _record_wait(self, upstream: int, tenant: str, seconds: float) -> float:
+        self._waits.append(seconds)
+        self._tenant(tenant).waits.append(seconds)
+        ADMISSION_WAIT.observe((str(upstream),), seconds)
+        TENANT_QUEUE_WAIT.observe((tenant,), seconds)
+        return seconds
+
+    def _trim_completions(self, state: _TenantState, now: float) -> None:
+        截止 = now - self.tenants.config.window
+        while state.completions and state.completions[0][0] < 截止:
+            state.completions.popleft()
+
+    @staticmethod
+    def _percentile(values: Any, p: float) -> float:
+        排序后 = sorted(values)
+        return round(排序后[min(len(排序后) - 1, int(p * len(排序后)))], 4) if 排序后 else 0.0
+
+    def tenant_stats(self) -> Dict[str, Any]:
+        """每个调用方的权重、配额、在途和排队数、排队时间分位数,以及最近 window 秒内的吞吐"""
+        现在 = time.monotonic()
+        窗口 = self.tenants.config.window
+        结果 = {}
+        for 名称 in sorted(set(self._tenant_states) | set(self.tenants.tenants)):
+            状态 = self._tenant(名称)
+            self._trim_completions(状态, 现在)
+            策略 = self.tenants.policy(名称)
+            结果[名称] = {
+                **状态.counts,
+                "weight": 策略.weight,
+                "max_concurrency": 策略.max_concurrency,
+                "in_flight": 状态.in_flight,
+                "queue_depth": 状态.queued,
+                "wait_p50": self._percentile(状态.waits, 0.5),
+                "wait_p95": self._percentile(状态.waits, 0.95),
+                "wait_max": round(max(状态.waits), 4) if 状态.waits else 0.0,
+                "calls_per_second": round(len(状态.completions) / 窗口, 3),
+                "output_tokens_per_second": round(sum(t for _, t in 状态.completions) / 窗口, 1),
+            }
+        return 结果
+
+    def stats(self) -> Dict[str, Any]:
+        等待时间 = sorted(self._waits)
+
+        def 分位数(p: float) -> float:
+            return round(等待时间[min(len(等待时间) - 1, int(p * len(等待时间)))], 4) if 等待时间 else 0.0
+
+        return {
+            **self.counts,
+            "in_flight": self._total,
+            "max_concurrency": self.config.max_concurrency,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.config.max_queue,
+            "queue_timeout": self.config.queue_timeout,
+            "wait_p50": 分位数(0.5),
+            "wait_p95": 分位数(0.95),
+            "wait_max": round(等待时间[-1], 4) if 等待时间 else 0.0,
+            "upstreams": {
+                索引: {
+                    "in_flight": self._in_flight.get(索引, 0),
+                    "limit": 上限,
+                    "waiting": sum(1 for 等待者 in self._waiters if 等待者.upstream == 索引),
+                }
+                for 索引, 上限 in self.upstream_limits.items()
+            },
+        }
+
+
+class UpstreamSlots:
+    """按上游限制某一类请求(例如批处理)同时进行的上游调用数,与 AdmissionController 的名额相互独立
+
+    调度器选择上游时跳过名额已满的上游,调用期间占用所选上游的一个名额;
+    可选的上游都已满时等待任意名额释放后重新选择,因此各上游的调用数都不超过 per_upstream。
+
+    Example:
+        >>> 名额 = UpstreamSlots(4)
+        >>> 结果, 尝试记录 = await 调度器.ask("问题", slots=名额)
+    """
+
+    def __init__(self, per_upstream: int):
+        self.per_upstream = max(1, per_upstream)
+        self.in_flight: Dict[int, int] = {}
+        self.peak: Dict[int, int] = {}  # 各上游同时进行的调用数峰值
+        self._waiters: List[asyncio.Future] = []
+
+    def saturated(self) -> Set[int]:
+        """名额已满的上游索引"""
+        return {索引 for 索引, 数量 in self.in_flight.items() if 数量 >= self.per_upstream}
+
+    def acquire(self, upstream: int) -> None:
+        数量 = self.in_flight[upstream] = self.in_flight.get(upstream, 0) + 1
+        self.peak[upstream] = max(self.peak.get(upstream, 0), 数量)
+
+    def release(self, upstream: int) -> None:
+        数量 = self.in_flight.get(upstream, 0) - 1
+        if 数量 > 0:
+            self.in_flight[upstream] = 数量
+        else:
+            self.in_flight.pop(upstream, None)
+        for 等待 in self._waiters:
+            if not 等待.done():
+                等待.set_result(None)
+        self._waiters.clear()
+
+    async def wait(self, timeout: float) -> None:
+        """等待任意名额释放,最多 timeout 秒"""
+        等待 = asyncio.get_running_loop().create_future()
+        self._waiters.append(等待)
+        try:
+            await asyncio.wait([等待], timeout=max(0.0, timeout))
+        finally:
+            if 等待 in self._waiters:
+                self._waiters.remove(等待)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"per_upstream": self.per_upstream, "in_flight": dict(self.in_flight), "peak": dict(self.peak)}
@@ -0,0 +1,71 @@
+"""AI 服务器的命令行入口
+
+解析命令行参数后以导入字符串交给 uvicorn 启动,服务器模块只在工作进程中导入一次;
+本模块只依赖标准库和 tomli,多进程启动时被重新导入也几乎没有开销。
+
+用法:
+    python 启动服务器.py
+    python 启动服务器.py --host 127.0.0.1 --port 8000 --config 基准测试/模拟配置.toml --workers 4
+    python AI服务器自定义接口.py --port 8000      # 直接运行服务器文件时在新进程中转交给本入口
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from 配置类 import 配置类
+
+脚本目录 = Path(__file__).resolve().parent
+APP = "AI服务器自定义接口:app"
+# 与 多进程共享类.WORKERS_ENV 相同;这里不导入该模块,以免启动器加载服务器的依赖
+WORKERS_ENV = "AI_SERVER_WORKERS"
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="启动 AI 负载均衡服务器")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=5000, help="监听端口")
+    parser.add_argument("--config", default=None,
+                        help="配置文件路径,相对当前目录;默认取环境变量 AI_CONFIGS,否则为本目录下的 ai_configs.toml")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数,默认取配置文件 [workers] workers")
+    parser.add_argument("--log-level", default="info", help="uvicorn 的日志级别")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.config is not None:
+        配置路径 = Path(args.config).resolve()
+    else:
+        # 环境变量和默认值中的相对路径按本目录解析,与服务器模块的约定一致
+        配置路径 = 脚本目录 / os.environ.get("AI_CONFIGS", "ai_configs.toml")
+    if not 配置路径.is_file():
+        print(f"配置文件不存在: {配置路径}", file=sys.stderr)
+        return 2
+    工作进程数 = args.workers
+    if 工作进程数 is None:
+        工作进程数 = int(配置类.读取toml文件(配置路径).get("workers", {}).get("workers", 1))
+    if 工作进程数 < 1:
+        print("--workers 至少为 1", file=sys.stderr)
+        return 2
+
+    # 服务器模块在导入时读取这两个环境变量;多进程时子进程继承环境和当前目录
+    os.environ["AI_CONFIGS"] = str(配置路径)
+    if 工作进程数 > 1:
+        os.environ[WORKERS_ENV] = str(工作进程数)
+    else:
+        os.environ.pop(WORKERS_ENV, None)
+    配置类.切换到脚本所在目录()
+    if sys.platform.startswith("win"):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    import uvicorn
+    uvicorn.run(APP, host=args.host, port=args.port, workers=工作进程数, log_level=args.log_level,
+                app_dir=str(脚本目录))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""SSE 流解析的基准测试
+
+生成若干 MB 的合成 chat.completion.chunk 流(含角色、结束原因和 [DONE] 事件),按随机大小切成网络块,
+对比三种实现的吞吐和峰值内存:
+
+- 旧实现: 逐行 decode+strip、json.loads、full_response += content(要求每次迭代恰好是一整行,
+  因此按行输入,不计 aiohttp 按行切分的开销;按网络块输入时会解析出错)
+- 新实现(json): SSE解析类 的字节级增量解析,强制使用标准库 json
+- 新实现(orjson): 同上,使用 orjson(未安装时跳过)
+
+用法:
+    python 基准测试/SSE解析基准.py --mb 8 --repeat 3
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import SSE解析类
+from SSE解析类 import iter_content
+
+
+def 生成流(目标字节数: int, 种子: int) -> bytes:
+    随机 = random.Random(种子)
+    字表 = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理"
+    def 事件(delta: dict, finish=None) -> bytes:
+        return b"data: " + json.dumps({
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1700000000,
+            "model": "doubao-1-5-lite-32k-250115",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n\n"
+
+    部分 = [事件({"role": "assistant", "content": ""})]
+    大小 = len(部分[0])
+    while 大小 < 目标字节数:
+        片段 = 事件({"content": "".join(随机.choice(字表) for _ in range(随机.randint(1, 6)))})
+        部分.append(片段)
+        大小 += len(片段)
+    部分.append(事件({}, finish="stop"))
+    部分.append(b"data: [DONE]\n\n")
+    return b"".join(部分)
+
+
+def 切块(数据: bytes, 种子: int, 最大块: int = 4096) -> list:
+    随机 = random.Random(种子)
+    块列表, 位置 = [], 0
+    while 位置 < len(数据):
+        长度 = 随机.randint(1, 最大块)
+        块列表.append(数据[位置:位置 + 长度])
+        位置 += 长度
+    return 块列表
+
+
+async def _异步迭代(项列表):
+    for 项 in 项列表:
+        yield 项
+
+
+async def 旧实现(行列表) -> str:
+    full_response = ""
+    async for line in _异步迭代(行列表):
+        if line:
+            line = line.decode('utf-8').strip()
+            if line.startswith('data: '):
+                data = line[6:]
+                if data == '[DONE]':
+                    continue
+                try:
+                    json_data = json.loads(data)
+                    content = json_data['choices'][0]['delta'].get('content', '')
+                    full_response += content
+                except json.JSONDecodeError:
+                    pass
+    return full_response
+
+
+async def 新实现(块列表) -> str:
+    return "".join([内容 async for 内容 in iter_content(_异步迭代(块列表))])
+
+
+def 计时(协程工厂, 输入, 重复: int):
+    最佳 = float("inf")
+    结果 = None
+    for _ in range(重复):
+        开始 = time.perf_counter()
+        结果 = asyncio.run(协程工厂(输入))
+        最佳 = min(最佳, time.perf_counter() - 开始)
+    tracemalloc.start()
+    asyncio.run(协程工厂(输入))
+    _, 峰值 = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return 结果, 最佳, 峰值
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比新旧 SSE 解析实现")
+    parser.add_argument("--mb", type=float, default=8, help="合成流的大小(MB)")
+    parser.add_argument("--repeat", type=int, default=3, help="每种实现的重复次数,取最快一次")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    流 = 生成流(int(args.mb * 1024 * 1024), args.seed)
+    行列表 = 流.splitlines(keepends=True)
+    块列表 = 切块(流, args.seed)
+    print(f"流大小: {len(流) / 1024 / 1024:.2f} MB | 行数: {len(行列表)} | 网络块数: {len(块列表)}")
+
+    原始loads = SSE解析类._loads
+    场景 = [("旧实现(按行输入)", 旧实现, 行列表, json.loads)]
+    场景.append(("新实现 json(按块输入)", 新实现, 块列表, json.loads))
+    if SSE解析类.orjson is not None:
+        场景.append(("新实现 orjson(按块输入)", 新实现, 块列表, SSE解析类.orjson.loads))
+
+    参考结果 = None
+    for 名称, 实现, 输入, 解码函数 in 场景:
+        SSE解析类._loads = 解码函数
+        结果, 耗时, 峰值 = 计时(实现, 输入, args.repeat)
+        if 参考结果 is None:
+            参考结果 = 结果
+        print(f"{名称}: {耗时 * 1000:.1f} ms | {len(流) / 1024 / 1024 / 耗时:.1f} MB/s | "
+              f"峰值内存 {峰值 / 1024 / 1024:.2f} MB | 输出一致: {结果 == 参考结果}")
+    SSE解析类._loads = 原始loads
+
+    try:
+        旧结果按块正确 = asyncio.run(旧实现(块列表)) == 参考结果
+    except UnicodeDecodeError as e:  # 多字节字符被切在两个块之间
+        旧结果按块正确 = f"False ({e.reason})"
+    print(f"旧实现按网络块输入时输出是否正确: {旧结果按块正确}")
+
+
+if __name__ == "__main__":
+    main()
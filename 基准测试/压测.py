@@ -0,0 +1,275 @@
+"""异步开环压测工具
+
+以固定的目标 RPS(开环:按时间表发出请求,不等待前一个请求完成)或固定并发数(闭环)压测服务器的
+/chat、/chat/stream 或 /v1/chat/completions,用 HDR 风格的对数分桶直方图记录首token延迟和总延迟,
+结果可导出为 JSON,并用 --compare 对比两次运行。
+
+开环模式下延迟从计划发出时刻算起,客户端来不及发出时产生的排队也计入延迟,避免协调遗漏
+(coordinated omission);"发送滞后" 一栏为实际发出时刻比计划晚的时间,明显增大说明压测机本身成了瓶颈。
+流式接口的首token延迟为收到第一段响应体的时间(服务器在首个增量到达后才开始返回响应体)。
+
+用法:
+    python 基准测试/压测.py --route /chat/stream --rps 50 --duration 30 --output 结果.json
+    python 基准测试/压测.py --route /chat --concurrency 16 --duration 30
+    python 基准测试/压测.py --compare 旧结果.json 新结果.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+
+class HDR直方图:
+    """HDR 风格的直方图:按 2 的幂分段,每段内线性细分,相对误差不超过 10^-有效数字
+
+    值以微秒整数记录,内存只与覆盖的数量级有关,与样本数无关;多个直方图可按桶合并。
+    """
+
+    def __init__(self, 有效数字: int = 3):
+        self.有效数字 = 有效数字
+        self.位数 = (2 * 10 ** 有效数字 - 1).bit_length()
+        self.子桶数 = 1 << self.位数
+        self.半 = self.子桶数 >> 1
+        self.桶: Counter = Counter()
+        self.数量 = 0
+        self.总和 = 0
+        self.最小 = None
+        self.最大 = 0
+
+    def 索引(self, 值: int) -> int:
+        指数 = max(0, 值.bit_length() - self.位数)
+        return 指数 * self.半 + (值 >> 指数)
+
+    def 桶上界(self, 索引: int) -> int:
+        """该桶内的最大值(与 HdrHistogram 的 highestEquivalentValue 一致)"""
+        if 索引 < self.子桶数:
+            return 索引
+        指数 = 索引 // self.半 - 1
+        子桶 = 索引 - 指数 * self.半
+        return ((子桶 + 1) << 指数) - 1
+
+    def 记录秒(self, 秒: float) -> None:
+        值 = max(0, int(秒 * 1_000_000))
+        self.桶[self.索引(值)] += 1
+        self.数量 += 1
+        self.总和 += 值
+        self.最小 = 值 if self.最小 is None else min(self.最小, 值)
+        self.最大 = max(self.最大, 值)
+
+    def 分位数毫秒(self, p: float) -> float:
+        if not self.数量:
+            return 0.0
+        目标 = max(1, round(p * self.数量))
+        累计 = 0
+        for 索引 in sorted(self.桶):
+            累计 += self.桶[索引]
+            if 累计 >= 目标:
+                return min(self.桶上界(索引), self.最大) / 1000
+        return self.最大 / 1000
+
+    def 汇总(self) -> Dict[str, Any]:
+        return {
+            "count": self.数量,
+            "min_ms": (self.最小 or 0) / 1000,
+            "mean_ms": round(self.总和 / self.数量 / 1000, 3) if self.数量 else 0.0,
+            **{f"p{str(p * 100).rstrip('0').rstrip('.')}_ms": self.分位数毫秒(p)
+               for p in (0.5, 0.75, 0.9, 0.95, 0.99, 0.999)},
+            "max_ms": self.最大 / 1000,
+        }
+
+    def 导出(self) -> Dict[str, Any]:
+        """汇总 + 原始桶计数(索引: 数量),可用于合并或重新计算任意分位数"""
+        return {**self.汇总(), "significant_figures": self.有效数字,
+                "buckets": {str(索引): 数量 for 索引, 数量 in sorted(self.桶.items())}}
+
+
+class 压测:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.首token = HDR直方图()
+        self.总延迟 = HDR直方图()
+        self.发送滞后 = HDR直方图()
+        self.状态码: Counter = Counter()
+        self.错误: Counter = Counter()
+        self.已发出 = 0
+        self.成功 = 0
+        self.丢弃 = 0
+        self.进行中 = 0
+        self.最大进行中 = 0
+        self.每秒完成: Counter = Counter()
+
+    def 请求参数(self, 序号: int) -> Dict[str, Any]:
+        问题 = self.args.question if self.args.same_question else f"{self.args.question} #{序号}"
+        if self.args.route == "/v1/chat/completions":
+            return {"messages": [{"role": "user", "content": 问题}], "stream": not self.args.no_stream}
+        return {"问题": 问题}
+
+    async def 单次请求(self, session: aiohttp.ClientSession, 序号: int, 计划时刻: float, 记录: bool) -> None:
+        实际时刻 = time.perf_counter()
+        self.进行中 += 1
+        self.最大进行中 = max(self.最大进行中, self.进行中)
+        首token时刻: Optional[float] = None
+        状态 = "error"
+        try:
+            async with session.post(self.args.url + self.args.route, json=self.请求参数(序号)) as 响应:
+                状态 = str(响应.status)
+                async for 块 in 响应.content.iter_any():
+                    if 首token时刻 is None:
+                        首token时刻 = time.perf_counter()
+                    # 流式接口中途失败时以 error 事件结束,状态码仍为 200
+                    if 响应.status == 200 and (b"event: error" in 块 or b'data: {"error"' in 块):
+                        状态 = "stream_error"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            状态 = type(e).__name__
+        finally:
+            self.进行中 -= 1
+        结束时刻 = time.perf_counter()
+        if not 记录:
+            return
+        self.状态码[状态] += 1
+        self.每秒完成[int(结束时刻 - self.开始时刻)] += 1
+        self.发送滞后.记录秒(实际时刻 - 计划时刻)
+        if 状态 != "200":
+            self.错误[状态] += 1
+            return
+        self.成功 += 1
+        self.总延迟.记录秒(结束时刻 - 计划时刻)
+        if 首token时刻 is not None and self.args.route != "/chat":
+            self.首token.记录秒(首token时刻 - 计划时刻)
+
+    async def 开环(self, session: aiohttp.ClientSession, 结束: float) -> None:
+        """按目标 RPS 的时间表发出请求(--arrival poisson 时间隔服从指数分布),不等待响应"""
+        随机 = random.Random(self.args.seed)
+        任务集合 = set()
+        计划时刻 = self.开始时刻
+        序号 = 0
+        while 计划时刻 < 结束:
+            等待 = 计划时刻 - time.perf_counter()
+            if 等待 > 0:
+                await asyncio.sleep(等待)
+            记录 = 计划时刻 >= self.开始时刻 + self.args.warmup
+            if self.进行中 >= self.args.max_outstanding:
+                if 记录:
+                    self.丢弃 += 1
+            else:
+                任务 = asyncio.create_task(self.单次请求(session, 序号, 计划时刻, 记录))
+                任务集合.add(任务)
+                任务.add_done_callback(任务集合.discard)
+                self.已发出 += 记录
+            序号 += 1
+            间隔 = 1 / self.args.rps
+            计划时刻 += 随机.expovariate(self.args.rps) if self.args.arrival == "poisson" else 间隔
+        if 任务集合:
+            await asyncio.wait(任务集合)
+
+    async def 闭环(self, session: aiohttp.ClientSession, 结束: float) -> None:
+        """固定并发:每个工作协程收到响应后立即发出下一个请求"""
+        序号 = iter(range(sys.maxsize))
+
+        async def 工作():
+            while (现在 := time.perf_counter()) < 结束:
+                记录 = 现在 >= self.开始时刻 + self.args.warmup
+                self.已发出 += 记录
+                await self.单次请求(session, next(序号), 现在, 记录)
+
+        await asyncio.gather(*(工作() for _ in range(self.args.concurrency)))
+
+    async def 运行(self) -> Dict[str, Any]:
+        超时 = aiohttp.ClientTimeout(total=self.args.timeout)
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=超时) as session:
+            self.开始时刻 = time.perf_counter()
+            结束 = self.开始时刻 + self.args.warmup + self.args.duration
+            if self.args.concurrency:
+                await self.闭环(session, 结束)
+            else:
+                await self.开环(session, 结束)
+            总用时 = time.perf_counter() - self.开始时刻 - self.args.warmup
+        return self.结果(总用时)
+
+    def 结果(self, 总用时: float) -> Dict[str, Any]:
+        return {
+            "config": {k: v for k, v in vars(self.args).items() if k not in ("output", "compare")},
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "summary": {
+                "sent": self.已发出,
+                "completed": sum(self.状态码.values()),
+                "succeeded": self.成功,
+                "dropped": self.丢弃,
+                "success_rate": round(self.成功 / self.已发出, 4) if self.已发出 else 0.0,
+                "throughput_rps": round(self.成功 / 总用时, 2) if 总用时 > 0 else 0.0,
+                "max_outstanding": self.最大进行中,
+            },
+            "status_codes": dict(self.状态码),
+            "errors": dict(self.错误),
+            "ttft": self.首token.导出(),
+            "latency": self.总延迟.导出(),
+            "send_lag": self.发送滞后.导出(),
+            "completed_per_second": {str(秒): 数量 for 秒, 数量 in sorted(self.每秒完成.items())},
+        }
+
+
+def 打印结果(结果: Dict[str, Any]) -> None:
+    汇总 = 结果["summary"]
+    print(f"发出 {汇总['sent']} | 成功 {汇总['succeeded']} ({汇总['success_rate'] * 100:.2f}%) | "
+          f"客户端丢弃 {汇总['dropped']} | 吞吐 {汇总['throughput_rps']} req/s | 最大并发 {汇总['max_outstanding']}")
+    print(f"状态码: {结果['status_codes']}")
+    列 = ["p50_ms", "p90_ms", "p99_ms", "p99.9_ms", "max_ms"]
+    print(f"{'':<10}" + "".join(f"{名称[:-3]:>10}" for 名称 in 列))
+    for 名称, 键 in (("首token", "ttft"), ("总延迟", "latency"), ("发送滞后", "send_lag")):
+        if 结果[键]["count"]:
+            print(f"{名称:<8}" + "".join(f"{结果[键][列名]:>10.1f}" for 列名 in 列) + " (ms)")
+
+
+def 对比(旧路径: str, 新路径: str) -> None:
+    """逐项对比两次运行的吞吐和延迟分位数"""
+    旧 = json.loads(open(旧路径, encoding="utf-8").read())
+    新 = json.loads(open(新路径, encoding="utf-8").read())
+    print(f"{'指标':<22}{'旧':>12}{'新':>12}{'变化':>10}")
+    项目 = [("summary", "throughput_rps"), ("summary", "success_rate")]
+    项目 += [(组, 列) for 组 in ("ttft", "latency") for 列 in ("p50_ms", "p90_ms", "p99_ms", "p99.9_ms", "max_ms")]
+    for 组, 列 in 项目:
+        旧值, 新值 = 旧[组].get(列, 0), 新[组].get(列, 0)
+        变化 = f"{(新值 - 旧值) / 旧值 * 100:+.1f}%" if 旧值 else "-"
+        print(f"{组 + '.' + 列:<22}{旧值:>12}{新值:>12}{变化:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="异步开环压测工具")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="服务器地址")
+    parser.add_argument("--route", choices=["/chat", "/chat/stream", "/v1/chat/completions"], default="/chat/stream")
+    parser.add_argument("--rps", type=float, default=10, help="开环模式的目标每秒请求数")
+    parser.add_argument("--arrival", choices=["constant", "poisson"], default="constant", help="开环模式的到达间隔分布")
+    parser.add_argument("--concurrency", type=int, default=0, help="设置后改为闭环模式,保持该并发数")
+    parser.add_argument("--duration", type=float, default=30, help="计入结果的压测时长(秒)")
+    parser.add_argument("--warmup", type=float, default=0, help="预热时长(秒),期间的请求不计入结果")
+    parser.add_argument("--max-outstanding", type=int, default=10000, help="开环模式下客户端同时进行的请求上限,超出的计为丢弃")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的超时(秒)")
+    parser.add_argument("--question", default="压测问题")
+    parser.add_argument("--same-question", action="store_true", help="所有请求使用相同问题(测试缓存);默认每个请求带序号")
+    parser.add_argument("--no-stream", action="store_true", help="/v1/chat/completions 使用非流式请求")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两个 JSON 结果文件")
+    args = parser.parse_args()
+
+    if args.compare:
+        对比(*args.compare)
+        return
+    if sys.platform.startswith('win'):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    结果 = asyncio.run(压测(args).运行())
+    打印结果(结果)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(结果, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
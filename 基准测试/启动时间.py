@@ -0,0 +1,122 @@
+"""服务器导入时间和启动时间的基准测试
+
+每轮启动一个新的 Python 进程,分别计时:
+- 导入: import AI服务器自定义接口(读取配置、创建负载均衡器/缓存/调度器等)
+- 启动: 执行 lifespan 的启动阶段(建立连接池会话、启动配置监视等,不访问上游)
+- 进程: 从启动解释器到进程退出的总耗时(父进程计时)
+
+并用 -X importtime 列出累计导入耗时最多的直接依赖。导入或启动中位数之和超过 --budget-ms(默认 1500),
+或服务器导入了 --forbid 中的模块(默认 DrissionPage,服务器不应依赖浏览器自动化)时以退出码 1 结束。
+tests/test_启动时间.py 在测试中以同样的预算和禁止列表检查。
+
+用法:
+    python 基准测试/启动时间.py --rounds 5 --budget-ms 1500
+    python 基准测试/启动时间.py --config 基准测试/模拟配置.toml --top 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+仓库目录 = Path(__file__).resolve().parent.parent
+默认预算毫秒 = 1500.0              # 导入+启动中位数的上限
+默认禁止模块 = ["DrissionPage"]    # 服务器不应导入的模块
+
+# 在子进程中执行:计时导入和 lifespan 启动,最后一行输出 JSON 结果
+子进程代码 = """
+import asyncio, json, sys, time
+开始 = time.perf_counter()
+import AI服务器自定义接口 as m
+导入完成 = time.perf_counter()
+
+async def 启动():
+    async with m.lifespan(m.app):
+        return time.perf_counter()
+
+启动完成 = asyncio.run(启动())
+print(json.dumps({
+    "import_ms": (导入完成 - 开始) * 1000,
+    "startup_ms": (启动完成 - 导入完成) * 1000,
+    "modules": len(sys.modules),
+    "loaded": sorted(sys.modules),
+}))
+"""
+
+
+def 运行一轮(环境: Dict[str, str], importtime: bool) -> Tuple[Dict, float, str]:
+    命令 = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", 子进程代码]
+    开始 = time.perf_counter()
+    结果 = subprocess.run(命令, cwd=仓库目录, env=环境, capture_output=True, text=True, encoding="utf-8")
+    进程耗时 = (time.perf_counter() - 开始) * 1000
+    if 结果.returncode != 0:
+        raise RuntimeError(f"子进程失败(退出码 {结果.returncode}):\n{结果.stderr[-2000:]}")
+    return json.loads(结果.stdout.strip().splitlines()[-1]), 进程耗时, 结果.stderr
+
+
+def 最慢模块(importtime输出: str, 数量: int) -> List[Tuple[str, float]]:
+    """解析 -X importtime 的输出,按累计耗时返回服务器模块直接导入的模块"""
+    模块 = []
+    for 行 in importtime输出.splitlines():
+        if not 行.startswith("import time:") or "cumulative" in 行:
+            continue
+        _, 累计, 名称 = 行.split("|")
+        # 模块名前的缩进为 1 + 2×嵌套层数,层数为 1 的是被服务器模块(及 asyncio 等顶层模块)直接导入的
+        if len(名称) - len(名称.lstrip()) == 3:
+            模块.append((名称.strip(), int(累计) / 1000))
+    return sorted(模块, key=lambda x: x[1], reverse=True)[:数量]
+
+
+def 已导入的禁止模块(已加载: List[str], 禁止: List[str]) -> List[str]:
+    return [m for m in 禁止 if any(名称 == m or 名称.startswith(m + ".") for 名称 in 已加载)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务器导入时间和启动时间的基准测试")
+    parser.add_argument("--rounds", type=int, default=5, help="测量的轮数(每轮一个新进程)")
+    parser.add_argument("--config", help="服务器使用的配置文件,默认为仓库的 ai_configs.toml")
+    parser.add_argument("--top", type=int, default=10, help="列出累计导入耗时最多的模块数")
+    parser.add_argument("--budget-ms", type=float, default=默认预算毫秒, help="导入+启动的中位数上限(毫秒),超出时退出码为 1")
+    parser.add_argument("--forbid", nargs="*", default=默认禁止模块, help="服务器不应导入的模块")
+    args = parser.parse_args()
+
+    环境 = dict(os.environ)
+    环境.pop("AI_SERVER_WORKERS", None)
+    if args.config:
+        环境["AI_CONFIGS"] = str(Path(args.config).resolve())
+
+    # 第一轮带 -X importtime,只用于分析模块耗时,不计入结果
+    首轮, _, importtime输出 = 运行一轮(环境, importtime=True)
+    导入, 启动, 进程 = [], [], []
+    for _ in range(args.rounds):
+        结果, 进程耗时, _ = 运行一轮(环境, importtime=False)
+        导入.append(结果["import_ms"])
+        启动.append(结果["startup_ms"])
+        进程.append(进程耗时)
+
+    print(f"轮数: {args.rounds}  已加载模块数: {首轮['modules']}")
+    print(f"{'阶段':<6}{'中位数(ms)':>12}{'最小(ms)':>12}{'最大(ms)':>12}")
+    for 名称, 样本 in (("导入", 导入), ("启动", 启动), ("进程", 进程)):
+        print(f"{名称:<6}{statistics.median(样本):>12.1f}{min(样本):>12.1f}{max(样本):>12.1f}")
+    print(f"\n累计导入耗时最多的 {args.top} 个直接依赖:")
+    for 名称, 毫秒 in 最慢模块(importtime输出, args.top):
+        print(f"  {毫秒:>8.1f} ms  {名称}")
+
+    失败 = []
+    违规模块 = 已导入的禁止模块(首轮["loaded"], args.forbid)
+    if 违规模块:
+        失败.append(f"服务器导入了不应依赖的模块: {', '.join(违规模块)}")
+    合计 = statistics.median(导入) + statistics.median(启动)
+    if 合计 > args.budget_ms:
+        失败.append(f"导入+启动中位数 {合计:.1f} ms 超出预算 {args.budget_ms:.1f} ms")
+    for 信息 in 失败:
+        print(f"\n失败: {信息}")
+    sys.exit(1 if 失败 else 0)
+
+
+if __name__ == "__main__":
+    main()
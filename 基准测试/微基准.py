@@ -0,0 +1,316 @@
+"""请求处理热路径的进程内微基准
+
+分别测量单个请求在各阶段的CPU开销,以及经过完整 FastAPI 请求路径(纯 ASGI 调用,上游为进程内桩)的开销:
+
+- 构造上游请求: AIClient._construct_requestall
+- 请求体序列化: 上游请求体的 json.dumps(aiohttp 发送 json= 时的开销)
+- 解析流式响应: AIClient._process_stream_response,约 30KB 的 SSE 流按随机网络块到达
+- 选择上游: 各负载均衡策略下的 LoadBalancer.get_next_api,以及 select + track 的一次完整记录
+- 日志格式化: /chat 成功日志的消息拼接 + logging.Formatter.format
+- 完整请求: POST /chat、/chat/stream、/v1/chat/completions(流式),日志写入空设备
+
+每项报告 ops/s、每次耗时、每次的内存分配峰值(tracemalloc,单次操作期间新分配内存的最高值)
+和每次留存的内存块数(sys.getallocatedblocks 的增量,持续大于0说明有对象被长期持有;
+/chat 的回答缓存未满时每次会留存一条缓存)。
+--save-baseline 保存结果,--baseline 与保存的结果对比:ops/s 下降或分配峰值上升超过 --threshold 时
+以退出码 1 结束,可用于提交前检查。基线与机器相关,应在同一台机器上生成和对比。
+
+用法:
+    python 基准测试/微基准.py --save-baseline 基准测试/微基准基线.json
+    python 基准测试/微基准.py --baseline 基准测试/微基准基线.json --threshold 0.15
+    python 基准测试/微基准.py --filter 完整请求
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from SSE解析基准 import 生成流, 切块
+from AIClass import AIClient, AIConfig, DEFAULT_SYSTEM_PROMPT
+from 负载均衡类 import LoadBalancer
+
+问题 = "请用三段话解释一下负载均衡中的 EWMA 延迟策略和 power of two choices 策略各自的优缺点," * 3
+上游配置 = [
+    AIConfig(url="https://api.example.com/v1/chat/completions", key="sk-bench", model=f"bench-model-{i}", weight=i + 1)
+    for i in range(3)
+]
+流数据 = 生成流(30_000, 种子=7)
+流块 = 切块(流数据, 种子=7)
+
+
+class _桩内容:
+    def __init__(self, 块列表: List[bytes]):
+        self.块列表 = 块列表
+
+    async def iter_any(self):
+        for 块 in self.块列表:
+            yield 块
+
+
+class _桩响应:
+    """代替 aiohttp 响应:状态码 200,响应体为预先切好的 SSE 块"""
+    status = 200
+    headers: Dict[str, str] = {}
+
+    def __init__(self):
+        self.content = _桩内容(流块)
+
+    def __await__(self):
+        # 与 aiohttp 的请求上下文一样,既可以 await 也可以 async with
+        return self._就绪().__await__()
+
+    async def _就绪(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+
+class _桩会话:
+    closed = False
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        return _桩响应()
+
+
+class 测量项:
+    def __init__(self, 名称: str, 函数: Callable, 异步: bool = False):
+        self.名称 = 名称
+        self.函数 = 函数
+        self.异步 = 异步
+
+
+def 计时(项: 测量项, 循环: asyncio.AbstractEventLoop, 最短时间: float, 轮数: int) -> Dict[str, float]:
+    """先按最短时间校准每轮次数,再取多轮中最快的一轮"""
+    def 跑(次数: int) -> float:
+        if 项.异步:
+            async def 批量():
+                开始 = time.perf_counter()
+                for _ in range(次数):
+                    await 项.函数()
+                return time.perf_counter() - 开始
+            return 循环.run_until_complete(批量())
+        开始 = time.perf_counter()
+        for _ in range(次数):
+            项.函数()
+        return time.perf_counter() - 开始
+
+    次数 = 1
+    while (耗时 := 跑(次数)) < 最短时间 / 10:
+        次数 *= 10
+    次数 = max(1, int(次数 * 最短时间 / max(耗时, 1e-9)))
+    最快 = min(跑(次数) for _ in range(轮数))
+    return {"ops_per_sec": round(次数 / 最快, 1), "us_per_op": round(最快 / 次数 * 1e6, 2)}
+
+
+def 内存(项: 测量项, 循环: asyncio.AbstractEventLoop, 次数: int = 50) -> Dict[str, float]:
+    async def 异步峰值() -> int:
+        合计 = 0
+        for _ in range(次数):
+            tracemalloc.reset_peak()
+            基线 = tracemalloc.get_traced_memory()[0]
+            await 项.函数()
+            合计 += tracemalloc.get_traced_memory()[1] - 基线
+        return 合计
+
+    def 同步峰值() -> int:
+        合计 = 0
+        for _ in range(次数):
+            tracemalloc.reset_peak()
+            基线 = tracemalloc.get_traced_memory()[0]
+            项.函数()
+            合计 += tracemalloc.get_traced_memory()[1] - 基线
+        return 合计
+
+    def 运行一次():
+        return 循环.run_until_complete(项.函数()) if 项.异步 else 项.函数()
+
+    tracemalloc.start()
+    try:
+        峰值合计 = 循环.run_until_complete(异步峰值()) if 项.异步 else 同步峰值()
+    finally:
+        tracemalloc.stop()
+
+    gc.collect()
+    块数 = sys.getallocatedblocks()
+    for _ in range(次数):
+        运行一次()
+    gc.collect()
+    return {
+        "alloc_peak_bytes": round(峰值合计 / 次数),
+        "retained_blocks": round((sys.getallocatedblocks() - 块数) / 次数, 2),
+    }
+
+
+def 阶段测量项() -> List[测量项]:
+    项目 = []
+    配置 = 上游配置[0]
+    项目.append(测量项("构造上游请求", lambda: AIClient._construct_requestall(配置, DEFAULT_SYSTEM_PROMPT, 问题)))
+    _, 请求体, _ = AIClient._construct_requestall(配置, DEFAULT_SYSTEM_PROMPT, 问题)
+    项目.append(测量项("请求体序列化", lambda: json.dumps(请求体)))
+    项目.append(测量项("解析流式响应", lambda: AIClient._process_stream_response(_桩响应()), 异步=True))
+
+    for 策略 in ("round_robin", "least_outstanding", "ewma", "p2c", "weighted", "throughput"):
+        均衡器 = LoadBalancer(上游配置, strategy=策略)
+        项目.append(测量项(f"选择上游[{策略}]", 均衡器.get_next_api))
+
+    均衡器 = LoadBalancer(上游配置, strategy="ewma")
+
+    def 选择并记录():
+        上游 = 均衡器.select()
+        with 均衡器.track(上游) as 记录:
+            记录["success"] = True
+    项目.append(测量项("选择上游+记录[ewma]", 选择并记录))
+
+    格式化器 = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    结果 = {"status": "success", "time": 1.23, "message": 流数据.decode("utf-8")[:1500], "message_length": 1500}
+    尝试记录 = [{"index": 1, "model": "bench-model-1", "status": "success", "time": 0.8}]
+
+    def 日志格式化():
+        尝试摘要 = " -> ".join(f"{记录['index']}({记录['status']})" for 记录 in 尝试记录)
+        消息 = (
+            f"请求时间: 2025-01-01 00:00:00\n"
+            f"接口ID: {尝试记录[-1]['index']}\n"
+            f"负载策略: ewma\n"
+            f"尝试记录: {尝试摘要}\n"
+            f"请求内容: {问题}\n"
+            f"响应内容: {结果}\n"
+            f"状态: 成功\n"
+            f"{'='*50}"
+        )
+        return 格式化器.format(logging.LogRecord("bench", logging.INFO, __file__, 0, 消息, None, None))
+    项目.append(测量项("日志格式化", 日志格式化))
+    return 项目
+
+
+async def ASGI请求(app, 路径: str, 请求体: bytes) -> int:
+    """直接调用 ASGI 应用完成一次 POST 请求,读完整个响应体,返回状态码"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": 路径, "raw_path": 路径.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(请求体)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 5000),
+    }
+    已发送 = False
+    状态 = 0
+    断开 = asyncio.Event()
+
+    async def receive():
+        nonlocal 已发送
+        if not 已发送:
+            已发送 = True
+            return {"type": "http.request", "body": 请求体, "more_body": False}
+        # 客户端不会断开;监听断开的任务在响应结束或取到首个增量后被取消,Event 不会随之被取消
+        await 断开.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal 状态
+        if message["type"] == "http.response.start":
+            状态 = message["status"]
+
+    await app(scope, receive, send)
+    断开.set()
+    return 状态
+
+
+def 完整请求测量项() -> List[测量项]:
+    import AI服务器自定义接口 as 服务器
+    # 上游换成进程内桩;日志仍然格式化,但写入空设备,不计磁盘和控制台的开销
+    AIClient._get_session = classmethod(lambda cls, url: _桩会话())
+    for 处理器 in list(服务器.logger.handlers):
+        服务器.logger.removeHandler(处理器)
+    服务器.日志管理器.stop()
+    服务器.logger.addHandler(logging.StreamHandler(open(os.devnull, "w", encoding="utf-8")))
+    序号 = iter(range(sys.maxsize))
+
+    def 请求(路径: str, 构造: Callable[[str], Dict[str, Any]]) -> Callable[[], Awaitable[None]]:
+        async def 发送():
+            # 每次使用不同的问题,避免命中回答缓存
+            状态 = await ASGI请求(服务器.app, 路径, json.dumps(构造(f"{问题} #{next(序号)}")).encode())
+            if 状态 != 200:
+                raise RuntimeError(f"{路径} 返回 {状态}")
+        return 发送
+
+    return [
+        测量项("完整请求[/chat]", 请求("/chat", lambda q: {"问题": q}), 异步=True),
+        测量项("完整请求[/chat/stream]", 请求("/chat/stream", lambda q: {"问题": q}), 异步=True),
+        测量项("完整请求[/v1/chat/completions]", 请求(
+            "/v1/chat/completions", lambda q: {"messages": [{"role": "user", "content": q}], "stream": True}), 异步=True),
+    ]
+
+
+def 对比基线(结果: Dict[str, Dict[str, float]], 基线: Dict[str, Dict[str, float]], 阈值: float) -> List[str]:
+    退化 = []
+    print(f"\n{'项目':<32}{'基线 ops/s':>14}{'当前 ops/s':>14}{'变化':>9}{'分配峰值变化':>14}")
+    for 名称, 当前 in 结果.items():
+        旧 = 基线.get(名称)
+        if 旧 is None:
+            print(f"{名称:<32}{'-':>14}{当前['ops_per_sec']:>14}{'(新增)':>9}")
+            continue
+        速度变化 = 当前["ops_per_sec"] / 旧["ops_per_sec"] - 1
+        内存变化 = (当前["alloc_peak_bytes"] / 旧["alloc_peak_bytes"] - 1) if 旧["alloc_peak_bytes"] else 0.0
+        标记 = ""
+        if 速度变化 < -阈值 or 内存变化 > 阈值:
+            标记 = "  <-- 退化"
+            退化.append(名称)
+        print(f"{名称:<32}{旧['ops_per_sec']:>14}{当前['ops_per_sec']:>14}{速度变化:>+9.1%}{内存变化:>+14.1%}{标记}")
+    return 退化
+
+
+def main():
+    parser = argparse.ArgumentParser(description="请求处理热路径的进程内微基准")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的项目")
+    parser.add_argument("--min-time", type=float, default=0.3, help="每轮的最短运行时间(秒)")
+    parser.add_argument("--rounds", type=int, default=5, help="轮数,取最快的一轮")
+    parser.add_argument("--save-baseline", metavar="PATH", help="把结果保存为基线")
+    parser.add_argument("--baseline", metavar="PATH", help="与基线对比,退化时退出码为1")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定退化的相对变化阈值")
+    args = parser.parse_args()
+
+    if sys.platform.startswith('win'):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    循环 = asyncio.new_event_loop()
+    asyncio.set_event_loop(循环)
+    项目 = 阶段测量项()
+    if not args.filter or "完整请求" in args.filter:
+        项目 += 完整请求测量项()
+
+    结果: Dict[str, Dict[str, float]] = {}
+    print(f"{'项目':<32}{'ops/s':>14}{'us/次':>12}{'分配峰值(B/次)':>16}{'留存块/次':>12}")
+    for 项 in 项目:
+        if args.filter not in 项.名称:
+            continue
+        数据 = {**计时(项, 循环, args.min_time, args.rounds), **内存(项, 循环)}
+        结果[项.名称] = 数据
+        print(f"{项.名称:<32}{数据['ops_per_sec']:>14}{数据['us_per_op']:>12}"
+              f"{数据['alloc_peak_bytes']:>16}{数据['retained_blocks']:>12}")
+    循环.close()
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(结果, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n基线已保存: {args.save_baseline}")
+    if args.baseline:
+        退化 = 对比基线(结果, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.threshold)
+        if 退化:
+            print(f"\n超过阈值 {args.threshold:.0%} 的退化: {', '.join(退化)}")
+            sys.exit(1)
+        print("\n没有超过阈值的退化")
+
+
+if __name__ == "__main__":
+    main()
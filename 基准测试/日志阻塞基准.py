@@ -0,0 +1,119 @@
+"""日志对事件循环阻塞时间的基准测试
+
+在事件循环中以 /chat 的日志格式记录大段问答,同时运行一个每毫秒唤醒一次的探针协程,
+统计探针被推迟的时间(即事件循环被日志写入阻塞的时间),对比同步模式和异步队列模式。
+
+--slow-io-ms 模拟每次控制台写入需要的阻塞时间(例如 Windows 控制台或被重定向到慢速管道时),
+这种情况下同步模式会把写入时间完整地加到事件循环上。
+
+用法:
+    python 基准测试/日志阻塞基准.py --records 2000 --size 8192 --console --slow-io-ms 0.5
+"""
+import argparse
+import asyncio
+import io
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stderr
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from 日志类 import LoggerManager
+
+
+class 慢速流(io.StringIO):
+    """每次写入阻塞指定时间的输出流,模拟慢速控制台"""
+
+    def __init__(self, 阻塞秒数: float):
+        super().__init__()
+        self.阻塞秒数 = 阻塞秒数
+
+    def write(self, s: str) -> int:
+        if self.阻塞秒数:
+            time.sleep(self.阻塞秒数)
+        return super().write(s)
+
+
+async def 探针(停止: asyncio.Event, 延迟列表: list, 间隔: float = 0.001):
+    """每隔 间隔 秒醒来一次,记录实际醒来时间比预期晚了多少"""
+    while not 停止.is_set():
+        预期 = time.perf_counter() + 间隔
+        await asyncio.sleep(间隔)
+        延迟列表.append(max(0.0, time.perf_counter() - 预期))
+
+
+async def 写日志(logger: logging.Logger, 条数: int, 大小: int):
+    回答 = "测" * (大小 // 3)
+    for i in range(条数):
+        logger.info(
+            f"请求时间: 2025-01-01 00:00:00\n"
+            f"接口ID: {i % 3}\n"
+            f"请求内容: 基准测试问题 #{i}\n"
+            f"响应内容: {{'status': 'success', 'message': '{回答}'}}\n"
+            f"状态: 成功\n"
+            f"{'='*50}"
+        )
+        # 模拟请求之间的让出
+        await asyncio.sleep(0)
+
+
+async def 运行一轮(模式: str, 条数: int, 大小: int, 控制台: bool, 日志目录: str) -> dict:
+    管理器 = LoggerManager(
+        name=f"bench_{模式}_{time.time_ns()}",
+        log_dir=日志目录,
+        console_output=控制台,
+        async_mode=(模式 == "async"),
+        queue_size=条数 * 2,
+    )
+    logger = 管理器.get_logger()
+    停止 = asyncio.Event()
+    延迟列表: list = []
+    探针任务 = asyncio.create_task(探针(停止, 延迟列表))
+    开始 = time.perf_counter()
+    await 写日志(logger, 条数, 大小)
+    耗时 = time.perf_counter() - 开始
+    停止.set()
+    await 探针任务
+    刷新开始 = time.perf_counter()
+    管理器.stop()
+    刷新耗时 = time.perf_counter() - 刷新开始
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+    延迟列表.sort()
+    return {
+        "模式": 模式,
+        "写日志耗时(秒)": round(耗时, 3),
+        "关闭刷新耗时(秒)": round(刷新耗时, 3),
+        "探针次数": len(延迟列表),
+        "阻塞p50(毫秒)": round(statistics.median(延迟列表) * 1000, 3) if 延迟列表 else 0,
+        "阻塞p99(毫秒)": round(延迟列表[int(len(延迟列表) * 0.99) - 1] * 1000, 3) if 延迟列表 else 0,
+        "阻塞最大(毫秒)": round(延迟列表[-1] * 1000, 3) if 延迟列表 else 0,
+        "丢弃条数": 管理器.queue_stats().get("dropped", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比同步/异步日志对事件循环的阻塞")
+    parser.add_argument("--records", type=int, default=2000, help="每轮记录的日志条数")
+    parser.add_argument("--size", type=int, default=8192, help="每条日志中回答的字节数")
+    parser.add_argument("--console", action="store_true", help="同时输出到控制台(输出被丢弃,只计算开销)")
+    parser.add_argument("--slow-io-ms", type=float, default=0.0, help="模拟每次控制台写入阻塞的毫秒数")
+    args = parser.parse_args()
+
+    结果列表 = []
+    with tempfile.TemporaryDirectory() as 日志目录:
+        for 模式 in ("sync", "async"):
+            # 控制台输出写入内存缓冲,避免刷屏但保留格式化和写入的开销
+            with redirect_stderr(慢速流(args.slow_io_ms / 1000)):
+                结果列表.append(asyncio.run(运行一轮(模式, args.records, args.size, args.console, 日志目录)))
+
+    for 结果 in 结果列表:
+        print(" | ".join(f"{键}: {值}" for 键, 值 in 结果.items()))
+
+
+if __name__ == "__main__":
+    main()
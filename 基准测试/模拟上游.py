@@ -0,0 +1,165 @@
+"""本地模拟的 OpenAI 风格流式上游,用于离线压测整个服务器
+
+以 SSE 返回 chat.completion.chunk 事件(角色、若干内容增量、结束原因,请求 include_usage 时附带用量),
+可配置首token延迟的分布、每秒输出的token数、回答长度,以及按比例注入 500、429(带 Retry-After)
+和中途断开的错误。所有模型名都接受,回答内容不依赖问题。
+
+--write-config 把仓库的 ai_configs.toml 复制一份,[[ai]] 列表替换为指向本模拟上游的条目,
+服务器通过环境变量 AI_CONFIGS 使用这份配置。
+
+用法(离线压测整个服务器,三个终端):
+    python 基准测试/模拟上游.py --port 8999 --ttft-ms 300 --ttft-dist lognormal --token-rate 50 \\
+        --write-config 基准测试/模拟配置.toml --upstreams 3
+    AI_CONFIGS=基准测试/模拟配置.toml python AI服务器自定义接口.py
+    python 基准测试/压测.py --route /chat/stream --rps 50 --duration 30 --output 结果.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+字表 = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+
+
+class 模拟上游:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.随机 = random.Random(args.seed)
+        self.统计 = {"requests": 0, "in_flight": 0, "max_in_flight": 0, "completed": 0,
+                     "injected_500": 0, "injected_429": 0, "injected_abort": 0, "tokens": 0}
+
+    def 首token延迟(self) -> float:
+        """按 --ttft-dist 抽取首token延迟(秒)"""
+        中位数 = self.args.ttft_ms / 1000
+        分布 = self.args.ttft_dist
+        if 分布 == "uniform":
+            return self.随机.uniform(0, 2 * 中位数)
+        if 分布 == "exponential":
+            return self.随机.expovariate(1 / 中位数) if 中位数 > 0 else 0.0
+        if 分布 == "lognormal":
+            # 中位数为 --ttft-ms,--ttft-sigma 越大长尾越重
+            return self.随机.lognormvariate(0, self.args.ttft_sigma) * 中位数
+        return 中位数
+
+    def 注入错误(self) -> str:
+        抽样 = self.随机.random()
+        for 类型, 比例 in (("500", self.args.error_rate), ("429", self.args.rate_limit_rate),
+                           ("abort", self.args.abort_rate)):
+            if 抽样 < 比例:
+                return 类型
+            抽样 -= 比例
+        return ""
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        请求体 = await request.json()
+        模型 = 请求体.get("model", "mock")
+        self.统计["requests"] += 1
+        错误 = self.注入错误()
+        if 错误 == "500":
+            self.统计["injected_500"] += 1
+            return web.Response(status=500, text="injected error")
+        if 错误 == "429":
+            self.统计["injected_429"] += 1
+            return web.Response(status=429, text="injected rate limit",
+                                headers={"Retry-After": str(self.args.retry_after)})
+
+        self.统计["in_flight"] += 1
+        self.统计["max_in_flight"] = max(self.统计["max_in_flight"], self.统计["in_flight"])
+        try:
+            await asyncio.sleep(self.首token延迟())
+            响应 = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await 响应.prepare(request)
+
+            def 事件(delta: dict, finish=None) -> bytes:
+                return b"data: " + json.dumps({
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": 模型, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                }, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n\n"
+
+            token数 = self.随机.randint(self.args.tokens_min, self.args.tokens_max)
+            中断位置 = self.随机.randint(0, token数 - 1) if 错误 == "abort" else None
+            await 响应.write(事件({"role": "assistant", "content": ""}))
+            开始 = time.perf_counter()
+            for 序号 in range(token数):
+                if 序号 == 中断位置:
+                    self.统计["injected_abort"] += 1
+                    request.transport.close()
+                    return 响应
+                if self.args.token_rate > 0:
+                    # 按累计时间表输出,sleep 的误差不会逐个token累积
+                    等待 = 开始 + 序号 / self.args.token_rate - time.perf_counter()
+                    if 等待 > 0:
+                        await asyncio.sleep(等待)
+                await 响应.write(事件({"content": self.随机.choice(字表)}))
+            self.统计["tokens"] += token数
+            await 响应.write(事件({}, finish="stop"))
+            if (请求体.get("stream_options") or {}).get("include_usage"):
+                提示词token数 = sum(len(str(消息.get("content", ""))) for 消息 in 请求体.get("messages", []))
+                await 响应.write(b"data: " + json.dumps({
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": 模型, "choices": [],
+                    "usage": {"prompt_tokens": 提示词token数, "completion_tokens": token数,
+                              "total_tokens": 提示词token数 + token数},
+                }).encode("utf-8") + b"\n\n")
+            await 响应.write(b"data: [DONE]\n\n")
+            self.统计["completed"] += 1
+            return 响应
+        finally:
+            self.统计["in_flight"] -= 1
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.统计)
+
+
+def 写入模拟配置(目标路径: str, 端口: int, 上游数: int) -> None:
+    """复制仓库的 ai_configs.toml(保留注释),把 [[ai]] 列表替换为指向模拟上游的条目"""
+    源文件 = Path(__file__).resolve().parent.parent / "ai_configs.toml"
+    文本 = 源文件.read_text(encoding="utf-8")
+    匹配 = re.search(r"^\[\[ai\]\]", 文本, re.MULTILINE)
+    if 匹配 is not None:
+        文本 = 文本[:匹配.start()]
+    条目 = "".join(
+        f'[[ai]]\nurl = "http://127.0.0.1:{端口}/v1/chat/completions"\nkey = "sk-mock"\nmodel = "mock-{i}"\n\n'
+        for i in range(上游数)
+    )
+    Path(目标路径).write_text(文本.rstrip("\n") + "\n\n" + 条目, encoding="utf-8")
+    print(f"已写入模拟配置: {目标路径}({上游数} 个上游)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 风格流式上游")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--ttft-ms", type=float, default=300, help="首token延迟的中位数(毫秒)")
+    parser.add_argument("--ttft-dist", choices=["fixed", "uniform", "exponential", "lognormal"], default="fixed")
+    parser.add_argument("--ttft-sigma", type=float, default=0.5, help="lognormal 分布的形状参数")
+    parser.add_argument("--token-rate", type=float, default=50, help="每秒输出的token数,0 为不限速")
+    parser.add_argument("--tokens-min", type=int, default=20, help="回答最少的token数")
+    parser.add_argument("--tokens-max", type=int, default=80, help="回答最多的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1, help="429 响应中 Retry-After 的秒数")
+    parser.add_argument("--abort-rate", type=float, default=0.0, help="输出中途断开连接的比例")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--write-config", metavar="PATH", help="写出指向本模拟上游的服务器配置文件")
+    parser.add_argument("--upstreams", type=int, default=3, help="--write-config 写出的上游条目数")
+    args = parser.parse_args()
+    if args.tokens_min < 1 or args.tokens_max < args.tokens_min:
+        parser.error("需要 1 <= --tokens-min <= --tokens-max")
+
+    if args.write_config:
+        写入模拟配置(args.write_config, args.port, args.upstreams)
+    上游 = 模拟上游(args)
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", 上游.chat)
+    app.router.add_post("/chat/completions", 上游.chat)
+    app.router.add_get("/stats", 上游.stats)
+    print(f"模拟上游已启动: http://127.0.0.1:{args.port}/v1/chat/completions(统计: /stats)")
+    web.run_app(app, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
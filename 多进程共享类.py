@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import math
+import mmap
+import os
+import time
+import zlib
+from dataclasses import dataclass, fields, replace
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from AIClass import AIConfig
+from 准入控制类 import AdmissionConfig
+from 租户类 import TenantConfig
+from 熔断器类 import OPEN
+
+logger = logging.getLogger(__name__)
+
+# 由 __main__ 以多进程方式启动时设置,值为工作进程数;工作进程据此启用共享状态
+WORKERS_ENV = "AI_SERVER_WORKERS"
+
+_MAGIC = 20250101.0
+_VERSION = 1.0
+_HEADER = 8           # 文件头: 魔数、版本、槽位数、上游数上限、上游配置版本号
+_RELOAD = 4           # 文件头中上游配置版本号的位置,每次通过管理接口修改上游配置时加一
+_WORKER_FIELDS = 4    # 每个槽位: pid、心跳时刻、轮询计数、保留
+_UPSTREAM_FIELDS = 8  # 每个 (槽位, 上游): 见 SharedState.publish
+
+
+@dataclass
+class WorkersConfig:
+    """多进程部署配置,对应 ai_configs.toml 中的 [workers] 段"""
+    workers: int = 1                  # 工作进程数,大于1时各进程通过共享内存共享上游状态
+    state_dir: str = "run"            # 存放共享内存文件和进程槽位文件的目录
+    max_upstreams: int = 64           # 共享表容纳的上游编号上限,编号超出的上游只使用本进程的统计
+    heartbeat_interval: float = 1.0   # 心跳间隔(秒)
+    stale_after: float = 5.0          # 超过该时间没有心跳的进程,其统计不再计入
+    shared_cache_path: str = "cache/responses.db"  # 多进程且 [cache] 未设置 sqlite_path 时使用的共享磁盘缓存
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "WorkersConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+def split_upstream_limits(api_configs: List[AIConfig], workers: int) -> List[AIConfig]:
+    """把服务商给的 rpm/tpm 额度和每个上游的并发上限平均分给各工作进程,合计不超过配置值"""
+    if workers <= 1:
+        return api_configs
+    return [
+        replace(
+            配置,
+            rpm=max(1, 配置.rpm // workers) if 配置.rpm else 配置.rpm,
+            tpm=max(1, 配置.tpm // workers) if 配置.tpm else 配置.tpm,
+            max_concurrency=math.ceil(配置.max_concurrency / workers) if 配置.max_concurrency else 配置.max_concurrency,
+        )
+        for 配置 in api_configs
+    ]
+
+
+def split_admission_limits(config: AdmissionConfig, workers: int) -> AdmissionConfig:
+    """把 [admission] 的总并发和每个上游的默认并发平均分给各工作进程"""
+    if workers <= 1:
+        return config
+    return replace(
+        config,
+        max_concurrency=math.ceil(config.max_concurrency / workers) if config.max_concurrency else config.max_concurrency,
+        upstream_concurrency=(math.ceil(config.upstream_concurrency / workers)
+                              if config.upstream_concurrency else config.upstream_concurrency),
+    )
+
+
+def split_tenant_limits(tenants: List[TenantConfig], workers: int) -> List[TenantConfig]:
+    """把每个调用方的并发配额和排队上限平均分给各工作进程"""
+    if workers <= 1:
+        return tenants
+    return [
+        replace(
+            租户,
+            max_concurrency=math.ceil(租户.max_concurrency / workers) if 租户.max_concurrency else 租户.max_concurrency,
+            max_queue=math.ceil(租户.max_queue / workers) if 租户.max_queue else 租户.max_queue,
+        )
+        for 租户 in tenants
+    ]
+
+
+class SharedState:
+    """多个工作进程共享的上游状态表(基于文件的共享内存)
+
+    每个工作进程启动时通过 O_EXCL 创建 worker-<n>.pid 取得一个槽位,只写入自己槽位的那一行
+    (在途数、请求数、错误数、EWMA延迟、熔断和冷却截止时刻),读取时汇总所有心跳未过期的槽位,
+    因此不需要跨进程锁;读到其他进程写了一半的行只会让某一次选择略有偏差。
+    进程异常退出后,它的槽位在心跳过期后不再计入,pid 不存在时槽位可被新进程接管。
+    某个进程通过管理接口修改上游配置后调用 announce_reload,其他进程在下一次心跳时发现版本号变化,
+    调用 start 传入的 on_reload 重新读取配置文件。
+
+    Example:
+        >>> 共享状态 = SharedState(WorkersConfig(workers=4))
+        >>> 负载均衡器 = LoadBalancer(上游配置, strategy="ewma", shared=共享状态)
+        >>> 共享状态.start(重新加载上游配置)   # 在事件循环中定时发送心跳并跟随其他进程的配置修改
+        >>> 共享状态.announce_reload()        # 本进程已应用新配置,通知其他进程
+        >>> await 共享状态.stop()             # 退出时释放槽位
+    """
+
+    def __init__(self, config: WorkersConfig):
+        self.config = config
+        self.slots = max(1, config.workers)
+        self.max_upstreams = config.max_upstreams
+        self.dir = Path(config.state_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._slot_size = _WORKER_FIELDS + self.max_upstreams * _UPSTREAM_FIELDS
+        大小 = (_HEADER + self.slots * self._slot_size) * 8
+        # 文件名带上布局尺寸,修改 workers 或 max_upstreams 后不会读到旧布局
+        self.path = self.dir / f"shared_state_{self.slots}x{self.max_upstreams}.bin"
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < 大小:
+                os.ftruncate(fd, 大小)
+            self._mm = mmap.mmap(fd, 大小)
+        finally:
+            os.close(fd)
+        self._d = memoryview(self._mm).cast("d")
+        self._d[0], self._d[1], self._d[2], self._d[3] = _MAGIC, _VERSION, float(self.slots), float(self.max_upstreams)
+        self.worker_id = self._acquire_slot()
+        self._task: Optional[asyncio.Task] = None
+        self._on_reload: Optional[Callable[[], Awaitable[Any]]] = None
+        self._reload_seen = self._d[_RELOAD]
+        self._identities: Dict[int, float] = {}
+
+    # ---- 槽位 ----
+
+    def _slot_file(self, slot: int) -> Path:
+        return self.dir / f"worker-{slot}.pid"
+
+    def _acquire_slot(self) -> int:
+        for 槽位 in range(self.slots):
+            路径 = self._slot_file(槽位)
+            for _ in range(2):
+                try:
+                    fd = os.open(路径, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                except FileExistsError:
+                    if self._stale(槽位):
+                        路径.unlink(missing_ok=True)
+                        continue
+                    break
+                with os.fdopen(fd, "w") as f:
+                    f.write(str(os.getpid()))
+                基址 = self._slot_base(槽位)
+                self._d[基址:基址 + self._slot_size] = memoryview(bytearray(8 * self._slot_size)).cast("d")
+                self._d[基址] = float(os.getpid())
+                self._d[基址 + 1] = time.time()
+                return 槽位
+        raise RuntimeError(f"没有空闲的工作进程槽位({self.slots} 个均被占用),请检查 {self.dir} 下的 worker-*.pid")
+
+    def _stale(self, slot: int) -> bool:
+        """槽位文件的主人已经退出:该 pid 已不存在;Windows 下无法安全探测进程,以心跳过期为准"""
+        try:
+            pid = int(self._slot_file(slot).read_text() or 0)
+        except (OSError, ValueError):
+            pid = 0
+        if os.name == "nt" or pid <= 0:
+            return time.time() - self._d[self._slot_base(slot) + 1] >= self.config.stale_after
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    def release(self) -> None:
+        """释放槽位:清零自己的行并删除槽位文件"""
+        if self.worker_id is None:
+            return
+        基址 = self._slot_base(self.worker_id)
+        self._d[基址:基址 + self._slot_size] = memoryview(bytearray(8 * self._slot_size)).cast("d")
+        self._slot_file(self.worker_id).unlink(missing_ok=True)
+        self.worker_id = None
+
+    def start(self, on_reload: Optional[Callable[[], Awaitable[Any]]] = None) -> None:
+        """开始定时发送心跳;on_reload 在其他进程修改上游配置后调用"""
+        self._on_reload = on_reload
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.release()
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            self.heartbeat()
+            await self.follow_reload()
+            await asyncio.sleep(self.config.heartbeat_interval)
+
+    def announce_reload(self) -> None:
+        """本进程已经应用了新的上游配置(并已写入配置文件),通知其他进程重新读取"""
+        self._d[_RELOAD] += 1
+        self._reload_seen = self._d[_RELOAD]
+
+    async def follow_reload(self) -> bool:
+        """其他进程修改过上游配置时调用 on_reload,返回是否调用;on_reload 抛出的异常只记录警告日志"""
+        版本 = self._d[_RELOAD]
+        if 版本 == self._reload_seen or self._on_reload is None:
+            return False
+        self._reload_seen = 版本
+        try:
+            await self._on_reload()
+        except Exception as e:
+            logger.warning(f"跟随其他进程重新加载配置失败,继续使用当前配置: {e}")
+        return True
+
+    def heartbeat(self) -> None:
+        if self.worker_id is not None:
+            self._d[self._slot_base(self.worker_id) + 1] = time.time()
+
+    # ---- 读写 ----
+
+    def _slot_base(self, slot: int) -> int:
+        return _HEADER + slot * self._slot_size
+
+    def _row(self, slot: int, index: int) -> int:
+        return self._slot_base(slot) + _WORKER_FIELDS + index * _UPSTREAM_FIELDS
+
+    def _live_peers(self, now: float) -> List[int]:
+        return [
+            槽位 for 槽位 in range(self.slots)
+            if 槽位 != self.worker_id and now - self._d[self._slot_base(槽位) + 1] < self.config.stale_after
+        ]
+
+    def _identity(self, upstream) -> float:
+        身份 = self._identities.get(upstream.index)
+        if 身份 is None:
+            身份 = float(zlib.crc32("\n".join(upstream.config.identity()).encode("utf-8")) + 1)
+            self._identities[upstream.index] = 身份
+        return 身份
+
+    def publish(self, upstream, now: Optional[float] = None) -> None:
+        """把本进程对该上游的统计写入自己槽位的行"""
+        if self.worker_id is None or upstream.index >= self.max_upstreams:
+            return
+        现在 = time.time() if now is None else now
+        单调 = time.monotonic()
+        统计 = upstream.stats
+        熔断器 = upstream.breaker
+        熔断截止 = 0.0
+        if 熔断器.state == OPEN:
+            熔断截止 = 现在 + max(0.0, 熔断器.opened_at + 熔断器.config.open_duration - 单调)
+        b = self._row(self.worker_id, upstream.index)
+        d = self._d
+        d[b] = self._identity(upstream)
+        d[b + 1] = 统计.in_flight
+        d[b + 2] = 统计.requests
+        d[b + 3] = 统计.errors
+        d[b + 4] = 统计.ewma_latency if 统计.ewma_latency is not None else math.nan
+        d[b + 5] = 统计.ewma_updated
+        d[b + 6] = 熔断截止
+        d[b + 7] = 现在 + max(0.0, upstream.cooldown_until - 单调)
+
+    def sync(self, upstreams) -> None:
+        """发布本进程的所有上游,并把其他进程的在途数、最新的EWMA延迟、熔断和冷却汇总到 peer_* 字段"""
+        现在 = time.time()
+        self.heartbeat()
+        同伴 = self._live_peers(现在)
+        d = self._d
+        for 上游 in upstreams:
+            self.publish(上游, 现在)
+            if 上游.index >= self.max_upstreams:
+                continue
+            身份 = self._identity(上游)
+            在途 = 0.0
+            延迟, 更新时刻 = None, 0.0
+            熔断截止 = 冷却截止 = 0.0
+            for 槽位 in 同伴:
+                b = self._row(槽位, 上游.index)
+                if d[b] != 身份:
+                    continue
+                在途 += d[b + 1]
+                if not math.isnan(d[b + 4]) and d[b + 5] > 更新时刻:
+                    延迟, 更新时刻 = d[b + 4], d[b + 5]
+                熔断截止 = max(熔断截止, d[b + 6])
+                冷却截止 = max(冷却截止, d[b + 7])
+            统计 = 上游.stats
+            统计.peer_in_flight = max(0, int(在途))
+            统计.peer_ewma_latency, 统计.peer_ewma_updated = 延迟, 更新时刻
+            上游.peer_open_until, 上游.peer_cooldown_until = 熔断截止, 冷却截止
+
+    def next_ticket(self) -> int:
+        """全局轮询序号:所有存活进程的轮询计数之和,然后本进程计数+1"""
+        现在 = time.time()
+        合计 = sum(self._d[self._slot_base(槽位) + 2] for 槽位 in self._live_peers(现在))
+        if self.worker_id is None:
+            return int(合计)
+        位置 = self._slot_base(self.worker_id) + 2
+        合计 += self._d[位置]
+        self._d[位置] += 1
+        return int(合计)
+
+    def stats(self) -> Dict[str, Any]:
+        现在 = time.time()
+        进程列表 = []
+        for 槽位 in range(self.slots):
+            基址 = self._slot_base(槽位)
+            心跳 = self._d[基址 + 1]
+            if not 心跳:
+                continue
+            上游 = {}
+            for 索引 in range(self.max_upstreams):
+                b = self._row(槽位, 索引)
+                if self._d[b]:
+                    上游[索引] = {"in_flight": int(self._d[b + 1]), "requests": int(self._d[b + 2]),
+                                 "errors": int(self._d[b + 3])}
+            进程列表.append({
+                "worker": 槽位,
+                "pid": int(self._d[基址]),
+                "alive": 现在 - 心跳 < self.config.stale_after,
+                "heartbeat_age": round(现在 - 心跳, 2),
+                "round_robin_count": int(self._d[基址 + 2]),
+                "upstreams": 上游,
+            })
+        return {"worker": self.worker_id, "slots": self.slots, "path": str(self.path),
+                "config_version": int(self._d[_RELOAD]), "workers": 进程列表}
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from 调度器类 import Dispatcher, DispatchError
+from 准入控制类 import UpstreamSlots
+
+
+@dataclass
+class BatchConfig:
+    """批量提问配置,对应 ai_configs.toml 中的 [batch] 段"""
+    max_items: int = 10000                 # 单个批次最多的问题数
+    concurrency_per_upstream: int = 4      # 每个上游同时处理的批处理问题数上限(所有批次合计)
+    item_retries: int = 2                  # 单个问题被限流/排队拒绝(429/503)后的重试次数
+    max_running: int = 4                   # 同时运行的批次数上限
+    result_ttl: float = 3600.0             # 批次结束后结果保留的时间(秒),期间可凭批次ID续传
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "BatchConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+class BatchRejected(Exception):
+    """批次不合法或同时运行的批次过多"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_batch_input(body: bytes, content_type: str = "") -> List[str]:
+    """解析批量输入,不合法时抛出 BatchRejected
+
+    JSON 请求体: {"问题列表": [...]} 或直接是列表;
+    其他类型按 JSONL 处理(例如上传的 .jsonl 文件),每行是一个字符串或 {"问题": ...} 对象,空行忽略。
+    """
+    def 取问题(条目: Any, 位置: str) -> str:
+        if isinstance(条目, dict):
+            条目 = 条目.get("问题")
+        if not isinstance(条目, str) or not 条目.strip():
+            raise BatchRejected(f"{位置}: 应为非空字符串或包含 问题 字段的对象")
+        return 条目
+
+    try:
+        if "application/json" in content_type:
+            数据 = json.loads(body)
+            if isinstance(数据, dict):
+                数据 = 数据.get("问题列表")
+            if not isinstance(数据, list):
+                raise BatchRejected("JSON 请求体应为问题列表或包含 问题列表 字段的对象")
+            return [取问题(条目, f"第 {i + 1} 个问题") for i, 条目 in enumerate(数据)]
+        return [
+            取问题(json.loads(行), f"第 {i + 1} 行")
+            for i, 行 in enumerate(body.decode("utf-8").splitlines()) if 行.strip()
+        ]
+    except (ValueError, UnicodeDecodeError) as e:
+        raise BatchRejected(f"无法解析批量输入: {e}")
+
+
+class BatchJob:
+    """一个批次:后台逐个完成问题,结果按完成顺序追加,客户端断开不影响执行
+
+    每条结果带 seq(完成顺序,从0开始)和 index(在输入中的位置);
+    客户端断开后可用 stream(offset=已收到的条数) 从断点继续接收;tenant 为提交批次的调用方。
+    """
+
+    def __init__(self, questions: List[str], tenant: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:16]
+        self.questions = questions
+        self.tenant = tenant
+        self.results: List[Dict[str, Any]] = []
+        self.running = 0
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    async def add_result(self, result: Dict[str, Any]) -> None:
+        async with self._changed:
+            result["seq"] = len(self.results)
+            self.results.append(result)
+            self._changed.notify_all()
+
+    async def finish(self) -> None:
+        async with self._changed:
+            self.finished = time.time()
+            self._changed.notify_all()
+
+    async def stream(self, offset: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """从第 offset 条结果开始产出,跟随新结果直到批次结束"""
+        位置 = max(0, offset)
+        while True:
+            async with self._changed:
+                while 位置 >= len(self.results) and not self.done:
+                    await self._changed.wait()
+                新结果 = self.results[位置:]
+                结束 = self.done
+            for 结果 in 新结果:
+                yield 结果
+            位置 += len(新结果)
+            if 结束 and 位置 >= len(self.results):
+                return
+
+    def progress(self) -> Dict[str, Any]:
+        成功 = sum(1 for 结果 in self.results if 结果["status"] == "success")
+        结束时间 = self.finished or time.time()
+        return {
+            "batch_id": self.id,
+            "tenant": self.tenant,
+            "total": len(self.questions),
+            "completed": len(self.results),
+            "succeeded": 成功,
+            "failed": len(self.results) - 成功,
+            "running": self.running,
+            "pending": len(self.questions) - len(self.results) - self.running,
+            "done": self.done,
+            "cancelled": self.cancelled,
+            "elapsed": round(结束时间 - self.created, 2),
+        }
+
+
+class BatchManager:
+    """批量提问管理:把问题分发给调度器并发执行,保存进行中和最近结束的批次
+
+    每个问题走与 /chat 相同的调度路径(负载均衡、故障转移、缓存、准入控制);
+    工作协程从共享队列取问题,慢的问题只占用一个工作协程,不会阻塞其他问题。
+    所有批次共用一张按上游的名额表:每个上游同时处理的批处理问题不超过 concurrency_per_upstream,
+    最快的上游名额用满后,其余问题分给其他上游或等待名额释放。
+
+    Example:
+        >>> 批处理 = BatchManager(调度器, BatchConfig())
+        >>> 批次 = 批处理.submit(["问题1", "问题2"])
+        >>> async for 结果 in 批次.stream():
+        ...     print(结果["index"], 结果["status"])
+    """
+
+    def __init__(self, dispatcher: Dispatcher, config: Optional[BatchConfig] = None):
+        self.dispatcher = dispatcher
+        self.config = config or BatchConfig()
+        self.jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+        self.slots = UpstreamSlots(self.config.concurrency_per_upstream)
+
+    def submit(self, questions: List[str], tenant: Optional[str] = None) -> BatchJob:
+        self._purge()
+        if not questions:
+            raise BatchRejected("问题列表为空")
+        if len(questions) > self.config.max_items:
+            raise BatchRejected(f"单个批次最多 {self.config.max_items} 个问题,实际 {len(questions)} 个")
+        if sum(1 for 批次 in self.jobs.values() if not 批次.done) >= self.config.max_running:
+            raise BatchRejected(f"同时运行的批次已达上限({self.config.max_running})", 429)
+        批次 = BatchJob(questions, tenant)
+        self.jobs[批次.id] = 批次
+        批次.task = asyncio.create_task(self._run(批次))
+        return 批次
+
+    def get(self, batch_id: str) -> Optional[BatchJob]:
+        self._purge()
+        return self.jobs.get(batch_id)
+
+    def cancel(self, batch_id: str) -> Optional[BatchJob]:
+        批次 = self.jobs.get(batch_id)
+        if 批次 is not None and not 批次.done and 批次.task is not None:
+            批次.cancelled = True
+            批次.task.cancel()
+        return 批次
+
+    async def close(self) -> None:
+        for 批次 in list(self.jobs.values()):
+            self.cancel(批次.id)
+        任务列表 = [批次.task for 批次 in self.jobs.values() if 批次.task is not None]
+        await asyncio.gather(*任务列表, return_exceptions=True)
+
+    def _purge(self) -> None:
+        截止 = time.time() - self.config.result_ttl
+        for 批次ID in [i for i, 批次 in self.jobs.items() if 批次.done and 批次.finished < 截止]:
+            del self.jobs[批次ID]
+
+    def _concurrency(self) -> int:
+        """批次的工作协程数;每个上游的实际并发由 slots 限制"""
+        健康上游 = sum(1 for 上游 in self.dispatcher.balancer.upstreams if 上游.available())
+        return max(1, self.config.concurrency_per_upstream * max(1, 健康上游))
+
+    async def _run(self, job: BatchJob) -> None:
+        队列: asyncio.Queue = asyncio.Queue()
+        for 索引, 问题 in enumerate(job.questions):
+            队列.put_nowait((索引, 问题))
+
+        async def 工作():
+            while True:
+                try:
+                    索引, 问题 = 队列.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                job.running += 1
+                try:
+                    结果 = await self._run_item(索引, 问题, job.tenant)
+                finally:
+                    job.running -= 1
+                await job.add_result(结果)
+
+        工作列表 = [asyncio.create_task(工作()) for _ in range(min(len(job.questions), self._concurrency()))]
+        try:
+            await asyncio.gather(*工作列表)
+        finally:
+            for 任务 in 工作列表:
+                任务.cancel()
+            await asyncio.gather(*工作列表, return_exceptions=True)
+            await job.finish()
+
+    async def _run_item(self, index: int, question: str, tenant: Optional[str] = None) -> Dict[str, Any]:
+        开始时间 = time.monotonic()
+        for 次数 in range(self.config.item_retries + 1):
+            try:
+                结果, 尝试记录 = await self.dispatcher.ask(question, tenant=tenant, slots=self.slots)
+                return {"index": index, "status": "success", "data": 结果, "attempts": 尝试记录}
+            except DispatchError as e:
+                if e.status_code in (429, 503) and 次数 < self.config.item_retries:
+                    await asyncio.sleep(e.retry_after or 1.0)
+                    continue
+                return {
+                    "index": index, "status": "error", "error": str(e), "status_code": e.status_code,
+                    "attempts": e.attempts, "time": round(time.monotonic() - 开始时间, 2),
+                }
+            except Exception as e:
+                return {"index": index, "status": "error", "error": str(e), "status_code": 500,
+                        "time": round(time.monotonic() - 开始时间, 2)}
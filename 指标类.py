@@ -0,0 +1,226 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 所有指标都只在事件循环线程里更新,一次记录就是几次字典/列表操作,不加锁
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    部分 = [f'{名}="{_escape(值)}"' for 名, 值 in zip(names, values)]
+    if extra:
+        部分.append(extra)
+    return "{" + ",".join(部分) + "}" if 部分 else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """只增计数器,标签值按 label_names 的顺序以元组传入"""
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for 标签, 值 in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, 标签)} {_format_value(值)}"
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+    type_name = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def set(self, labels: Tuple[str, ...], value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram:
+    """固定分桶直方图,observe 只做一次二分查找和三次加法"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合: [各桶计数..., +Inf桶计数, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        数据 = self._values.get(labels)
+        if 数据 is None:
+            数据 = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+        数据[bisect_left(self.buckets, value)] += 1
+        数据[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        for 标签, 数据 in self._values.items():
+            累计 = 0.0
+            for 上界, 计数 in zip(self.buckets + (float("inf"),), 数据[:-1]):
+                累计 += 计数
+                le = f'le="{_format_value(上界)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, 标签, le)} {_format_value(累计)}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, 标签)} {_format_value(数据[-1])}"
+            yield f"{self.name}_count{_format_labels(self.label_names, 标签)} {_format_value(累计)}"
+
+
+class MetricsRegistry:
+    """指标注册表,按 Prometheus 文本格式输出;collectors 在抓取时动态生成额外的样本行"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = ()) -> Histogram:
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[str]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        行列表: List[str] = []
+        for 指标 in self._metrics:
+            行列表.append(f"# HELP {指标.name} {指标.help}")
+            行列表.append(f"# TYPE {指标.name} {指标.type_name}")
+            行列表.extend(指标.samples())
+        for 收集器 in self._collectors:
+            行列表.extend(收集器())
+        return "\n".join(行列表) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TTFT_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)
+TPS_BUCKETS = (1, 5, 10, 20, 30, 40, 50, 75, 100, 150, 200, 300)
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+
+# 上游调用(由 AIClient 记录),标签: upstream=上游索引, model=模型名
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "ai_upstream_requests_total", "Upstream calls by outcome", ("upstream", "model", "outcome"))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "ai_upstream_errors_total", "Upstream call errors by reason", ("upstream", "model", "reason"))
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "ai_upstream_in_flight", "Upstream calls currently in flight", ("upstream", "model"))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "ai_upstream_latency_seconds", "Total upstream call latency", ("upstream", "model"), LATENCY_BUCKETS)
+UPSTREAM_TTFT = REGISTRY.histogram(
+    "ai_upstream_ttft_seconds", "Time to first token", ("upstream", "model"), TTFT_BUCKETS)
+UPSTREAM_TPS = REGISTRY.histogram(
+    "ai_upstream_tokens_per_second", "Decode speed after the first token", ("upstream", "model"), TPS_BUCKETS)
+
+# 服务端路由(由 chat、test_all 等接口记录)
+ROUTE_REQUESTS = REGISTRY.counter(
+    "ai_http_requests_total", "Requests served by route and status code", ("route", "code"))
+ROUTE_LATENCY = REGISTRY.histogram(
+    "ai_http_request_duration_seconds", "Request latency by route", ("route",), LATENCY_BUCKETS)
+# 客户端在回答完成前断开(随后取消的上游调用计入 ai_upstream_requests_total{outcome="cancelled"})
+CLIENT_DISCONNECTS = REGISTRY.counter(
+    "ai_client_disconnects_total", "Requests abandoned by the client before completion", ("route",))
+
+# 准入控制(由 AdmissionController 记录)
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    "ai_admission_queue_depth", "Requests waiting for an upstream concurrency slot")
+ADMISSION_WAIT = REGISTRY.histogram(
+    "ai_admission_wait_seconds", "Time spent waiting for a concurrency slot", ("upstream",), WAIT_BUCKETS)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "ai_admission_rejected_total", "Requests rejected by admission control", ("reason",))
+
+# 调用方公平排队(由 AdmissionController 记录),标签 tenant 为 [[tenant]] 的名称或 anonymous
+TENANT_QUEUE_WAIT = REGISTRY.histogram(
+    "ai_tenant_queue_wait_seconds", "Time spent waiting for a concurrency slot by tenant", ("tenant",), WAIT_BUCKETS)
+TENANT_CALLS = REGISTRY.counter(
+    "ai_tenant_upstream_calls_total", "Completed upstream calls by tenant", ("tenant",))
+TENANT_OUTPUT_TOKENS = REGISTRY.counter(
+    "ai_tenant_output_tokens_total", "Completion tokens delivered by tenant", ("tenant",))
+
+
+# 模型池路由(由 ModelRouter 记录),标签 pool 为首选池,不限池时为 all
+POOL_REQUESTS = REGISTRY.counter(
+    "ai_pool_requests_total", "Requests dispatched by preferred model pool and routing reason", ("pool", "reason"))
+POOL_FALLBACKS = REGISTRY.counter(
+    "ai_pool_fallbacks_total", "Upstream calls sent to a fallback pool", ("pool", "fallback"))
+
+
+def decode_tps(tokens: Optional[float], first_token_at: Optional[float], finished_at: float) -> Optional[float]:
+    """首token之后的解码速度(token/秒);首token本身的耗时计入首token延迟,不计入解码"""
+    if tokens is None or first_token_at is None or tokens <= 1 or finished_at <= first_token_at:
+        return None
+    return (tokens - 1) / (finished_at - first_token_at)
+
+
+class UpstreamCall:
+    """一次上游调用的指标记录器,由 AIClient 在流式读取过程中使用
+
+    Example:
+        >>> 记录 = UpstreamCall("0", "doubao-1-5-lite-32k-250115")
+        >>> 记录.on_delta()          # 每收到一个增量调用一次
+        >>> 记录.finish("success", completion_tokens=usage.get("completion_tokens"))
+    """
+    __slots__ = ("labels", "start", "first_token_at", "tokens", "_finished")
+
+    def __init__(self, upstream: str, model: str):
+        self.labels = (upstream, model)
+        self.start = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.tokens = 0
+        self._finished = False
+        UPSTREAM_IN_FLIGHT.inc(self.labels)
+
+    def on_delta(self, tokens: int = 1) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            UPSTREAM_TTFT.observe(self.labels, self.first_token_at - self.start)
+        self.tokens += tokens
+
+    def finish(self, outcome: str, reason: Optional[str] = None, completion_tokens: Optional[int] = None) -> None:
+        """completion_tokens 为上游返回的回答token数,有时代替增量个数计算解码速度"""
+        if self._finished:
+            return
+        self._finished = True
+        现在 = time.perf_counter()
+        UPSTREAM_IN_FLIGHT.dec(self.labels)
+        UPSTREAM_REQUESTS.inc(self.labels + (outcome,))
+        if reason is not None:
+            UPSTREAM_ERRORS.inc(self.labels + (reason,))
+        if outcome == "success":
+            UPSTREAM_LATENCY.observe(self.labels, 现在 - self.start)
+            速度 = decode_tps(completion_tokens or self.tokens, self.first_token_at, 现在)
+            if 速度 is not None:
+                UPSTREAM_TPS.observe(self.labels, 速度)
+
+
+def observe_route(route: str, code: int, started: float) -> None:
+    """记录一次服务端请求;started 为 time.perf_counter() 取得的开始时间,状态码 499 表示客户端断开"""
+    ROUTE_REQUESTS.inc((route, str(code)))
+    if code == 499:
+        CLIENT_DISCONNECTS.inc((route,))
+    ROUTE_LATENCY.observe((route,), time.perf_counter() - started)
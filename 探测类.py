@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+from AIClass import AIClient, ChatPayload, Timeouts
+from 日志类 import LogThrottle
+from 负载均衡类 import Upstream
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProbeConfig:
+    """后台探测配置,对应 ai_configs.toml 中的 [probe] 段"""
+    enabled: bool = False            # 是否在后台定时探测所有上游;每次探测都是一次计费的补全请求,默认关闭
+    interval: float = 300.0          # 两轮探测之间的间隔(秒)
+    initial_delay: float = 5.0       # 启动后第一轮探测的延迟(秒)
+    concurrency: int = 4             # 同时探测的上游数上限(后台和 live 探测共用)
+    timeout: float = 30.0            # 单个上游的探测超时(秒)
+    system_prompt: str = "Reply with OK."
+    question: str = "ping"           # 探测用的提问,尽量短,只为测出延迟和可用性
+    max_tokens: int = 8              # 探测回答的token上限
+    history: int = 20                # 每个上游保留最近多少次探测结果,用于计算成功率
+    snapshot_path: Optional[str] = None  # 多进程时各进程共享探测结果的文件;不设置时只在本进程内保存
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ProbeConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+class _ProbeEntry:
+    """单个上游的探测记录"""
+    __slots__ = ("row", "outcomes", "consecutive_failures", "last_error", "last_error_at", "last_success_at")
+
+    def __init__(self, history: int):
+        self.row: Optional[Dict[str, Any]] = None
+        self.outcomes: Deque[bool] = deque(maxlen=history)
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.last_error_at: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+
+
+class UpstreamProber:
+    """上游探测器:在后台按固定间隔用简短的提问探测每个上游,把结果保存在记分板中
+
+    探测不经过负载均衡器和熔断器,直接调用每个上游;同时进行的探测数受 concurrency 限制,
+    同一上游正在进行的默认探测会被后来的请求复用。设置 snapshot_path 时,
+    每轮结束后把记分板写入该文件,其他进程读取记分板时合并其中更新的结果。
+
+    Example:
+        >>> 探测器 = UpstreamProber(ProbeConfig(interval=300), lambda: 负载均衡器.upstreams)
+        >>> 探测器.start()
+        >>> 探测器.scoreboard()["详细结果"]
+        [{'api_index': 0, 'api_model': '...', 'test_result': {'status': 'success', 'time': 0.41, ...}, ...}]
+        >>> async for 结果 in 探测器.probe_all():   # 立即探测一轮,按完成顺序产出
+        ...     print(结果["api_index"], 结果["test_result"]["status"])
+        >>> await 探测器.stop()
+    """
+
+    def __init__(self, config: Optional[ProbeConfig] = None,
+                 upstreams: Callable[[], List[Upstream]] = lambda: [], background: bool = True):
+        self.config = config or ProbeConfig()
+        self.upstreams = upstreams
+        self.background = background and self.config.enabled
+        self._entries: Dict[int, _ProbeEntry] = {}
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(max(1, self.config.concurrency))
+        self._task: Optional[asyncio.Task] = None
+        self._snapshot = Path(self.config.snapshot_path) if self.config.snapshot_path else None
+        self._peer_rows: Dict[int, Dict[str, Any]] = {}
+        self._peer_mtime: Optional[int] = None
+        self.counts = {"rounds": 0, "probes": 0, "failures": 0, "shared": 0}
+        self.last_round_at: Optional[float] = None
+        self.last_round_time: Optional[float] = None
+        self._failure_log = LogThrottle(600)  # 上游长时间故障时,探测失败最多每10分钟记录一次
+
+    def start(self) -> None:
+        if self.background and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for 任务 in list(self._inflight.values()):
+            任务.cancel()
+
+    async def _run(self) -> None:
+        await asyncio.sleep(self.config.initial_delay)
+        while True:
+            try:
+                async for _ in self.probe_all():
+                    pass
+            except Exception as e:
+                被压下 = self._failure_log.allow()
+                if 被压下 is not None:
+                    logger.warning(f"上游探测失败,下一轮继续: {e}" + (f"(此前另有 {被压下} 轮失败未记录)" if 被压下 else ""))
+            await asyncio.sleep(self.config.interval)
+
+    def _payload(self, question: Optional[str]) -> ChatPayload:
+        载荷 = ChatPayload.from_question(question or self.config.question, self.config.system_prompt,
+                                         Timeouts(first_byte=self.config.timeout, idle=self.config.timeout))
+        载荷.params = {"temperature": 0, "max_tokens": self.config.max_tokens}
+        return 载荷
+
+    async def probe_all(self, question: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """立即探测当前所有上游,按完成顺序产出每个上游的记分板条目;question 为空时使用配置的探测提问"""
+        开始时间 = time.monotonic()
+        任务列表 = [asyncio.ensure_future(self.probe(上游, question)) for 上游 in self.upstreams()]
+        try:
+            for 完成 in asyncio.as_completed(任务列表):
+                yield await 完成
+        finally:
+            for 任务 in 任务列表:
+                任务.cancel()
+        self.counts["rounds"] += 1
+        self.last_round_at = round(time.time(), 3)
+        self.last_round_time = round(time.monotonic() - 开始时间, 2)
+        await self._save()
+
+    async def probe(self, upstream: Upstream, question: Optional[str] = None) -> Dict[str, Any]:
+        """探测单个上游并更新记分板,返回它的条目;同一上游正在进行的默认探测直接复用"""
+        if question is not None:
+            await self._probe(upstream, question)
+            return self._row(upstream)
+        任务 = self._inflight.get(upstream.index)
+        if 任务 is None:
+            任务 = asyncio.ensure_future(self._probe(upstream, None))
+            self._inflight[upstream.index] = 任务
+            任务.add_done_callback(lambda _: self._inflight.pop(upstream.index, None))
+        else:
+            self.counts["shared"] += 1
+        await asyncio.shield(任务)
+        return self._row(upstream)
+
+    async def _probe(self, upstream: Upstream, question: Optional[str]) -> None:
+        async with self._semaphore:
+            开始时间 = time.time()
+            try:
+                结果 = await asyncio.wait_for(
+                    AIClient.async_timed_chat(upstream.config, self._payload(question), f"probe-{upstream.index}"),
+                    self.config.timeout)
+            except asyncio.TimeoutError:
+                结果 = {"status": "timeout", "time": round(time.time() - 开始时间, 2),
+                        "message": f"探测超过 {self.config.timeout} 秒"}
+            except Exception as e:
+                结果 = {"status": "error", "time": round(time.time() - 开始时间, 2), "message": str(e)}
+        self._record(upstream.index, 结果)
+
+    def _record(self, index: int, result: Dict[str, Any]) -> None:
+        条目 = self._entries.get(index)
+        if 条目 is None:
+            条目 = self._entries[index] = _ProbeEntry(self.config.history)
+        现在 = round(time.time(), 3)
+        成功 = result["status"] == "success"
+        self.counts["probes"] += 1
+        条目.outcomes.append(成功)
+        if 成功:
+            条目.consecutive_failures = 0
+            条目.last_success_at = 现在
+        else:
+            self.counts["failures"] += 1
+            条目.consecutive_failures += 1
+            条目.last_error = result.get("message")
+            条目.last_error_at = 现在
+        条目.row = {
+            "test_result": {**result, "checked_at": 现在},
+            "success_rate": round(sum(条目.outcomes) / len(条目.outcomes), 4),
+            "consecutive_failures": 条目.consecutive_failures,
+            "last_error": 条目.last_error,
+            "last_error_at": 条目.last_error_at,
+            "last_success_at": 条目.last_success_at,
+        }
+
+    def _row(self, upstream: Upstream) -> Dict[str, Any]:
+        条目 = self._entries.get(upstream.index)
+        行 = 条目.row if 条目 is not None else None
+        其他进程 = self._peer_rows.get(upstream.index)
+        if 其他进程 is not None and (行 is None or 其他进程["test_result"]["checked_at"] > 行["test_result"]["checked_at"]):
+            行 = 其他进程
+        if 行 is None:
+            行 = {"test_result": {"status": "pending", "time": None, "checked_at": None}}
+        return {"api_index": upstream.index, "api_url": upstream.config.url, "api_model": upstream.config.model, **行}
+
+    def scoreboard(self) -> Dict[str, Any]:
+        """当前上游的最近一次探测结果:成功的按耗时升序在前,其次是失败的,尚未探测的在最后"""
+        self._load()
+        行列表 = [self._row(上游) for 上游 in self.upstreams()]
+        顺序 = {"success": 0, "pending": 2}
+        行列表.sort(key=lambda 行: (顺序.get(行["test_result"]["status"], 1), 行["test_result"]["time"] or 0))
+        return {
+            "总用时": self.last_round_time,
+            "接口数量": len(行列表),
+            "详细结果": 行列表,
+            "探测": self.stats(),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "background": self._task is not None,
+            "interval": self.config.interval,
+            "concurrency": self.config.concurrency,
+            "last_round_at": self.last_round_at,
+            "in_flight": len(self._inflight),
+        }
+
+    async def _save(self) -> None:
+        if self._snapshot is None:
+            return
+        行 = {str(编号): 条目.row for 编号, 条目 in self._entries.items() if 条目.row is not None}
+        await asyncio.to_thread(self._write_snapshot, 行)
+
+    def _write_snapshot(self, rows: Dict[str, Any]) -> None:
+        # 合并文件中其他进程更新的结果后整体替换,读取方不会看到写了一半的文件
+        try:
+            已有 = json.loads(self._snapshot.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            已有 = {}
+        for 编号, 行 in 已有.items():
+            if 编号 not in rows or 行["test_result"]["checked_at"] > rows[编号]["test_result"]["checked_at"]:
+                rows[编号] = 行
+        self._snapshot.parent.mkdir(parents=True, exist_ok=True)
+        临时文件 = self._snapshot.with_name(f"{self._snapshot.name}.{os.getpid()}.tmp")
+        临时文件.write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+        os.replace(临时文件, self._snapshot)
+
+    def _load(self) -> None:
+        """读取其他进程写入的记分板;文件未变化时不重复解析"""
+        if self._snapshot is None:
+            return
+        try:
+            修改时间 = self._snapshot.stat().st_mtime_ns
+            if 修改时间 == self._peer_mtime:
+                return
+            self._peer_rows = {int(编号): 行 for 编号, 行 in
+                               json.loads(self._snapshot.read_text(encoding="utf-8")).items()}
+            self._peer_mtime = 修改时间
+        except (OSError, ValueError):
+            pass
@@ -1,9 +1,77 @@
+import atexit
 import logging
 import os
+import queue
+import time
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
-from typing import Optional, Union
+from typing import Dict, List, Optional, Union
+
+class BoundedQueueHandler(QueueHandler):
+    """有界队列日志处理器
+
+    调用线程只负责把日志记录放入队列,真正的文件和控制台写入由后台监听线程完成。
+    队列满时按策略处理:"drop" 立即丢弃并计数,"block" 最多等待 block_timeout 秒后再丢弃。
+
+    Attributes:
+        dropped (int): 因队列已满被丢弃的日志条数
+    """
+
+    def __init__(self, maxsize: int, full_policy: str = "drop", block_timeout: float = 1.0):
+        if full_policy not in ("drop", "block"):
+            raise ValueError(f"未知的队列满处理策略: {full_policy}")
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 监听线程与调用线程在同一进程内,记录无需序列化;格式化留给监听线程的处理器完成,
+        # 基类的 prepare 会在调用线程中格式化整条消息(大段问答时正是阻塞事件循环的部分)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.full_policy == "block":
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _DrainingQueueListener(QueueListener):
+    """队列已满时,停止信号也要排队等待,保证剩余日志全部写完"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+class LogThrottle:
+    """限制同一类日志的输出频率:interval 秒内只放行一条,期间被压下的条数随下一条放行的日志报告
+
+    用于后台任务和流式热路径中可能连续出现的同类错误,避免上游故障期间日志刷屏。
+
+    Example:
+        >>> 节流 = LogThrottle(60)
+        >>> 被压下 = 节流.allow()
+        >>> if 被压下 is not None:
+        ...     logger.warning(f"上游探测失败: {e}(此前 {被压下} 次未记录)")
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.suppressed = 0
+        self._last: Optional[float] = None
+
+    def allow(self) -> Optional[int]:
+        """可以输出时返回上次输出以来被压下的条数(可能为0),否则返回 None 并计入被压下的条数"""
+        现在 = time.monotonic()
+        if self._last is not None and 现在 - self._last < self.interval:
+            self.suppressed += 1
+            return None
+        self._last = 现在
+        被压下, self.suppressed = self.suppressed, 0
+        return 被压下
 
 class LoggerManager:
     """日志管理器类,用于统一配置和管理日志系统
@@ -21,11 +89,17 @@ class LoggerManager:
         set_level: 设置日志级别
         clean_old_logs: 清理过期日志文件
         get_instance: 获取单例日志记录器
+        stop: 异步模式下写完队列中剩余日志并停止后台线程
+        queue_stats: 获取异步模式的队列状态和丢弃计数
 
     Example:
         >>> logger_manager = LoggerManager()
         >>> logger = logger_manager.get_logger()
         >>> logger.info("这是一条日志消息")
+
+        >>> # 异步模式:在事件循环中记录大段日志时不阻塞
+        >>> logger_manager = LoggerManager(async_mode=True, queue_size=10000)
+        >>> logger_manager.stop()  # 关闭时写完剩余日志
     """
     
     def __init__(self,
@@ -36,7 +110,11 @@ class LoggerManager:
                 backup_count: int = 5,
                 log_format: str = '%(asctime)s - %(levelname)s - %(message)s',
                 encoding: str = 'utf-8',
-                console_output: bool = True):
+                console_output: bool = True,
+                async_mode: bool = False,
+                queue_size: int = 10000,
+                full_policy: str = "drop",
+                block_timeout: float = 1.0):
         """初始化日志管理器
 
         配置日志记录器的各项参数,包括日志级别、存储位置、轮转策略等。
@@ -51,6 +129,10 @@ class LoggerManager:
             log_format (str): 日志格式字符串,默认包含时间、级别和消息
             encoding (str): 日志文件编码,默认utf-8
             console_output (bool): 是否同时输出到控制台,默认True
+            async_mode (bool): 是否启用异步模式,由后台线程写日志,默认False
+            queue_size (int): 异步模式的队列容量,默认10000条
+            full_policy (str): 队列满时的策略,"drop"丢弃或"block"等待,默认"drop"
+            block_timeout (float): "block"策略下最多等待的秒数,默认1秒
 
         Raises:
             RuntimeError: 创建日志目录或处理器失败时抛出
@@ -66,21 +148,33 @@ class LoggerManager:
         self.logger = logging.getLogger(name)
         self.logger.setLevel(log_level)
         
+        self.queue_handler: Optional[BoundedQueueHandler] = None
+        self.listener: Optional[_DrainingQueueListener] = None
+        
         # 避免重复添加处理器
         if not self.logger.handlers:
-            # 添加文件处理器
-            file_handler = self._create_file_handler(
+            # 创建文件处理器
+            handlers: List[logging.Handler] = [self._create_file_handler(
                 max_bytes=max_bytes,
                 backup_count=backup_count,
                 log_format=log_format,
                 encoding=encoding
-            )
-            self.logger.addHandler(file_handler)
+            )]
             
-            # 添加控制台处理器
+            # 创建控制台处理器
             if console_output:
-                console_handler = self._create_console_handler(log_format)
-                self.logger.addHandler(console_handler)
+                handlers.append(self._create_console_handler(log_format))
+
+            if async_mode:
+                # 记录器只挂队列处理器,文件和控制台处理器交给后台监听线程
+                self.queue_handler = BoundedQueueHandler(queue_size, full_policy, block_timeout)
+                self.listener = _DrainingQueueListener(self.queue_handler.queue, *handlers, respect_handler_level=True)
+                self.listener.start()
+                self.logger.addHandler(self.queue_handler)
+                atexit.register(self.stop)
+            else:
+                for handler in handlers:
+                    self.logger.addHandler(handler)
     
     def _set_log_dir(self):
         """设置日志目录为当前脚本所在目录下的子目录
@@ -191,6 +285,38 @@ class LoggerManager:
         except Exception as e:
             self.logger.error(f"清理旧日志文件失败: {e}")
 
+    def stop(self) -> None:
+        """停止异步模式的后台线程
+
+        会先写完队列中剩余的日志再返回,可重复调用;非异步模式下无操作。
+        停止后记录器改为直接挂文件和控制台处理器,之后的日志同步写入,不会进入无人消费的队列。
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.flush()
+            self.logger.removeHandler(self.queue_handler)
+            for handler in self.listener.handlers:
+                self.logger.addHandler(handler)
+            self.listener = None
+
+    def queue_stats(self) -> Dict[str, Union[int, bool]]:
+        """获取异步日志队列状态
+
+        Returns:
+            Dict[str, Union[int, bool]]: 是否异步模式、当前队列长度、队列容量和已丢弃条数
+        """
+        if self.queue_handler is None:
+            return {"async_mode": False}
+        return {
+            "async_mode": True,
+            "running": self.listener is not None,
+            "queued": self.queue_handler.queue.qsize(),
+            "capacity": self.queue_handler.queue.maxsize,
+            "dropped": self.queue_handler.dropped,
+            "full_policy": self.queue_handler.full_policy,
+        }
+
     @staticmethod
     def get_instance(name: str = "app") -> logging.Logger:
         """获取单例日志记录器
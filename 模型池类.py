@@ -0,0 +1,127 @@
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from 负载均衡类 import LoadBalancer, Upstream
+from 指标类 import POOL_FALLBACKS, POOL_REQUESTS
+
+AUTO = "auto"  # 请求的模型为 auto 时与不指定相同,由路由决定
+
+
+@dataclass
+class RoutingConfig:
+    """模型池路由配置,对应 ai_configs.toml 中的 [routing] 段"""
+    default_pool: Optional[str] = None   # 请求未指定模型时使用的池;不设置时在全部上游中选择
+    fallback: Dict[str, List[str]] = field(default_factory=dict)    # 池内上游都已满或不可用时依次改用的池
+    strategies: Dict[str, str] = field(default_factory=dict)        # 各池的负载均衡策略,不设置时与 [balancer] strategy 相同
+    cheap_router: bool = False           # 是否把未指定模型的短提问发给 cheap_pool
+    cheap_pool: str = "lite"
+    cheap_max_chars: int = 200           # 提示词(含系统提示词)不超过该字数时视为短提问
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "RoutingConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+@dataclass(frozen=True)
+class Route:
+    """一次请求可以使用的上游范围"""
+    pools: Tuple[str, ...] = ()   # 按顺序尝试的模型池,为空时不限池
+    model: Optional[str] = None   # 请求指定了具体模型时,只选该模型的上游
+    reason: str = "default"       # requested(指定池) / model(指定模型) / cheap(短提问) / default
+
+    @property
+    def label(self) -> str:
+        return self.pools[0] if self.pools else "all"
+
+    @property
+    def cache_scope(self) -> str:
+        """缓存键中代表回答来源的部分:范围相同的请求可以共用回答,与最终由哪个上游回答无关"""
+        if self.model is not None:
+            return self.model
+        return "pool:" + "+".join(self.pools) if self.pools else "*"
+
+
+class UnknownModel(ValueError):
+    """请求指定的模型既不是模型池名,也不是任何上游的模型名"""
+
+
+class ModelRouter:
+    """模型池路由:按请求指定的模型或提问长度决定使用哪些池
+
+    请求指定池名时使用该池,池内上游都已满或不可用时按 fallback 依次改用其他池;
+    指定具体模型名时只使用该模型的上游,不改用其他模型。未指定时,开启 cheap_router 且提问足够短时
+    使用 cheap_pool(同样可以 fallback),否则使用 default_pool,都没有时在全部上游中选择。
+    模型池由 [[ai]] 的 pool 字段决定,热加载后立即按新的分组路由。
+
+    Example:
+        >>> 路由 = ModelRouter(RoutingConfig(fallback={"lite": ["pro"]}, cheap_router=True), 负载均衡器)
+        >>> 路由.route("lite", 50)
+        Route(pools=('lite', 'pro'), model=None, reason='requested')
+        >>> 路由.route(None, 30)
+        Route(pools=('lite', 'pro'), model=None, reason='cheap')
+    """
+
+    def __init__(self, config: Optional[RoutingConfig] = None, balancer: Optional[LoadBalancer] = None):
+        self.config = config or RoutingConfig()
+        self.balancer = balancer
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.fallbacks: Dict[str, Dict[str, int]] = {}
+
+    def knows(self, name: Optional[str]) -> bool:
+        """name 为空、auto、模型池名或某个上游的模型名时返回 True"""
+        if not name or name == AUTO:
+            return True
+        return name in self.balancer.pools() or bool(self.balancer.members(model=name))
+
+    def route(self, requested: Optional[str], prompt_chars: int) -> Route:
+        """决定请求使用的上游范围;requested 不是已知的池名或模型名时抛出 UnknownModel"""
+        池表 = self.balancer.pools()
+        if requested and requested != AUTO:
+            if requested in 池表:
+                return Route(self._chain(requested, 池表), reason="requested")
+            所在池 = tuple(dict.fromkeys(上游.config.pool for 上游 in self.balancer.members(model=requested)))
+            if 所在池:
+                return Route(所在池, model=requested, reason="model")
+            raise UnknownModel(f"未知的模型或模型池: {requested},可用的模型池: {', '.join(池表)}")
+        配置 = self.config
+        if 配置.cheap_router and 配置.cheap_pool in 池表 and prompt_chars <= 配置.cheap_max_chars:
+            return Route(self._chain(配置.cheap_pool, 池表), reason="cheap")
+        if 配置.default_pool in 池表:
+            return Route(self._chain(配置.default_pool, 池表))
+        return Route()
+
+    def _chain(self, pool: str, pools: Dict[str, List[Upstream]]) -> Tuple[str, ...]:
+        """pool 及其 fallback 池,去掉重复和当前不存在的池"""
+        return tuple(dict.fromkeys(池 for 池 in (pool, *self.config.fallback.get(pool, ())) if 池 in pools))
+
+    def record(self, route: Route) -> None:
+        """记录一次按 route 调度的请求"""
+        按原因 = self.counts.setdefault(route.label, {})
+        按原因[route.reason] = 按原因.get(route.reason, 0) + 1
+        POOL_REQUESTS.inc((route.label, route.reason))
+
+    def record_attempt(self, route: Route, upstream: Upstream) -> None:
+        """上游调用落在首选池以外时记一次 fallback"""
+        if route.pools and upstream.config.pool != route.pools[0]:
+            改用 = self.fallbacks.setdefault(route.pools[0], {})
+            改用[upstream.config.pool] = 改用.get(upstream.config.pool, 0) + 1
+            POOL_FALLBACKS.inc((route.pools[0], upstream.config.pool))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "default_pool": self.config.default_pool,
+            "cheap_router": self.config.cheap_router,
+            "cheap_pool": self.config.cheap_pool,
+            "cheap_max_chars": self.config.cheap_max_chars,
+            "pools": {
+                池: {
+                    "strategy": self.balancer.pool_strategies.get(池, self.balancer.strategy.name),
+                    "fallback": list(self._chain(池, self.balancer.pools())[1:]),
+                    "upstreams": [{"index": 上游.index, "model": 上游.config.model} for 上游 in 成员],
+                }
+                for 池, 成员 in self.balancer.pools().items()
+            },
+            "requests": self.counts,
+            "fallbacks": self.fallbacks,
+        }
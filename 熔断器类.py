@@ -0,0 +1,156 @@
+import time
+from collections import deque
+from dataclasses import dataclass, fields
+from typing import Any, Deque, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 失败的类别:只有 ERROR 计入熔断。上游限流已按 Retry-After 单独冷却;请求自身的时间预算耗尽
+# 和请求本身有误(4xx)说明不了上游是否健康,计入会让短超时的调用方或一阵限流把健康的上游熔断
+ERROR = "error"
+RATE_LIMITED = "rate_limited"
+DEADLINE = "deadline"
+CLIENT_ERROR = "client_error"
+
+
+def failure_kind(status: Optional[int] = None) -> str:
+    """按上游返回的 HTTP 状态码区分失败类别;没有状态码(连接错误、超时、中途断开)时为 ERROR"""
+    if status == 429:
+        return RATE_LIMITED
+    if status is not None and 400 <= status < 500:
+        return CLIENT_ERROR
+    return ERROR
+
+
+@dataclass
+class BreakerConfig:
+    """熔断器配置,对应 ai_configs.toml 中的 [breaker] 段"""
+    failure_threshold: int = 5             # 连续失败多少次后熔断
+    error_rate_threshold: float = 0.5      # 滑动窗口内错误率达到该值后熔断
+    window_size: int = 20                  # 滑动窗口保留的最近请求数
+    min_requests: int = 10                 # 计算错误率所需的最少样本数
+    open_duration: float = 30.0            # 熔断打开后多久进入半开(秒)
+    half_open_max_calls: int = 1           # 半开状态下同时允许的试探请求数
+    half_open_success_threshold: int = 2   # 半开状态下连续成功多少次后恢复
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "BreakerConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+class CircuitBreaker:
+    """单个上游的熔断器
+
+    closed: 正常放行,记录结果;连续失败或错误率过高时转为 open
+    open: 拒绝所有请求,open_duration 到期后转为 half_open
+    half_open: 只放行有限的试探请求,连续成功则 closed,任一失败则重新 open
+
+    record_failure 的 kind 不是 ERROR 时只释放试探名额并计数,不影响状态。
+    before_call 返回的试探令牌要原样传给 release/record_success/record_failure:只有在半开状态下占用了
+    试探名额的调用结束时才释放名额,熔断前(closed)发出、半开后才结束的调用不会释放别人的试探名额。
+    """
+
+    def __init__(self, config: Optional[BreakerConfig] = None):
+        self.config = config or BreakerConfig()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.window: Deque[bool] = deque(maxlen=self.config.window_size)
+        self.opened_at = 0.0
+        self.open_count = 0
+        self.half_open_in_flight = 0
+        self.half_open_successes = 0
+        self.half_open_period = 0  # 每次进入半开加一,试探令牌即占用名额时的该值
+        self.last_error: Optional[str] = None
+        self.ignored_failures: Dict[str, int] = {}
+
+    def _refresh(self) -> None:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.config.open_duration:
+            self.state = HALF_OPEN
+            self.half_open_in_flight = 0
+            self.half_open_successes = 0
+            self.half_open_period += 1
+
+    def available(self) -> bool:
+        """当前是否可以向该上游发送请求(不占用试探名额)"""
+        self._refresh()
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN:
+            return self.half_open_in_flight < self.config.half_open_max_calls
+        return False
+
+    def before_call(self) -> Optional[int]:
+        """开始一次调用;半开状态下占用一个试探名额并返回试探令牌,否则返回 None"""
+        self._refresh()
+        if self.state == HALF_OPEN:
+            self.half_open_in_flight += 1
+            return self.half_open_period
+        return None
+
+    def release(self, trial: Optional[int] = None) -> None:
+        """调用被取消(如客户端断开)时释放试探名额,不计入成败;trial 为 before_call 返回的试探令牌"""
+        # 令牌属于已经结束的半开期(其间重新熔断过)时,名额已随状态切换清零,不能再减
+        if (trial is not None and trial == self.half_open_period and self.state == HALF_OPEN
+                and self.half_open_in_flight > 0):
+            self.half_open_in_flight -= 1
+
+    def record_success(self, trial: Optional[int] = None) -> None:
+        self.release(trial)
+        self.consecutive_failures = 0
+        self.window.append(True)
+        if self.state == HALF_OPEN:
+            self.half_open_successes += 1
+            if self.half_open_successes >= self.config.half_open_success_threshold:
+                self._close()
+
+    def record_failure(self, error: Optional[str] = None, kind: str = ERROR, trial: Optional[int] = None) -> None:
+        self.release(trial)
+        if kind != ERROR:
+            self.ignored_failures[kind] = self.ignored_failures.get(kind, 0) + 1
+            return
+        self.last_error = error
+        self.consecutive_failures += 1
+        self.window.append(False)
+        if self.state == HALF_OPEN:
+            self._open()
+        elif self.state == CLOSED and (
+            self.consecutive_failures >= self.config.failure_threshold or self._error_rate_exceeded()
+        ):
+            self._open()
+
+    def _error_rate_exceeded(self) -> bool:
+        if len(self.window) < self.config.min_requests:
+            return False
+        return self.window.count(False) / len(self.window) >= self.config.error_rate_threshold
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.open_count += 1
+        self.half_open_in_flight = 0
+        self.half_open_successes = 0
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.window.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        self._refresh()
+        错误率 = self.window.count(False) / len(self.window) if self.window else 0.0
+        数据 = {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "error_rate": round(错误率, 4),
+            "window_requests": len(self.window),
+            "open_count": self.open_count,
+            "half_open_in_flight": self.half_open_in_flight,
+            "last_error": self.last_error,
+            "ignored_failures": dict(self.ignored_failures),
+        }
+        if self.state == OPEN:
+            数据["retry_in"] = round(max(0.0, self.opened_at + self.config.open_duration - time.monotonic()), 2)
+        return 数据
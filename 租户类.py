@@ -0,0 +1,114 @@
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Mapping, Optional
+
+ANONYMOUS = "anonymous"
+
+
+@dataclass
+class FairnessConfig:
+    """调用方识别与公平排队配置,对应 ai_configs.toml 中的 [fairness] 段"""
+    enabled: bool = False
+    header: str = "X-API-Key"       # 携带调用方 key 的请求头;没有时也接受 Authorization: Bearer <key>
+    require_key: bool = False       # 为 true 时缺少或未知 key 的请求以 401 拒绝,否则归入 anonymous
+    anonymous_weight: float = 1.0   # 未识别调用方的权重
+    anonymous_max_concurrency: Optional[int] = None  # 未识别调用方的并发配额,None 为不限制
+    window: float = 60.0            # 统计各调用方吞吐的时间窗口(秒)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "FairnessConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+@dataclass
+class TenantConfig:
+    """一个 [[tenant]] 调用方条目"""
+    name: str
+    key: str = ""
+    weight: float = 1.0                    # 排队时按权重分配空闲名额,权重越大排得越靠前
+    max_concurrency: Optional[int] = None  # 该调用方同时进行的上游调用数上限
+    max_queue: Optional[int] = None        # 该调用方同时排队的请求数上限,不设置时只受 [admission] max_queue 限制
+    queue_timeout: Optional[float] = None  # 该调用方的最长排队时间(秒),不设置时使用 [admission] queue_timeout
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TenantConfig":
+        """校验并转换一个 [[tenant]] 条目,不合法时抛出 ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError(f"调用方配置应为表,实际为 {type(data).__name__}")
+        for 字段 in ("name", "key"):
+            if not isinstance(data.get(字段), str) or not data[字段].strip():
+                raise ValueError(f"缺少字段 {字段} 或不是非空字符串")
+        if data["name"] == ANONYMOUS:
+            raise ValueError(f"{ANONYMOUS} 是保留名称,其权重和配额在 [fairness] 中设置")
+        for 字段 in ("weight", "queue_timeout"):
+            值 = data.get(字段)
+            if 值 is not None and (isinstance(值, bool) or not isinstance(值, (int, float)) or 值 <= 0):
+                raise ValueError(f"{字段} 必须是正数: {值!r}")
+        for 字段 in ("max_concurrency", "max_queue"):
+            值 = data.get(字段)
+            if 值 is not None and (isinstance(值, bool) or not isinstance(值, int) or 值 <= 0):
+                raise ValueError(f"{字段} 必须是正整数: {值!r}")
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in 已知字段})
+
+    @classmethod
+    def from_list(cls, items: Any) -> List["TenantConfig"]:
+        """校验整个 [[tenant]] 列表,名称和 key 都不能重复"""
+        if items is None:
+            return []
+        if not isinstance(items, list):
+            raise ValueError("[[tenant]] 应为表数组")
+        结果 = []
+        for 序号, 条目 in enumerate(items):
+            try:
+                结果.append(cls.from_dict(条目))
+            except ValueError as e:
+                raise ValueError(f"第 {序号 + 1} 个 [[tenant]] 条目不合法: {e}") from None
+        for 字段 in ("name", "key"):
+            值列表 = [getattr(租户, 字段) for 租户 in 结果]
+            if len(set(值列表)) != len(值列表):
+                raise ValueError(f"[[tenant]] 的 {字段} 不能重复")
+        return 结果
+
+
+class TenantRejected(Exception):
+    """要求识别调用方时,请求没有携带 key 或 key 未知"""
+
+
+class TenantRegistry:
+    """调用方登记表:按请求头中的 key 识别调用方,并提供其权重和配额
+
+    未识别的调用方归入 anonymous(require_key 为 true 时拒绝);日志和统计中只出现调用方名称,不出现 key。
+
+    Example:
+        >>> 登记表 = TenantRegistry(FairnessConfig(enabled=True), [TenantConfig("web", "sk-web", weight=4)])
+        >>> 登记表.identify({"x-api-key": "sk-web"})
+        'web'
+        >>> 登记表.identify({})
+        'anonymous'
+    """
+
+    def __init__(self, config: Optional[FairnessConfig] = None, tenants: Optional[List[TenantConfig]] = None):
+        self.config = config or FairnessConfig()
+        self.tenants: Dict[str, TenantConfig] = {租户.name: 租户 for 租户 in tenants or []}
+        self._by_key = {租户.key: 租户.name for 租户 in tenants or []}
+        self.anonymous = TenantConfig(ANONYMOUS, weight=self.config.anonymous_weight,
+                                      max_concurrency=self.config.anonymous_max_concurrency)
+
+    def identify(self, headers: Mapping[str, str]) -> str:
+        """返回调用方名称;headers 的键不区分大小写(如 Starlette 的 Headers)或已转为小写"""
+        key = headers.get(self.config.header.lower())
+        if not key:
+            认证 = headers.get("authorization") or ""
+            if 认证[:7].lower() == "bearer ":
+                key = 认证[7:].strip()
+        名称 = self._by_key.get(key) if key else None
+        if 名称 is not None:
+            return 名称
+        if self.config.require_key:
+            raise TenantRejected("缺少调用方 key" if not key else "未知的调用方 key")
+        return ANONYMOUS
+
+    def policy(self, name: Optional[str]) -> TenantConfig:
+        """调用方的权重和配额;未登记的名称按 anonymous 处理"""
+        return self.tenants.get(name) or self.anonymous
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from pathlib import Path
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+@dataclass
+class CacheConfig:
+    """响应缓存配置,对应 ai_configs.toml 中的 [cache] 段"""
+    enabled: bool = True
+    max_entries: int = 1024            # 内存层最多缓存的回答数
+    ttl: float = 600.0                 # 回答的有效期(秒)
+    sqlite_path: Optional[str] = None  # 设置后启用磁盘层,重启后仍可命中
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "CacheConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+class _SQLiteTier:
+    """磁盘缓存层,所有操作在线程池中执行,避免阻塞事件循环"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            行 = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(行[0]) if 行 else None
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            删除数 = self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            self._conn.commit()
+        return 删除数
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """回答缓存:内存 LRU+TTL 层、可选的 SQLite 磁盘层,以及相同请求的合并(single-flight)
+
+    同一个键同时有多个未命中请求时,只有第一个真正请求上游,其余等待并共享它的结果;
+    所有等待者都断开时才取消这次上游请求。
+
+    Example:
+        >>> cache = ResponseCache(CacheConfig(sqlite_path="cache/responses.db"))
+        >>> key = ResponseCache.make_key(model, system_prompt, question, params)
+        >>> 结果, 来源 = await cache.get_or_fetch(key, 请求上游)
+    """
+
+    def __init__(self, config: Optional[CacheConfig] = None):
+        self.config = config or CacheConfig()
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[asyncio.Task, list]] = {}
+        self._disk = _SQLiteTier(self.config.sqlite_path) if self.config.sqlite_path else None
+        self.counts = {
+            "memory_hits": 0, "disk_hits": 0, "shared": 0, "misses": 0,
+            "bypassed": 0, "stores": 0, "evictions": 0, "expired": 0,
+        }
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, question: str, params: Dict[str, Any]) -> str:
+        原文 = json.dumps([model, system_prompt, question, params], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(原文.encode("utf-8")).hexdigest()
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Tuple[Any, bool]]],
+                           bypass: bool = False) -> Tuple[Any, str]:
+        """返回 (值, 来源);来源为 memory / disk / shared / miss / bypass
+
+        fetch 返回 (值, 是否可缓存);bypass 为 True 时跳过读取和合并,但仍写入新结果。
+        """
+        if bypass:
+            self.counts["bypassed"] += 1
+            值, 可缓存 = await fetch()
+            if 可缓存:
+                await self.put(key, 值)
+            return 值, "bypass"
+
+        值 = self._memory_get(key)
+        if 值 is not None:
+            self.counts["memory_hits"] += 1
+            return 值, "memory"
+
+        if key in self._inflight:
+            self.counts["shared"] += 1
+            return await self._wait(key), "shared"
+
+        if self._disk is not None:
+            值 = await asyncio.to_thread(self._disk.get, key)
+            if 值 is not None:
+                self.counts["disk_hits"] += 1
+                self._memory_put(key, 值)
+                return 值, "disk"
+            if key in self._inflight:  # 查询磁盘期间可能已有相同请求发出
+                self.counts["shared"] += 1
+                return await self._wait(key), "shared"
+
+        self.counts["misses"] += 1
+        任务 = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+        self._inflight[key] = (任务, [0])
+        任务.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await self._wait(key), "miss"
+
+    async def _fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[Tuple[Any, bool]]]) -> Any:
+        值, 可缓存 = await fetch()
+        if 可缓存:
+            await self.put(key, 值)
+        return 值
+
+    async def _wait(self, key: str) -> Any:
+        任务, 等待数 = self._inflight[key]
+        等待数[0] += 1
+        try:
+            return await asyncio.shield(任务)
+        except asyncio.CancelledError:
+            if not 任务.done() and 等待数[0] == 1:
+                任务.cancel()
+            raise
+        finally:
+            等待数[0] -= 1
+
+    def _memory_get(self, key: str) -> Optional[Any]:
+        条目 = self._memory.get(key)
+        if 条目 is None:
+            return None
+        过期时间, 值 = 条目
+        if 过期时间 <= time.monotonic():
+            del self._memory[key]
+            self.counts["expired"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return 值
+
+    def _memory_put(self, key: str, value: Any) -> None:
+        self._memory[key] = (time.monotonic() + self.config.ttl, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.config.max_entries:
+            self._memory.popitem(last=False)
+            self.counts["evictions"] += 1
+
+    async def put(self, key: str, value: Any) -> None:
+        self.counts["stores"] += 1
+        self._memory_put(key, value)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.put, key, value, self.config.ttl)
+
+    async def stats(self) -> Dict[str, Any]:
+        命中 = self.counts["memory_hits"] + self.counts["disk_hits"] + self.counts["shared"]
+        查询 = 命中 + self.counts["misses"]
+        数据 = {
+            **self.counts,
+            "hit_ratio": round(命中 / 查询, 4) if 查询 else 0.0,
+            "memory_size": len(self._memory),
+            "max_entries": self.config.max_entries,
+            "in_flight": len(self._inflight),
+        }
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.purge_expired)
+            数据["disk_size"] = await asyncio.to_thread(self._disk.size)
+        return 数据
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
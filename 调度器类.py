@@ -0,0 +1,575 @@
+import asyncio
+import time
+from dataclasses import dataclass, fields, replace
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from AIClass import AIClient, ChatPayload, Timeouts, UpstreamError, DEFAULT_SYSTEM_PROMPT
+from 负载均衡类 import LoadBalancer, NoUpstreamAvailable, Upstream
+from 熔断器类 import DEADLINE, failure_kind
+from 缓存类 import ResponseCache
+from 近似缓存类 import ApproxCache
+from 准入控制类 import AdmissionController, AdmissionRejected, UpstreamSlots
+from 模型池类 import ModelRouter, Route, UnknownModel
+from 限流类 import RateLimiter, RateLimitConfig, Reservation
+from SSE解析类 import RelayChunk
+from 指标类 import decode_tps
+
+
+@dataclass
+class RetryConfig:
+    """故障转移配置,对应 ai_configs.toml 中的 [retry] 段"""
+    max_attempts: int = 3          # 单个请求最多尝试的上游次数
+    deadline: float = 120.0        # 单个请求的总时间预算(秒),请求未指定超时时使用
+    max_deadline: float = 600.0    # 请求通过 X-Request-Timeout 等指定的总时间预算上限(秒)
+    max_retry_after: float = 10.0  # 所有上游都不可用时,最多愿意按 Retry-After 等待的秒数
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "RetryConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+@dataclass
+class HedgeConfig:
+    """对冲请求配置,对应 ai_configs.toml 中的 [hedge] 段"""
+    enabled: bool = False          # 全局默认是否对冲,单个请求可通过 对冲 字段覆盖
+    delay: Optional[float] = None  # 固定对冲延迟(秒);不设置时使用主上游首token延迟的实时分位数
+    percentile: float = 0.95       # 实时对冲延迟使用的分位数
+    min_samples: int = 20          # 使用实时分位数所需的最少样本数
+    default_delay: float = 2.0     # 样本不足时的对冲延迟(秒)
+    min_delay: float = 0.1         # 对冲延迟下限(秒)
+    max_ratio: float = 0.1         # 对冲请求占全部请求的比例上限
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "HedgeConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+class DispatchError(Exception):
+    """请求最终失败,携带应返回给客户端的状态码和全部尝试记录"""
+
+    def __init__(self, message: str, status_code: int, attempts: List[Dict[str, Any]],
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.attempts = attempts
+        self.retry_after = retry_after
+
+    def headers(self) -> Optional[Dict[str, str]]:
+        if self.retry_after is None:
+            return None
+        return {"Retry-After": str(max(1, round(self.retry_after)))}
+
+
+class Dispatcher:
+    """请求调度器:通过负载均衡器选择上游,在时间预算内对可重试的失败自动换上游重试
+
+    只有尚未收到上游首个增量(连接错误、5xx、429)的失败才会重试。
+    开启对冲时,主上游在对冲延迟内没有产出首个增量,就把同一问题再发给另一个上游,
+    先产出首个增量的一方胜出,另一方被取消;对冲次数受 max_ratio 限制。
+    配置了准入控制时,每次上游调用前先取得并发名额,优先选择还有空闲名额的上游。
+    配置了限流时,按预估token数避开 RPM/TPM 额度不足的上游,发送前预扣额度,结束后按实际用量修正。
+    配置了近似缓存时,ask 在精确缓存未命中后查找相似的问题,命中时返回它的回答并附带相似度。
+    配置了模型池路由时,只在路由给出的池中选择上游:优先首选池中还有空闲名额的上游,
+    首选池已满或不可用时依次改用 fallback 池,都已满时在首选池排队。
+    调用方传入 slots(UpstreamSlots)时,每个上游同时进行的该类调用不超过其上限,都已满时等待名额释放。
+    stream 产出回答增量;relay 接受完整的消息列表,产出原样的上游 SSE 字节块(RelayChunk)。
+    """
+
+    def __init__(self, balancer: LoadBalancer, retry_config: Optional[RetryConfig] = None,
+                 hedge_config: Optional[HedgeConfig] = None, cache: Optional[ResponseCache] = None,
+                 admission: Optional[AdmissionController] = None, rate_limiter: Optional[RateLimiter] = None,
+                 approx_cache: Optional[ApproxCache] = None, router: Optional[ModelRouter] = None):
+        self.balancer = balancer
+        self.router = router
+        self.cache = cache
+        self.approx_cache = approx_cache
+        self.admission = admission
+        self.rate_limiter = rate_limiter
+        self.retry_config = retry_config or RetryConfig()
+        self.hedge_config = hedge_config or HedgeConfig()
+        self._hedge_tokens = 1.0
+        self.hedge_counts = {"requests": 0, "hedged": 0, "hedge_wins": 0, "budget_exhausted": 0}
+
+    async def ask(self, question: str, system_prompt: Optional[str] = None, hedge: Optional[bool] = None,
+                  bypass_cache: bool = False, timeouts: Optional[Timeouts] = None,
+                  tenant: Optional[str] = None, model: Optional[str] = None,
+                  slots: Optional[UpstreamSlots] = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """非流式提问,返回 (结果, 尝试记录);最终失败时抛出 DispatchError
+
+        timeouts 为请求指定的超时,total 代替 [retry] deadline 作为整个请求的时间预算;
+        tenant 为调用方名称,准入控制按它公平排队(合并的相同请求只按首个请求的调用方排队);
+        model 为请求指定的模型池名或模型名,未知时以 400 失败;
+        slots 为按上游限制并发的名额表,只选择其中还有名额的上游,调用期间占用一个名额。
+
+        启用缓存时以请求的路由范围(指定的模型、模型池或全部上游)、系统提示词、问题和采样参数为键查缓存,
+        同时到达的相同请求合并为一次上游调用,由首个请求在未命中时再选择上游;
+        命中时结果带 cache 字段且尝试记录为空。精确缓存未命中而近似缓存命中时,
+        cache 为 similar,结果另带 similarity 字段(与缓存问题的相似度)。
+        """
+        if self.cache is None and self.approx_cache is None:
+            return await self._ask_upstream(question, system_prompt, hedge, timeouts=timeouts, tenant=tenant,
+                                            model=model, slots=slots)
+        载荷 = ChatPayload.from_question(question, system_prompt)
+        载荷.model = model
+        范围 = self._route(载荷).cache_scope
+        系统提示词 = system_prompt or DEFAULT_SYSTEM_PROMPT
+        参数 = AIClient.sampling_params
+        尝试记录: List[Dict[str, Any]] = []
+
+        async def 请求上游() -> Tuple[Dict[str, Any], bool]:
+            if self.approx_cache is not None and not bypass_cache:
+                近似 = self.approx_cache.lookup(范围, 系统提示词, question, 参数)
+                if 近似 is not None:
+                    # 近似命中的回答不写入精确缓存,以免以当前问题为键
+                    return 近似[0], False
+            结果, 记录 = await self._ask_upstream(question, system_prompt, hedge, timeouts=timeouts,
+                                               tenant=tenant, model=model, slots=slots)
+            尝试记录.extend(记录)
+            if self.approx_cache is not None:
+                self.approx_cache.put(范围, 系统提示词, question, 参数, 结果)
+            return 结果, True
+
+        if self.cache is None:
+            结果, _ = await 请求上游()
+            来源 = "miss"
+        else:
+            键 = ResponseCache.make_key(范围, 系统提示词, question, 参数)
+            结果, 来源 = await self.cache.get_or_fetch(键, 请求上游, bypass=bypass_cache)
+        if 来源 == "miss" and "similarity" in 结果:
+            来源 = "similar"
+        return {**结果, "cache": 来源}, 尝试记录
+
+    async def _ask_upstream(self, question: str, system_prompt: Optional[str] = None, hedge: Optional[bool] = None,
+                            timeouts: Optional[Timeouts] = None, tenant: Optional[str] = None,
+                            model: Optional[str] = None,
+                            slots: Optional[UpstreamSlots] = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        尝试记录: List[Dict[str, Any]] = []
+        开始时间 = time.time()
+        try:
+            片段列表 = [增量 async for 增量 in
+                        self.stream(question, 尝试记录, system_prompt, hedge, timeouts, tenant, model, slots)]
+        except UpstreamError as e:
+            raise DispatchError(str(e), 504 if e.timed_out else 502, 尝试记录)
+        回答 = "".join(片段列表)
+        return {
+            "status": "success",
+            "time": round(time.time() - 开始时间, 2),
+            "message": 回答,
+            "message_length": len(回答),
+        }, 尝试记录
+
+    def stream(self, question: str, attempts: List[Dict[str, Any]],
+               system_prompt: Optional[str] = None, hedge: Optional[bool] = None,
+               timeouts: Optional[Timeouts] = None, tenant: Optional[str] = None,
+               model: Optional[str] = None, slots: Optional[UpstreamSlots] = None) -> AsyncIterator[str]:
+        """流式提问,逐个产出增量;尝试记录写入调用方传入的 attempts
+
+        在第一个增量产出之前的可重试失败会换上游重试,之后的失败直接抛出。
+        timeouts 为请求指定的超时;tenant 为调用方名称;model 为请求指定的模型池名或模型名;
+        slots 为按上游限制并发的名额表。
+        """
+        载荷 = ChatPayload.from_question(question, system_prompt, timeouts)
+        载荷.tenant = tenant
+        载荷.model = model
+        载荷.slots = slots
+        return self._stream(载荷, attempts, hedge)
+
+    def relay(self, payload: ChatPayload, attempts: List[Dict[str, Any]],
+              hedge: Optional[bool] = None) -> AsyncIterator[RelayChunk]:
+        """转发完整的对话请求,产出原样的上游 SSE 字节块;重试、对冲、准入和限流与 stream 相同
+
+        第一个字节块即包含首个回答增量,在它之前的可重试失败会换上游重试;
+        请求指定的超时、调用方和模型分别在 payload.timeouts、payload.tenant、payload.model 中。
+        """
+        return self._stream(replace(payload, raw=True), attempts, hedge)
+
+    async def _stream(self, payload: ChatPayload, attempts: List[Dict[str, Any]],
+                      hedge: Optional[bool] = None) -> AsyncIterator[Any]:
+        对冲 = self.hedge_config.enabled if hedge is None else hedge
+        成本 = self._estimate_cost(payload)
+        输出token数 = payload.max_output_tokens()
+        路线 = self._route(payload)
+        if self.router is not None:
+            self.router.record(路线)
+        self._refill_hedge_budget()
+        已尝试: Set[int] = set()
+        截止时间 = time.monotonic() + self._time_budget(payload.timeouts)
+        最后错误: Optional[UpstreamError] = None
+        while len(attempts) < self.retry_config.max_attempts:
+            上游 = await self._next_upstream(已尝试, 截止时间, attempts, 最后错误, 成本, 输出token数, 路线,
+                                            payload.slots)
+            已尝试.add(上游.index)
+            if self.router is not None:
+                self.router.record_attempt(路线, 上游)
+            try:
+                if 对冲:
+                    上游流, 首个增量 = await self._hedged_first(上游, payload, attempts, 已尝试, 截止时间, 成本, 输出token数,
+                                                          路线)
+                else:
+                    上游流 = self._upstream_stream(上游, payload, attempts, 截止时间, 成本)
+                    首个增量 = await self._first_delta(上游流)
+            except UpstreamError as e:
+                最后错误 = self._handle_upstream_error(e, attempts)
+                continue
+            try:
+                if 首个增量 is not None:
+                    yield 首个增量
+                    async for 增量 in 上游流:
+                        yield 增量
+                return
+            finally:
+                await 上游流.aclose()
+        raise self._to_dispatch_error(最后错误, attempts)
+
+    async def _upstream_stream(self, upstream: Upstream, payload: ChatPayload,
+                               attempts: List[Dict[str, Any]], deadline: float,
+                               cost: float = 0.0) -> AsyncIterator[Any]:
+        """对单个上游的一次流式调用,负责统计、熔断记录和尝试记录
+
+        首个增量受请求截止时间约束;之后每收到一个增量检查一次截止时间。
+        UpstreamError 会附带 upstream 属性,供调度器冷却对应上游。
+        准入控制拒绝时抛出对应状态码(429/503)的 DispatchError,不再换上游重试。
+        payload.slots 不为空时,从排队到调用结束一直占用该上游的一个名额。
+        """
+        开始时间 = time.monotonic()
+        名额 = payload.slots
+        if 名额 is not None:
+            名额.acquire(upstream.index)
+        try:
+            if self.admission is not None:
+                try:
+                    await self.admission.acquire(upstream.index, deadline - 开始时间, payload.tenant)
+                except AdmissionRejected as e:
+                    attempts.append(self._attempt(upstream, 开始时间, "rejected", str(e)))
+                    raise DispatchError(str(e), e.status_code, attempts, retry_after=e.retry_after)
+                except asyncio.CancelledError:
+                    attempts.append(self._attempt(upstream, 开始时间, "cancelled"))
+                    raise
+            预留 = upstream.rate_limit.reserve(cost) if upstream.rate_limit is not None else None
+            用量: Dict[str, Any] = {}
+            输出字数 = 0
+            上游流 = self._tracked_stream(upstream, payload, attempts, deadline, 开始时间, 用量)
+            try:
+                async for 增量 in 上游流:
+                    输出字数 += len(增量.text) if payload.raw else len(增量)
+                    yield 增量
+            finally:
+                await 上游流.aclose()
+                if 预留 is not None:
+                    self._settle(预留, 用量, 输出字数)
+                if self.admission is not None:
+                    self.admission.release(upstream.index, payload.tenant, self._output_tokens(用量, 输出字数))
+        finally:
+            if 名额 is not None:
+                名额.release(upstream.index)
+
+    async def _tracked_stream(self, upstream: Upstream, payload: ChatPayload,
+                              attempts: List[Dict[str, Any]], deadline: float, started: float,
+                              usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[Any]:
+        """在负载均衡器统计下调用上游;started 为尝试开始时刻(含排队),首token延迟从放行后开始计
+
+        成功结束时把首token延迟和解码速度记入上游的吞吐窗口,并写入尝试记录(ttft、tokens、tps);
+        回答token数优先取上游返回的用量,没有时按回答字数估算。
+        """
+        调用开始 = time.monotonic()
+        用量 = usage if usage is not None else {}
+        with self.balancer.track(upstream) as 调用记录:
+            上游流 = AIClient.async_stream_chat(upstream.config, payload, upstream_label=str(upstream.index), usage=用量)
+            try:
+                try:
+                    首个增量 = await asyncio.wait_for(上游流.__anext__(), timeout=max(0.0, deadline - 调用开始))
+                except StopAsyncIteration:
+                    首个增量 = None
+                except asyncio.TimeoutError:
+                    调用记录.update(error="超出请求时间预算", kind=DEADLINE)
+                    attempts.append(self._attempt(upstream, started, "timeout", "超出请求时间预算"))
+                    raise DispatchError("超出请求时间预算", 504, attempts)
+                except UpstreamError as e:
+                    调用记录.update(error=str(e), kind=failure_kind(e.status))
+                    attempts.append(self._attempt(upstream, started, "timeout" if e.timed_out else "error", str(e), e.status))
+                    e.upstream = upstream
+                    raise
+                except asyncio.CancelledError:
+                    # 对冲落败或客户端断开
+                    attempts.append(self._attempt(upstream, started, "cancelled"))
+                    raise
+                首token时刻 = time.monotonic()
+                首token延迟 = 首token时刻 - 调用开始
+                upstream.stats.record_ttft(首token延迟)
+                尝试 = self._attempt(upstream, started, "success")
+                attempts.append(尝试)
+                输出字数 = 0
+                if 首个增量 is not None:
+                    输出字数 += len(首个增量.text) if payload.raw else len(首个增量)
+                    yield 首个增量
+                    try:
+                        async for 增量 in 上游流:
+                            输出字数 += len(增量.text) if payload.raw else len(增量)
+                            yield 增量
+                            if time.monotonic() > deadline:
+                                raise DispatchError("超出请求时间预算", 504, attempts)
+                    except (UpstreamError, DispatchError) as e:
+                        超时 = isinstance(e, DispatchError) or e.timed_out
+                        调用记录.update(error=str(e),
+                                        kind=DEADLINE if isinstance(e, DispatchError) else failure_kind(e.status))
+                        尝试.update(status="timeout" if 超时 else "error", error=str(e))
+                        raise
+                调用记录["success"] = True
+                回答token数 = self._output_tokens(用量, 输出字数)
+                解码速度 = decode_tps(回答token数, 首token时刻, time.monotonic())
+                upstream.stats.record_throughput(首token延迟, 解码速度, 用量)
+                尝试.update(ttft=round(首token延迟, 3), tokens=round(回答token数),
+                            tps=round(解码速度, 1) if 解码速度 is not None else None)
+            finally:
+                await 上游流.aclose()
+
+    @staticmethod
+    async def _first_delta(upstream_stream: AsyncIterator[Any]) -> Any:
+        try:
+            return await upstream_stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def _hedged_first(self, primary: Upstream, payload: ChatPayload,
+                            attempts: List[Dict[str, Any]], tried: Set[int],
+                            deadline: float, cost: float = 0.0, output_tokens: Optional[float] = None,
+                            route: Route = Route()) -> Tuple[AsyncIterator[Any], Any]:
+        """主上游与对冲上游竞速首个增量,返回胜出方的流和首个增量,其余参赛者被取消"""
+        参赛者: Dict[asyncio.Task, Tuple[Upstream, AsyncIterator[Any]]] = {}
+
+        def 出发(上游: Upstream) -> None:
+            上游流 = self._upstream_stream(上游, payload, attempts, deadline, cost)
+            参赛者[asyncio.ensure_future(self._first_delta(上游流))] = (上游, 上游流)
+
+        出发(primary)
+        try:
+            已完成, _ = await asyncio.wait(list(参赛者), timeout=self._hedge_delay(primary))
+            if not 已完成:
+                对冲上游 = self._take_hedge_slot(tried, cost, output_tokens, route, payload.slots)
+                if 对冲上游 is not None:
+                    tried.add(对冲上游.index)
+                    出发(对冲上游)
+            最后错误: Optional[BaseException] = None
+            while 参赛者:
+                已完成, _ = await asyncio.wait(list(参赛者), return_when=asyncio.FIRST_COMPLETED)
+                for 任务 in 已完成:
+                    上游, 上游流 = 参赛者.pop(任务)
+                    错误 = 任务.exception()
+                    if 错误 is None:
+                        if 上游 is not primary:
+                            self.hedge_counts["hedge_wins"] += 1
+                        return 上游流, 任务.result()
+                    if isinstance(错误, UpstreamError) and 错误.retry_after:
+                        上游.cool_down(错误.retry_after)
+                    最后错误 = 错误
+            raise 最后错误
+        finally:
+            # 取消落败者:任务取消会关闭其上游连接,熔断器按取消处理不计失败
+            for 任务 in 参赛者:
+                任务.cancel()
+            for 任务, (_, 上游流) in 参赛者.items():
+                try:
+                    await 任务
+                except BaseException:
+                    pass
+                await 上游流.aclose()
+
+    def _refill_hedge_budget(self) -> None:
+        # 每个请求积攒 max_ratio 个对冲名额,每次对冲消耗一个;上限允许短时间内突发若干次对冲
+        self.hedge_counts["requests"] += 1
+        self._hedge_tokens = min(self._hedge_tokens + self.hedge_config.max_ratio,
+                                 max(1.0, self.hedge_config.max_ratio * 100))
+
+    def _hedge_delay(self, upstream: Upstream) -> float:
+        配置 = self.hedge_config
+        if 配置.delay is not None:
+            return max(配置.min_delay, 配置.delay)
+        if len(upstream.stats.ttft_samples) < 配置.min_samples:
+            return 配置.default_delay
+        return max(配置.min_delay, upstream.stats.ttft_percentile(配置.percentile))
+
+    def _take_hedge_slot(self, tried: Set[int], cost: float = 0.0, output_tokens: Optional[float] = None,
+                         route: Route = Route(), slots: Optional[UpstreamSlots] = None) -> Optional[Upstream]:
+        """对冲预算允许且路由范围内有其他可用上游时,返回用于对冲的上游"""
+        if self._hedge_tokens < 1.0:
+            self.hedge_counts["budget_exhausted"] += 1
+            return None
+        try:
+            # 对冲只发给有空闲名额的上游,排队等待的对冲请求没有意义
+            已满 = (self.admission.saturated() if self.admission else set()) | (slots.saturated() if slots else set())
+            上游 = self._select_in(route, set(tried) | 已满, cost, output_tokens)
+        except NoUpstreamAvailable:
+            return None
+        self._hedge_tokens -= 1.0
+        self.hedge_counts["hedged"] += 1
+        return 上游
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        return {
+            **self.hedge_counts,
+            "enabled_by_default": self.hedge_config.enabled,
+            "budget_tokens": round(self._hedge_tokens, 2),
+            "delays": {上游.index: round(self._hedge_delay(上游), 3) for 上游 in self.balancer.upstreams},
+        }
+
+    async def _next_upstream(self, tried: Set[int], deadline: float, attempts: List[Dict[str, Any]],
+                             last_error: Optional[UpstreamError], cost: float = 0.0,
+                             output_tokens: Optional[float] = None, route: Route = Route(),
+                             slots: Optional[UpstreamSlots] = None) -> Upstream:
+        """选择下一个上游;全部不可用但有上游在 Retry-After 冷却、等待限流额度或 slots 名额时,在预算内等待它恢复"""
+        while True:
+            try:
+                return self._select(tried, cost, output_tokens, route, slots)
+            except NoUpstreamAvailable as e:
+                if slots is not None and time.monotonic() < deadline and any(
+                        上游.index in slots.saturated() and 上游.index not in tried and 上游.available()
+                        for 上游 in self._members(route)):
+                    await slots.wait(deadline - time.monotonic())
+                    continue
+                等待上游 = self._soonest_cooling(deadline, cost, route)
+                if 等待上游 is None:
+                    if last_error is not None:
+                        raise self._to_dispatch_error(last_error, attempts)
+                    if self._rate_limited(cost, route):
+                        raise DispatchError("所有上游的 RPM/TPM 额度已用尽", 429, attempts,
+                                            retry_after=self._cooldown_remaining(cost, route))
+                    raise DispatchError(str(e), 503, attempts, retry_after=self._cooldown_remaining(cost, route))
+                await asyncio.sleep(等待上游.wait_time(cost))
+                tried.discard(等待上游.index)
+
+    def _route(self, payload: ChatPayload) -> Route:
+        """请求可以使用的上游范围;没有配置路由时为全部上游,指定的模型未知时以 400 失败"""
+        if self.router is None:
+            return Route()
+        try:
+            return self.router.route(payload.model, payload.prompt_chars())
+        except UnknownModel as e:
+            raise DispatchError(str(e), 400, [])
+
+    def _members(self, route: Route) -> List[Upstream]:
+        if not route.pools:
+            return self.balancer.members(model=route.model)
+        return [上游 for 池 in route.pools for 上游 in self.balancer.members(池, route.model)]
+
+    def _select(self, exclude: Set[int] = frozenset(), cost: float = 0.0,
+                output_tokens: Optional[float] = None, route: Route = Route(),
+                slots: Optional[UpstreamSlots] = None) -> Upstream:
+        """优先在还有并发名额的上游中选择(按池的顺序);全部已满时仍按策略选择,由准入控制排队
+
+        slots 的名额是硬上限:名额已满的上游不会被选中。
+        """
+        if slots is not None:
+            exclude = set(exclude) | slots.saturated()
+        if self.admission is not None:
+            已满 = self.admission.saturated()
+            if 已满:
+                try:
+                    return self._select_in(route, set(exclude) | 已满, cost, output_tokens)
+                except NoUpstreamAvailable:
+                    pass
+        return self._select_in(route, exclude, cost, output_tokens)
+
+    def _select_in(self, route: Route, exclude: Set[int], cost: float = 0.0,
+                   output_tokens: Optional[float] = None) -> Upstream:
+        """按路由的池顺序,在第一个有可用上游的池中按该池的策略选择"""
+        if not route.pools:
+            return self.balancer.select(exclude=exclude, cost=cost, output_tokens=output_tokens, model=route.model)
+        for 池 in route.pools:
+            try:
+                return self.balancer.select(exclude=exclude, cost=cost, output_tokens=output_tokens, pool=池,
+                                            model=route.model)
+            except NoUpstreamAvailable:
+                pass
+        raise NoUpstreamAvailable(f"模型池 {', '.join(route.pools)} 中没有可用的上游(均已熔断、冷却或已尝试)")
+
+    def _soonest_cooling(self, deadline: float, cost: float = 0.0, route: Route = Route()) -> Optional[Upstream]:
+        现在 = time.monotonic()
+        候选 = [
+            上游 for 上游 in self._members(route)
+            if 上游.breaker.available() and 上游.wait_time(cost) > 0
+        ]
+        if not 候选:
+            return None
+        上游 = min(候选, key=lambda u: u.wait_time(cost))
+        等待 = 上游.wait_time(cost)
+        if 等待 > self.retry_config.max_retry_after or 现在 + 等待 >= deadline:
+            return None
+        return 上游
+
+    def _cooldown_remaining(self, cost: float = 0.0, route: Route = Route()) -> Optional[float]:
+        等待 = [上游.wait_time(cost) for 上游 in self._members(route)]
+        等待 = [秒 for 秒 in 等待 if 秒 > 0]
+        return min(等待) if 等待 else None
+
+    def _rate_limited(self, cost: float, route: Route = Route()) -> bool:
+        return any(
+            上游.rate_limit is not None and not 上游.rate_limit.can_afford(cost)
+            for 上游 in self._members(route) if 上游.breaker.available()
+        )
+
+    def _estimate_cost(self, payload: ChatPayload) -> float:
+        if self.rate_limiter is None:
+            return 0.0
+        return self.rate_limiter.estimate_chars(payload.prompt_chars())
+
+    def _output_tokens(self, usage: Dict[str, Any], output_chars: int) -> float:
+        if usage.get("completion_tokens") is not None:
+            return usage["completion_tokens"]
+        if self.rate_limiter is not None:
+            return self.rate_limiter.estimate_output(output_chars)
+        return output_chars / RateLimitConfig.chars_per_token
+
+    def _settle(self, reservation: Reservation, usage: Dict[str, Any], output_chars: int) -> None:
+        """用上游返回的实际用量修正预扣额度
+
+        上游没有返回用量时按回答字数估算;没有产出回答的失败调用视为未计费,退回预扣的token。
+        """
+        if usage.get("total_tokens") is not None:
+            reservation.settle(usage["total_tokens"])
+        elif output_chars == 0:
+            reservation.settle(0)
+        else:
+            提示词 = reservation.tokens - self.rate_limiter.config.estimated_output_tokens
+            reservation.settle(提示词 + self.rate_limiter.estimate_output(output_chars))
+
+    def _handle_upstream_error(self, error: UpstreamError, attempts: List[Dict[str, Any]]) -> UpstreamError:
+        上游 = getattr(error, "upstream", None)
+        if error.retry_after and 上游 is not None:
+            上游.cool_down(error.retry_after)
+        if not error.retryable:
+            raise self._to_dispatch_error(error, attempts)
+        return error
+
+    def _time_budget(self, timeouts: Optional[Timeouts]) -> float:
+        """整个请求的时间预算:请求指定了 total 时使用它(不超过 max_deadline),否则为 [retry] deadline"""
+        if timeouts is None or timeouts.total is None:
+            return self.retry_config.deadline
+        return min(timeouts.total, self.retry_config.max_deadline)
+
+    @staticmethod
+    def _to_dispatch_error(error: Optional[UpstreamError], attempts: List[Dict[str, Any]]) -> DispatchError:
+        if error is None:
+            return DispatchError("没有可用的上游", 503, attempts)
+        if error.status == 429:
+            return DispatchError(str(error), 429, attempts, retry_after=error.retry_after)
+        if error.timed_out:
+            return DispatchError(str(error), 504, attempts)
+        return DispatchError(str(error), 502, attempts, retry_after=error.retry_after)
+
+    @staticmethod
+    def _attempt(upstream: Upstream, started: float, status: str, error: Optional[str] = None,
+                 http_status: Optional[int] = None) -> Dict[str, Any]:
+        记录 = {
+            "index": upstream.index,
+            "model": upstream.config.model,
+            "pool": upstream.config.pool,
+            "status": status,
+            "time": round(time.monotonic() - started, 3),
+        }
+        if error is not None:
+            记录["error"] = error
+        if http_status is not None:
+            记录["http_status"] = http_status
+        return 记录
@@ -0,0 +1,503 @@
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Collection, Deque, Dict, Iterator, List, Optional, Tuple
+
+from AIClass import AIConfig
+from 熔断器类 import ERROR, BreakerConfig, CircuitBreaker
+from 限流类 import RateLimit, RateLimiter
+
+
+class NoUpstreamAvailable(Exception):
+    """所有上游都处于熔断、冷却、额度不足或已被排除,没有可用的上游"""
+
+
+class ThroughputWindow:
+    """最近若干次成功调用的首token延迟和解码速度(token/秒),只保留 window 秒内、最多 max_samples 个样本
+
+    Example:
+        >>> 窗口 = ThroughputWindow(window=600, max_samples=64)
+        >>> 窗口.add(ttft=0.42, tps=38.5)
+        >>> 窗口.median_tps()
+        38.5
+    """
+    __slots__ = ("window", "_samples", "_cached")
+
+    def __init__(self, window: float = 600.0, max_samples: int = 64):
+        self.window = window
+        self._samples: Deque[Tuple[float, float, Optional[float]]] = deque(maxlen=max_samples)
+        # 每次选择上游都会读取中位数,样本没有变化时复用上次的结果
+        self._cached: Optional[Tuple[Tuple[int, float], Optional[float], Optional[float]]] = None
+
+    def add(self, ttft: float, tps: Optional[float]) -> None:
+        self._samples.append((time.monotonic(), ttft, tps))
+
+    def _prune(self) -> None:
+        最早 = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < 最早:
+            self._samples.popleft()
+
+    @staticmethod
+    def _median(values: List[float]) -> Optional[float]:
+        if not values:
+            return None
+        values.sort()
+        return values[len(values) // 2]
+
+    def _medians(self) -> Tuple[Optional[float], Optional[float]]:
+        self._prune()
+        if not self._samples:
+            return None, None
+        版本 = (len(self._samples), self._samples[-1][0])
+        if self._cached is None or self._cached[0] != 版本:
+            self._cached = (
+                版本,
+                self._median([样本[1] for 样本 in self._samples]),
+                self._median([样本[2] for 样本 in self._samples if 样本[2] is not None]),
+            )
+        return self._cached[1], self._cached[2]
+
+    def median_ttft(self) -> Optional[float]:
+        return self._medians()[0]
+
+    def median_tps(self) -> Optional[float]:
+        return self._medians()[1]
+
+    def __len__(self) -> int:
+        self._prune()
+        return len(self._samples)
+
+
+@dataclass
+class UpstreamStats:
+    """单个上游的实时统计:在途请求数、延迟的指数加权移动平均和最近的首token延迟样本
+
+    peer_* 为多进程部署时其他工作进程的汇总(见 多进程共享类.SharedState),单进程时保持为空。
+    """
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    ewma_latency: Optional[float] = None
+    ewma_updated: float = 0.0  # 最近一次更新 ewma_latency 的时刻(time.time,可跨进程比较)
+    last_latency: Optional[float] = None
+    ttft_samples: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+    peer_in_flight: int = 0
+    peer_ewma_latency: Optional[float] = None
+    peer_ewma_updated: float = 0.0
+    throughput: ThroughputWindow = field(default_factory=ThroughputWindow)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    usage_reported: int = 0   # 上游返回了用量的成功调用数,其余调用的token数按字数估算
+
+    @property
+    def total_in_flight(self) -> int:
+        """所有工作进程发往该上游的在途请求数"""
+        return self.in_flight + self.peer_in_flight
+
+    @property
+    def latency(self) -> Optional[float]:
+        """本进程与其他进程中更新较晚的那个EWMA延迟"""
+        if self.peer_ewma_latency is not None and self.peer_ewma_updated > self.ewma_updated:
+            return self.peer_ewma_latency
+        return self.ewma_latency
+
+    def record_ttft(self, ttft: float) -> None:
+        self.ttft_samples.append(ttft)
+
+    def ttft_percentile(self, percentile: float) -> Optional[float]:
+        if not self.ttft_samples:
+            return None
+        样本 = sorted(self.ttft_samples)
+        return 样本[min(len(样本) - 1, int(percentile * len(样本)))]
+
+    def record_throughput(self, ttft: float, tps: Optional[float], usage: Dict[str, Any]) -> None:
+        """记录一次成功调用的首token延迟、解码速度和上游返回的用量"""
+        self.throughput.add(ttft, tps)
+        if usage.get("completion_tokens") is not None:
+            self.usage_reported += 1
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.completion_tokens += usage["completion_tokens"]
+
+    def throughput_dict(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self.throughput),
+            "ttft_median": self._round(self.throughput.median_ttft()),
+            "tps_median": self._round(self.throughput.median_tps()),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "usage_reported": self.usage_reported,
+        }
+
+    def record(self, latency: float, success: bool, alpha: float) -> None:
+        self.requests += 1
+        if not success:
+            self.errors += 1
+            return
+        self.last_latency = latency
+        # 从其他进程的最新值继续平滑,各进程的EWMA不会各自漂移
+        基准 = self.latency
+        if 基准 is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = alpha * latency + (1 - alpha) * 基准
+        self.ewma_updated = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "peer_in_flight": self.peer_in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ewma_latency": self._round(self.ewma_latency),
+            "last_latency": self._round(self.last_latency),
+            "ttft_p50": self._round(self.ttft_percentile(0.5)),
+            "ttft_p95": self._round(self.ttft_percentile(0.95)),
+            "tps_median": self._round(self.throughput.median_tps()),
+        }
+
+    @staticmethod
+    def _round(value: Optional[float]) -> Optional[float]:
+        return round(value, 4) if value is not None else None
+
+
+@dataclass
+class Upstream:
+    """一个 [[ai]] 上游条目及其运行时统计
+
+    index 为上游编号:首次加载时等于在配置中的位置,热加载新增的上游获得新的编号,已删除的编号不再复用。
+    """
+    index: int
+    config: AIConfig
+    weight: float = 1.0
+    stats: UpstreamStats = field(default_factory=UpstreamStats)
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    current_weight: float = 0.0  # 平滑加权轮询的内部状态
+    cooldown_until: float = 0.0  # 上游返回 Retry-After 后,在此时刻(monotonic)之前不再选择
+    rate_limit: Optional[RateLimit] = None  # 与同 key、同模型的上游共享的 RPM/TPM 额度
+    peer_open_until: float = 0.0      # 其他工作进程的熔断器打开到此时刻(time.time)
+    peer_cooldown_until: float = 0.0  # 其他工作进程收到 Retry-After 后的冷却截止时刻(time.time)
+
+    def available(self, cost: float = 0.0) -> bool:
+        """未冷却、未熔断(包括其他工作进程中),且共享额度足够支付 cost 个token(外加一次请求)"""
+        if time.monotonic() < self.cooldown_until or not self.breaker.available():
+            return False
+        if time.time() < max(self.peer_open_until, self.peer_cooldown_until):
+            return False
+        return self.rate_limit is None or self.rate_limit.can_afford(cost)
+
+    def wait_time(self, cost: float = 0.0) -> float:
+        """冷却和额度两方面都恢复还需等待的秒数(不考虑熔断)"""
+        等待 = max(0.0, self.cooldown_until - time.monotonic(), self.peer_cooldown_until - time.time())
+        if self.rate_limit is not None:
+            等待 = max(等待, self.rate_limit.time_until(cost))
+        return 等待
+
+    def cool_down(self, seconds: float) -> None:
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "model": self.config.model,
+            "pool": self.config.pool,
+            "url": self.config.url,
+            "weight": self.weight,
+            **self.stats.to_dict(),
+            "breaker": self.breaker.state,
+            "rate_limited": self.rate_limit is not None and not self.rate_limit.can_afford(0),
+        }
+
+
+class SelectionStrategy:
+    """上游选择策略基类,子类实现 select
+
+    output_tokens 为本次请求预计的回答token数(请求中的 max_tokens),未设置时为 None,只有部分策略使用。
+    """
+    name = "base"
+
+    def select(self, upstreams: List[Upstream], output_tokens: Optional[float] = None) -> Upstream:
+        raise NotImplementedError
+
+
+class RoundRobinStrategy(SelectionStrategy):
+    name = "round_robin"
+
+    def __init__(self, counter: Optional[Callable[[], int]] = None):
+        """counter 返回下一个轮询序号,多进程部署时由各进程共享,不设置时使用本进程的计数"""
+        self._next = 0
+        self._counter = counter
+
+    def select(self, upstreams: List[Upstream], output_tokens: Optional[float] = None) -> Upstream:
+        if self._counter is not None:
+            return upstreams[self._counter() % len(upstreams)]
+        上游 = upstreams[self._next % len(upstreams)]
+        self._next += 1
+        return 上游
+
+
+class LeastOutstandingStrategy(SelectionStrategy):
+    """选择在途请求最少的上游,相同时轮换以免总压在第一个上"""
+    name = "least_outstanding"
+
+    def __init__(self):
+        self._offset = 0
+
+    def select(self, upstreams: List[Upstream], output_tokens: Optional[float] = None) -> Upstream:
+        self._offset += 1
+        n = len(upstreams)
+        return min((upstreams[(self._offset + i) % n] for i in range(n)), key=lambda u: u.stats.total_in_flight)
+
+
+class EWMALatencyStrategy(SelectionStrategy):
+    """按 EWMA延迟 × (在途数+1) 打分,尚无延迟样本的上游优先被探索"""
+    name = "ewma"
+
+    def select(self, upstreams: List[Upstream], output_tokens: Optional[float] = None) -> Upstream:
+        return min(upstreams, key=self._score)
+
+    @staticmethod
+    def _score(upstream: Upstream) -> float:
+        延迟 = upstream.stats.latency
+        if 延迟 is None:
+            return -1.0 / (upstream.stats.total_in_flight + 1)
+        return 延迟 * (upstream.stats.total_in_flight + 1)
+
+
+class PowerOfTwoStrategy(SelectionStrategy):
+    """随机取两个上游,选在途数更少者,相同则比较EWMA延迟"""
+    name = "p2c"
+
+    def select(self, upstreams: List[Upstream], output_tokens: Optional[float] = None) -> Upstream:
+        if len(upstreams) == 1:
+            return upstreams[0]
+        a, b = random.sample(upstreams, 2)
+        return min((a, b), key=lambda u: (u.stats.total_in_flight, u.stats.latency or 0.0))
+
+
+class WeightedStrategy(SelectionStrategy):
+    """平滑加权轮询,权重取自 ai_configs.toml 中每个 [[ai]] 的 weight 字段"""
+    name = "weighted"
+
+    def select(self, upstreams: List[Upstream], output_tokens: Optional[float] = None) -> Upstream:
+        总权重 = 0.0
+        最佳 = None
+        for 上游 in upstreams:
+            上游.current_weight += 上游.weight
+            总权重 += 上游.weight
+            if 最佳 is None or 上游.current_weight > 最佳.current_weight:
+                最佳 = 上游
+        最佳.current_weight -= 总权重
+        return 最佳
+
+
+class ThroughputStrategy(SelectionStrategy):
+    """按预计完成时间 (首token延迟 + 回答token数 / 解码速度) × (在途数+1) 打分
+
+    回答越长,解码速度的权重越大,长回答会被发给解码最快的上游;短回答主要比较首token延迟。
+    请求没有设置 max_tokens 时按 default_output_tokens 估计回答长度;尚无样本的上游优先被探索。
+    """
+    name = "throughput"
+
+    def __init__(self, default_output_tokens: float = 512):
+        self.default_output_tokens = default_output_tokens
+
+    def select(self, upstreams: List[Upstream], output_tokens: Optional[float] = None) -> Upstream:
+        回答token数 = output_tokens or self.default_output_tokens
+        return min(upstreams, key=lambda u: self._score(u, 回答token数))
+
+    @staticmethod
+    def _score(upstream: Upstream, output_tokens: float) -> float:
+        统计 = upstream.stats
+        首token延迟 = 统计.throughput.median_ttft()
+        解码速度 = 统计.throughput.median_tps()
+        if 首token延迟 is None or not 解码速度:
+            return -1.0 / (统计.total_in_flight + 1)
+        return (首token延迟 + output_tokens / 解码速度) * (统计.total_in_flight + 1)
+
+
+STRATEGIES = {
+    cls.name: cls
+    for cls in (RoundRobinStrategy, LeastOutstandingStrategy, EWMALatencyStrategy, PowerOfTwoStrategy,
+                WeightedStrategy, ThroughputStrategy)
+}
+
+
+class LoadBalancer:
+    """负载均衡器:维护上游列表及统计,按配置的策略选择上游
+
+    Example:
+        >>> 负载均衡器 = LoadBalancer(ai_configs['ai'], strategy="ewma")
+        >>> 上游 = 负载均衡器.select()
+        >>> with 负载均衡器.track(上游) as 记录:
+        ...     记录["success"] = True
+
+    多进程部署时传入 shared(多进程共享类.SharedState):每次选择前汇总其他进程的在途数、延迟、
+    熔断和冷却状态,全部上游的轮询序号也在进程间共享。
+
+    select 传入 pool 时只在该模型池(AIConfig.pool)的上游中选择,每个池使用各自的策略实例
+    (pool_strategies 中指定的策略,未指定时与全局策略相同),轮询位置等状态互不影响。
+    """
+
+    def __init__(self, api_configs: List[AIConfig], strategy: str = "round_robin", ewma_alpha: float = 0.3,
+                 breaker_config: Optional[BreakerConfig] = None, rate_limiter: Optional[RateLimiter] = None,
+                 shared=None, throughput_window: float = 600.0, throughput_samples: int = 64,
+                 expected_output_tokens: float = 512, pool_strategies: Optional[Dict[str, str]] = None):
+        for 名称 in [strategy, *(pool_strategies or {}).values()]:
+            if 名称 not in STRATEGIES:
+                raise ValueError(f"未知的负载均衡策略: {名称},可选: {', '.join(STRATEGIES)}")
+        if not api_configs:
+            raise ValueError("上游配置列表为空")
+        self.breaker_config = breaker_config
+        self.rate_limiter = rate_limiter
+        self.throughput_window = throughput_window
+        self.throughput_samples = throughput_samples
+        self.upstreams = [self._new_upstream(i, 配置) for i, 配置 in enumerate(api_configs)]
+        self._next_index = len(self.upstreams)
+        self.shared = shared
+        self.expected_output_tokens = expected_output_tokens
+        if shared is not None and strategy == RoundRobinStrategy.name:
+            self.strategy = RoundRobinStrategy(counter=shared.next_ticket)
+        else:
+            self.strategy = self._make_strategy(strategy)
+        self.pool_strategies = dict(pool_strategies or {})
+        self._pool_strategies: Dict[str, SelectionStrategy] = {}
+        self.ewma_alpha = ewma_alpha
+
+    def _make_strategy(self, name: str) -> SelectionStrategy:
+        if name == ThroughputStrategy.name:
+            return ThroughputStrategy(self.expected_output_tokens)
+        return STRATEGIES[name]()
+
+    def pool_strategy(self, pool: str) -> SelectionStrategy:
+        """模型池的策略实例,首次使用时创建;池内轮询使用本进程的计数(共享序号被其他池的请求穿插后会失去均匀性)"""
+        策略 = self._pool_strategies.get(pool)
+        if 策略 is None:
+            策略 = self._pool_strategies[pool] = self._make_strategy(self.pool_strategies.get(pool, self.strategy.name))
+        return 策略
+
+    def pools(self) -> Dict[str, List[Upstream]]:
+        """当前各模型池的上游,按配置顺序"""
+        结果: Dict[str, List[Upstream]] = {}
+        for 上游 in self.upstreams:
+            结果.setdefault(上游.config.pool, []).append(上游)
+        return 结果
+
+    def members(self, pool: Optional[str] = None, model: Optional[str] = None) -> List[Upstream]:
+        """属于模型池 pool、模型为 model 的上游;参数为 None 时不按该项筛选"""
+        return [
+            上游 for 上游 in self.upstreams
+            if (pool is None or 上游.config.pool == pool) and (model is None or 上游.config.model == model)
+        ]
+
+    def _new_upstream(self, index: int, config: AIConfig) -> Upstream:
+        统计 = UpstreamStats(throughput=ThroughputWindow(self.throughput_window, self.throughput_samples))
+        return Upstream(index=index, config=config, weight=config.weight, stats=统计,
+                        breaker=CircuitBreaker(self.breaker_config),
+                        rate_limit=self.rate_limiter.for_config(config) if self.rate_limiter else None)
+
+    def reload(self, api_configs: List[AIConfig]) -> Dict[str, List[int]]:
+        """用新的上游列表替换当前列表,返回新增、删除、保留的上游编号
+
+        url、key、model 都相同的条目视为同一上游,保留其统计、熔断器和冷却状态,只更新权重等设置;
+        进行中的请求持有原 Upstream 对象,不受替换影响。列表替换是一次赋值,不会出现半新半旧的状态。
+        """
+        if not api_configs:
+            raise ValueError("上游配置列表为空")
+        if self.rate_limiter is not None:
+            self.rate_limiter.reconfigure(api_configs)
+        旧上游: Dict[Tuple[str, str, str], List[Upstream]] = {}
+        for 上游 in self.upstreams:
+            旧上游.setdefault(上游.config.identity(), []).append(上游)
+        新列表, 新增, 保留 = [], [], []
+        for 配置 in api_configs:
+            候选 = 旧上游.get(配置.identity())
+            if 候选:
+                上游 = 候选.pop(0)
+                上游.config = 配置
+                上游.weight = 配置.weight
+                上游.rate_limit = self.rate_limiter.for_config(配置) if self.rate_limiter else None
+                保留.append(上游.index)
+            else:
+                上游 = self._new_upstream(self._next_index, 配置)
+                self._next_index += 1
+                新增.append(上游.index)
+            新列表.append(上游)
+        删除 = [上游.index for 剩余 in 旧上游.values() for 上游 in 剩余]
+        self.upstreams = 新列表
+        return {"added": 新增, "removed": 删除, "kept": 保留}
+
+    def select(self, exclude: Collection[int] = (), cost: float = 0.0,
+               output_tokens: Optional[float] = None, pool: Optional[str] = None,
+               model: Optional[str] = None) -> Upstream:
+        """在未熔断、未冷却、额度足够支付 cost 个token且不在 exclude 中的上游里按策略选择一个
+
+        output_tokens 为请求限制的回答token数,供 throughput 策略估计完成时间;
+        pool、model 不为 None 时只在该模型池、该模型的上游中选择,指定 pool 时使用池的策略。
+        """
+        if self.shared is not None:
+            self.shared.sync(self.upstreams)
+        可用上游 = [上游 for 上游 in self.members(pool, model) if 上游.index not in exclude and 上游.available(cost)]
+        if not 可用上游:
+            范围 = "" if pool is None else f"模型池 {pool} 中"
+            raise NoUpstreamAvailable(f"{范围}没有可用的上游(均已熔断、冷却或已尝试)")
+        策略 = self.strategy if pool is None else self.pool_strategy(pool)
+        return 策略.select(可用上游, output_tokens)
+
+    def get_next_api(self) -> Tuple[int, AIConfig]:
+        上游 = self.select()
+        return 上游.index, 上游.config
+
+    @contextmanager
+    def track(self, upstream: Upstream) -> Iterator[Dict[str, Any]]:
+        """记录一次上游调用
+
+        进入时在途数+1,退出时按 记录["success"] 更新延迟统计和熔断器,失败时 记录["kind"]
+        (熔断器类中的失败类别,默认 error)决定是否计入熔断;调用被取消(客户端断开)时只释放名额,不计入成败。
+        """
+        记录 = {"success": False, "error": None, "kind": ERROR}
+        upstream.stats.in_flight += 1
+        试探 = upstream.breaker.before_call()
+        if self.shared is not None:
+            self.shared.publish(upstream)
+        开始时间 = time.monotonic()
+        try:
+            yield 记录
+        except (asyncio.CancelledError, GeneratorExit):
+            upstream.breaker.release(试探)
+            记录["cancelled"] = True
+            raise
+        finally:
+            upstream.stats.in_flight -= 1
+            if not 记录.get("cancelled"):
+                upstream.stats.record(time.monotonic() - 开始时间, 记录["success"], self.ewma_alpha)
+                if 记录["success"]:
+                    upstream.breaker.record_success(试探)
+                else:
+                    upstream.breaker.record_failure(记录["error"], 记录["kind"], 试探)
+            if self.shared is not None:
+                self.shared.publish(upstream)
+
+    def breaker_stats(self) -> List[Dict[str, Any]]:
+        return [
+            {"index": 上游.index, "model": 上游.config.model, **上游.breaker.to_dict()}
+            for 上游 in self.upstreams
+        ]
+
+    def throughput_stats(self) -> List[Dict[str, Any]]:
+        return [
+            {"index": 上游.index, "model": 上游.config.model, **上游.stats.throughput_dict()}
+            for 上游 in self.upstreams
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "strategy": self.strategy.name,
+            "upstreams": [上游.to_dict() for 上游 in self.upstreams],
+            "pools": {
+                池: {"strategy": self.pool_strategies.get(池, self.strategy.name), "upstreams": [上游.index for 上游 in 成员]}
+                for 池, 成员 in self.pools().items()
+            },
+        }
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import random
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+# MinHash 的哈希族 (a*h + b) mod p 取梅森素数 p = 2^61 - 1
+_PRIME = (1 << 61) - 1
+
+
+@dataclass
+class ApproxCacheConfig:
+    """近似问题缓存配置,对应 ai_configs.toml 中的 [approx_cache] 段"""
+    enabled: bool = False
+    threshold: float = 0.9       # 规范化后字符 n-gram 集合的 Jaccard 相似度达到该值才命中
+    shingle_size: int = 3        # n-gram 的字符数
+    num_perm: int = 64           # MinHash 签名长度
+    bands: int = 16              # LSH 分段数,num_perm 须能被整除;段越多,越低的相似度也会成为候选
+    max_entries: int = 2048      # 最多缓存的问题数,超出时淘汰最久未命中的
+    ttl: float = 600.0           # 回答的有效期(秒)
+    min_chars: int = 8           # 规范化后短于该长度的问题不参与近似匹配(短问题改几个字含义就变了)
+    max_chars: int = 4000        # 规范化后长于该长度的问题不参与,限制签名计算耗时和内存
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ApproxCacheConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+def normalize_question(text: str) -> str:
+    """NFKC 规范化(全角转半角)、转小写,去掉空白和标点"""
+    return "".join(
+        字 for 字 in unicodedata.normalize("NFKC", text).lower()
+        if not 字.isspace() and not unicodedata.category(字).startswith("P")
+    )
+
+
+def shingles(text: str, size: int) -> FrozenSet[str]:
+    if len(text) <= size:
+        return frozenset((text,))
+    return frozenset(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    交集 = len(a & b)
+    return 交集 / (len(a) + len(b) - 交集)
+
+
+class _Entry:
+    __slots__ = ("scope", "signature", "shingles", "value", "expires_at")
+
+    def __init__(self, scope: str, signature: Tuple[int, ...], shingle_set: FrozenSet[str], value: Any,
+                 expires_at: float):
+        self.scope = scope
+        self.signature = signature
+        self.shingles = shingle_set
+        self.value = value
+        self.expires_at = expires_at
+
+
+class ApproxCache:
+    """近似问题缓存:MinHash 签名 + LSH 分段索引,只在内存中,按 LRU 淘汰
+
+    问题规范化后切成字符 n-gram,用 MinHash 签名的各段作为 LSH 桶找出候选,
+    再用 n-gram 集合的精确 Jaccard 相似度确认;最高相似度达到 threshold 时返回缓存的回答。
+    模型、系统提示词和采样参数不同的问题互不匹配。
+
+    Example:
+        >>> cache = ApproxCache(ApproxCacheConfig(enabled=True, threshold=0.9))
+        >>> cache.put(model, system_prompt, "怎么用 Python 读取 CSV 文件?", params, 结果)
+        >>> cache.lookup(model, system_prompt, "怎么用python读取csv文件", params)
+        ({...回答..., 'similarity': 1.0}, 1.0)
+    """
+
+    # 相似度分布按 0.1 分档统计,用于调整 threshold
+    _HISTOGRAM_EDGES = tuple(round(0.1 * i, 1) for i in range(10))
+
+    def __init__(self, config: Optional[ApproxCacheConfig] = None):
+        self.config = config or ApproxCacheConfig()
+        if self.config.num_perm % self.config.bands:
+            raise ValueError("approx_cache 的 num_perm 必须能被 bands 整除")
+        self._rows = self.config.num_perm // self.config.bands
+        # 每个 n-gram 取一次 64 位哈希,再用 num_perm 组随机 (a, b) 的 (a*h + b) mod p 模拟随机排列;
+        # 只与随机掩码异或不是 min-wise 独立的,各签名位的碰撞概率会偏离 Jaccard 相似度
+        随机 = random.Random(20250101)
+        self._perms = [(随机.randrange(1, _PRIME), 随机.randrange(0, _PRIME)) for _ in range(self.config.num_perm)]
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[int]] = {}
+        self._next_id = 0
+        self.counts = {"lookups": 0, "hits": 0, "misses": 0, "skipped": 0, "stores": 0,
+                       "evictions": 0, "expired": 0, "candidates": 0}
+        self._best_similarity = [0] * len(self._HISTOGRAM_EDGES)
+        self._hit_similarity_sum = 0.0
+
+    @staticmethod
+    def make_scope(model: str, system_prompt: str, params: Dict[str, Any]) -> str:
+        原文 = json.dumps([model, system_prompt, params], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(原文.encode("utf-8")).hexdigest()
+
+    def _features(self, question: str) -> Optional[Tuple[FrozenSet[str], Tuple[int, ...]]]:
+        文本 = normalize_question(question)
+        if not self.config.min_chars <= len(文本) <= self.config.max_chars:
+            return None
+        集合 = shingles(文本, self.config.shingle_size)
+        哈希 = [int.from_bytes(hashlib.blake2b(片.encode("utf-8"), digest_size=8).digest(), "little") for 片 in 集合]
+        return 集合, tuple(min((a * h + b) % _PRIME for h in 哈希) for a, b in self._perms)
+
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]) -> List[Tuple[str, int, Tuple[int, ...]]]:
+        r = self._rows
+        return [(scope, 段, signature[段 * r:(段 + 1) * r]) for 段 in range(self.config.bands)]
+
+    def lookup(self, model: str, system_prompt: str, question: str,
+               params: Dict[str, Any]) -> Optional[Tuple[Any, float]]:
+        """返回 (带 similarity 字段的缓存回答, 相似度);没有足够相似的问题时返回 None"""
+        特征 = self._features(question)
+        if 特征 is None:
+            self.counts["skipped"] += 1
+            return None
+        self.counts["lookups"] += 1
+        集合, 签名 = 特征
+        范围 = self.make_scope(model, system_prompt, params)
+        候选: Set[int] = set()
+        for 桶键 in self._band_keys(范围, 签名):
+            候选 |= self._buckets.get(桶键, set())
+        self.counts["candidates"] += len(候选)
+
+        现在 = time.monotonic()
+        最佳编号, 最佳相似度 = None, 0.0
+        for 编号 in 候选:
+            条目 = self._entries.get(编号)
+            if 条目 is None:
+                continue
+            if 条目.expires_at <= 现在:
+                self._remove(编号)
+                self.counts["expired"] += 1
+                continue
+            相似度 = jaccard(集合, 条目.shingles)
+            if 相似度 > 最佳相似度:
+                最佳编号, 最佳相似度 = 编号, 相似度
+        self._best_similarity[min(int(最佳相似度 * 10), 9)] += 1
+
+        if 最佳编号 is None or 最佳相似度 < self.config.threshold:
+            self.counts["misses"] += 1
+            return None
+        self.counts["hits"] += 1
+        self._hit_similarity_sum += 最佳相似度
+        self._entries.move_to_end(最佳编号)
+        相似度 = round(最佳相似度, 4)
+        return {**self._entries[最佳编号].value, "similarity": 相似度}, 相似度
+
+    def put(self, model: str, system_prompt: str, question: str, params: Dict[str, Any], value: Any) -> None:
+        特征 = self._features(question)
+        if 特征 is None:
+            return
+        集合, 签名 = 特征
+        范围 = self.make_scope(model, system_prompt, params)
+        self.counts["stores"] += 1
+        # 规范化后相同的问题覆盖原来的条目,重复写入不占用桶和容量
+        桶键列表 = self._band_keys(范围, 签名)
+        for 编号 in self._buckets.get(桶键列表[0], ()):
+            条目 = self._entries[编号]
+            if 条目.scope == 范围 and 条目.shingles == 集合:
+                条目.value = value
+                条目.expires_at = time.monotonic() + self.config.ttl
+                self._entries.move_to_end(编号)
+                return
+        编号 = self._next_id
+        self._next_id += 1
+        self._entries[编号] = _Entry(范围, 签名, 集合, value, time.monotonic() + self.config.ttl)
+        for 桶键 in 桶键列表:
+            self._buckets.setdefault(桶键, set()).add(编号)
+        while len(self._entries) > self.config.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.counts["evictions"] += 1
+
+    def _remove(self, entry_id: int) -> None:
+        条目 = self._entries.pop(entry_id)
+        for 桶键 in self._band_keys(条目.scope, 条目.signature):
+            桶 = self._buckets.get(桶键)
+            if 桶 is not None:
+                桶.discard(entry_id)
+                if not 桶:
+                    del self._buckets[桶键]
+
+    def stats(self) -> Dict[str, Any]:
+        查询 = self.counts["lookups"]
+        return {
+            **self.counts,
+            "hit_ratio": round(self.counts["hits"] / 查询, 4) if 查询 else 0.0,
+            "avg_hit_similarity": round(self._hit_similarity_sum / self.counts["hits"], 4) if self.counts["hits"] else None,
+            "threshold": self.config.threshold,
+            "size": len(self._entries),
+            "max_entries": self.config.max_entries,
+            "buckets": len(self._buckets),
+            # 每次查询中最相似候选的相似度分布,键为区间下界;命中率低而 0.7~0.8 档很多时可考虑降低 threshold
+            "best_similarity_histogram": {
+                f"{下界:.1f}": 数量 for 下界, 数量 in zip(self._HISTOGRAM_EDGES, self._best_similarity)
+            },
+        }
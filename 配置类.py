@@ -1,6 +1,9 @@
 import os
+import re
+import json
+import math
+import datetime
 from pathlib import Path
-from DrissionPage import Chromium,ChromiumPage, ChromiumOptions
 import tomli
 
 class 配置类:
@@ -10,46 +13,82 @@ class 配置类:
         os.chdir(当前目录.parent)
     @staticmethod
     def dp配置():
-        co = ChromiumOptions().set_local_port(8077)
-        co.set_timeouts(base=5)
-        page = ChromiumPage(addr_or_opts=co)
-        print(f"浏览器启动端口: {page.address}")
-        return page
+        """兼容旧调用,见 浏览器类.dp配置;DrissionPage 只在调用时才导入"""
+        from 浏览器类 import 浏览器类
+        return 浏览器类.dp配置()
     @staticmethod
     def dp配置使用手机环境():
-        co = ChromiumOptions().set_local_port(8077)
-        co.set_user_agent(user_agents["Chrome_Android"])
-        tab = Chromium(co).latest_tab
-        user_agents = {
-    "Chrome_Windows": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36",
-    "Firefox_Windows": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:110.0) Gecko/20100101 Firefox/110.0",
-    "Safari_macOS": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Version/15.1 Safari/537.36",
-    "Edge_Windows": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Edge/110.0.1587.57",
-    "Chrome_Android": "Mozilla/5.0 (Linux; Android 12; Pixel 5 Build/SP1A.210812.016) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Mobile Safari/537.36",
-    "Safari_iOS": "Mozilla/5.0 (iPhone; CPU iPhone OS 15_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.1 Mobile/15E148 Safari/604.1",
-    "Opera_Windows": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36 OPR/97.0.4692.71"
-        }
-        # 设置界面模式
-        zoom = {
-            "command": "Emulation.setDeviceMetricsOverride",
-            "parameters": {
-                "width": 360,          # 设备的宽度 (像素)
-                "height": 740,         # 设备的高度 (像素)
-                "deviceScaleFactor": 1, # 设置设备的缩放比例 (相当于屏幕 DPI)
-                "mobile": True,        # 设置是否为手机模拟 (选填为 "true" 或 "false")
-                "scale": 1            # 页面缩放比例 (0.8 表示页面缩小到 80%)
-            }
-        }
-        tab.run_cdp(zoom["command"], **zoom["parameters"])
-        tab.get("https://www.baidu.com/")
+        from 浏览器类 import 浏览器类
+        return 浏览器类.dp配置使用手机环境()
     @staticmethod
     def 读取toml文件(文件路径: str) -> dict:
         with open(文件路径, 'rb') as f:
             return tomli.load(f)
     @staticmethod
     def 写入toml文件(文件路径: str, 配置文件数据: dict):
-        with open(文件路径, 'wb') as f:
-            tomli.dump(配置文件数据, f)
+        """写入 toml 文件(tomli 只能读取);安装了 tomli_w 时使用它,否则使用内置的简单实现
+
+        注意:写入会丢失原文件中的注释。先写临时文件再替换,写入中途失败不会损坏原文件。
+        """
+        try:
+            import tomli_w
+            内容 = tomli_w.dumps(配置文件数据)
+        except ImportError:
+            内容 = 转toml文本(配置文件数据)
+        tomli.loads(内容)  # 写入前确认能被读回
+        临时路径 = Path(str(文件路径) + '.tmp')
+        临时路径.write_text(内容, encoding='utf-8')
+        os.replace(临时路径, 文件路径)
+
+_裸键 = re.compile(r'^[A-Za-z0-9_-]+$')
+
+def _toml键(键: str) -> str:
+    return 键 if _裸键.match(键) else _toml字符串(键)
+
+def _toml字符串(值: str) -> str:
+    # JSON 的字符串转义是 TOML 基本字符串转义的子集,只需额外转义 DEL
+    return json.dumps(值, ensure_ascii=False).replace('\x7f', '\\u007f')
+
+def _toml值(值) -> str:
+    if isinstance(值, bool):
+        return 'true' if 值 else 'false'
+    if isinstance(值, (int, float)):
+        if isinstance(值, float) and math.isnan(值):
+            return 'nan'
+        if isinstance(值, float) and math.isinf(值):
+            return 'inf' if 值 > 0 else '-inf'
+        return repr(值)
+    if isinstance(值, str):
+        return _toml字符串(值)
+    if isinstance(值, (datetime.datetime, datetime.date, datetime.time)):
+        return 值.isoformat()
+    if isinstance(值, (list, tuple)):
+        return '[' + ', '.join(_toml值(项) for 项 in 值) + ']'
+    if isinstance(值, dict):
+        return '{' + ', '.join(f'{_toml键(k)} = {_toml值(v)}' for k, v in 值.items()) + '}'
+    raise TypeError(f"无法写入toml的类型: {type(值).__name__}")
+
+def _是表数组(值) -> bool:
+    return isinstance(值, list) and bool(值) and all(isinstance(项, dict) for 项 in 值)
+
+def 转toml文本(数据: dict, 前缀: str = '') -> str:
+    """把字典转换为 toml 文本:先写普通键值,再写子表,最后写表数组([[...]])"""
+    行列表 = []
+    for 键, 值 in 数据.items():
+        if not isinstance(值, dict) and not _是表数组(值):
+            行列表.append(f'{_toml键(键)} = {_toml值(值)}')
+    for 键, 值 in 数据.items():
+        if isinstance(值, dict):
+            表名 = f'{前缀}{_toml键(键)}'
+            行列表.append(f'\n[{表名}]')
+            行列表.append(转toml文本(值, 表名 + '.').strip('\n'))
+    for 键, 值 in 数据.items():
+        if _是表数组(值):
+            表名 = f'{前缀}{_toml键(键)}'
+            for 项 in 值:
+                行列表.append(f'\n[[{表名}]]')
+                行列表.append(转toml文本(项, 表名 + '.').strip('\n'))
+    return '\n'.join(行 for 行 in 行列表 if 行).lstrip('\n') + '\n'
 
 if __name__ == "__main__":
     配置类.切换到脚本所在目录()
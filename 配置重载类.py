@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, fields
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReloadConfig:
+    """配置热加载设置,对应 ai_configs.toml 中的 [reload] 段"""
+    watch: bool = True      # 是否监视配置文件,修改后自动重新加载上游列表
+    interval: float = 2.0   # 检查文件修改时间的间隔(秒)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ReloadConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+class ConfigWatcher:
+    """定时检查配置文件的修改时间和大小,发生变化时调用 on_change
+
+    on_change 抛出的异常(例如新配置不合法)只记录警告日志,不影响下一次检查;
+    文件写到一半时读到的不完整内容会校验失败,写完后修改时间再次变化时会重新加载。
+
+    Example:
+        >>> 监视器 = ConfigWatcher("ai_configs.toml", 重新加载上游配置, interval=2)
+        >>> 监视器.start()
+        >>> await 监视器.stop()
+    """
+
+    def __init__(self, path: str, on_change: Callable[[], Awaitable[Any]], interval: float = 2.0):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._last = self._signature()
+        self._task: Optional[asyncio.Task] = None
+
+    def _signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            状态 = os.stat(self.path)
+        except OSError:
+            return None
+        return 状态.st_mtime_ns, 状态.st_size
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            当前 = self._signature()
+            if 当前 is None or 当前 == self._last:
+                continue
+            self._last = 当前
+            try:
+                await self.on_change()
+            except Exception as e:
+                logger.warning(f"重新加载配置失败,继续使用当前配置: {e}")
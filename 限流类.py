@@ -0,0 +1,187 @@
+import time
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from AIClass import AIConfig
+
+
+@dataclass
+class RateLimitConfig:
+    """客户端限流配置,对应 ai_configs.toml 中的 [rate_limit] 段;rpm/tpm 本身写在各个 [[ai]] 中"""
+    enabled: bool = True
+    chars_per_token: float = 1.5          # 估算提示词token数时,平均每个token对应的字符数
+    estimated_output_tokens: int = 512    # 发送前预估的回答token数,收到实际用量后按实际值修正
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "RateLimitConfig":
+        已知字段 = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in (data or {}).items() if k in 已知字段})
+
+
+class TokenBucket:
+    """令牌桶:容量为每分钟额度,按 额度/60 每秒匀速补充;允许为负(实际用量超出预估时欠账)"""
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> float:
+        现在 = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (现在 - self.updated) * self.rate)
+        self.updated = 现在
+        return self.tokens
+
+    def can_afford(self, amount: float) -> bool:
+        return self._refill() >= min(amount, self.capacity)
+
+    def time_until(self, amount: float) -> float:
+        """距离余额足够支付 amount 还需等待的秒数"""
+        缺口 = min(amount, self.capacity) - self._refill()
+        return max(0.0, 缺口 / self.rate) if self.rate else float("inf")
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"per_minute": self.capacity, "available": round(self._refill(), 1)}
+
+
+class Reservation:
+    """一次上游调用预先扣除的额度,调用结束后用实际用量修正"""
+    __slots__ = ("limit", "tokens", "settled")
+
+    def __init__(self, limit: "RateLimit", tokens: float):
+        self.limit = limit
+        self.tokens = tokens
+        self.settled = False
+
+    def settle(self, actual_tokens: Optional[float]) -> None:
+        """按实际用量多退少补;actual_tokens 为 None 时保持预估值"""
+        if self.settled:
+            return
+        self.settled = True
+        if actual_tokens is not None and self.limit.tpm is not None:
+            self.limit.tpm.consume(actual_tokens - self.tokens)
+            self.limit.counts["reconciled_tokens"] += actual_tokens - self.tokens
+
+
+class RateLimit:
+    """同一 API key + 模型的 RPM/TPM 额度,使用该 key 和模型的所有上游共享"""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        self.counts = {"reserved_requests": 0, "reserved_tokens": 0.0, "reconciled_tokens": 0.0}
+
+    def can_afford(self, tokens: float) -> bool:
+        return (self.rpm is None or self.rpm.can_afford(1)) and (self.tpm is None or self.tpm.can_afford(tokens))
+
+    def time_until(self, tokens: float) -> float:
+        return max(
+            self.rpm.time_until(1) if self.rpm else 0.0,
+            self.tpm.time_until(tokens) if self.tpm else 0.0,
+        )
+
+    def reserve(self, tokens: float) -> Reservation:
+        if self.rpm is not None:
+            self.rpm.consume(1)
+        if self.tpm is not None:
+            self.tpm.consume(tokens)
+        self.counts["reserved_requests"] += 1
+        self.counts["reserved_tokens"] += tokens
+        return Reservation(self, tokens)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rpm": self.rpm.to_dict() if self.rpm else None,
+            "tpm": self.tpm.to_dict() if self.tpm else None,
+            **{k: round(v, 1) for k, v in self.counts.items()},
+        }
+
+
+class RateLimiter:
+    """按 (API key, 模型) 管理共享的限流额度
+
+    同一 key 和模型出现在多个 [[ai]] 中时共用一份额度,rpm/tpm 取其中最小的配置值。
+
+    Example:
+        >>> 限流器 = RateLimiter(RateLimitConfig())
+        >>> 额度 = 限流器.for_config(AIConfig(url=url, key="k", model="m", rpm=60, tpm=20000))
+        >>> 预留 = 额度.reserve(限流器.estimate(system_prompt, question))
+        >>> 预留.settle(usage["total_tokens"])
+    """
+
+    def __init__(self, config: Optional[RateLimitConfig] = None):
+        self.config = config or RateLimitConfig()
+        self._limits: Dict[Tuple[str, str], RateLimit] = {}
+
+    def for_config(self, api_config: AIConfig) -> Optional[RateLimit]:
+        """返回上游配置对应的共享额度;未配置 rpm/tpm 时返回 None"""
+        rpm, tpm = api_config.rpm, api_config.tpm
+        if not rpm and not tpm:
+            return None
+        键 = (api_config.key, api_config.model)
+        额度 = self._limits.get(键)
+        if 额度 is None:
+            额度 = self._limits[键] = RateLimit(rpm, tpm)
+            return 额度
+        # 已存在时收紧到更小的配置,保留当前余额
+        for 名称, 值 in (("rpm", rpm), ("tpm", tpm)):
+            if not 值:
+                continue
+            桶 = getattr(额度, 名称)
+            if 桶 is None:
+                setattr(额度, 名称, TokenBucket(值))
+            elif 值 < 桶.capacity:
+                桶.capacity, 桶.rate = float(值), 值 / 60.0
+                桶.tokens = min(桶.tokens, 桶.capacity)
+        return 额度
+
+    def reconfigure(self, api_configs: List[AIConfig]) -> None:
+        """热加载时按新的 [[ai]] 列表重设额度(可放宽也可收紧),已有的余额保留"""
+        新额度: Dict[Tuple[str, str], Dict[str, Optional[int]]] = {}
+        for 配置 in api_configs:
+            if not 配置.rpm and not 配置.tpm:
+                continue
+            当前 = 新额度.setdefault((配置.key, 配置.model), {"rpm": None, "tpm": None})
+            for 名称 in ("rpm", "tpm"):
+                值 = getattr(配置, 名称)
+                if 值 and (当前[名称] is None or 值 < 当前[名称]):
+                    当前[名称] = 值
+        # 不再有上游引用的额度直接丢弃,进行中调用的预留仍持有原对象
+        self._limits = {键: 额度 for 键, 额度 in self._limits.items() if 键 in 新额度}
+        for 键, 值表 in 新额度.items():
+            额度 = self._limits.setdefault(键, RateLimit())
+            for 名称, 值 in 值表.items():
+                桶 = getattr(额度, 名称)
+                if not 值:
+                    setattr(额度, 名称, None)
+                elif 桶 is None:
+                    setattr(额度, 名称, TokenBucket(值))
+                else:
+                    桶.capacity, 桶.rate = float(值), 值 / 60.0
+                    桶.tokens = min(桶.tokens, 桶.capacity)
+
+    def estimate(self, system_prompt: str, question: str) -> float:
+        """估算一次请求消耗的token数(提示词按字符数折算 + 预估回答长度)"""
+        return self.estimate_chars(len(system_prompt) + len(question))
+
+    def estimate_chars(self, prompt_chars: int) -> float:
+        """按提示词总字数估算一次请求消耗的token数(多轮对话时为所有消息的字数之和)"""
+        return prompt_chars / self.config.chars_per_token + self.config.estimated_output_tokens
+
+    def estimate_output(self, chars: int) -> float:
+        """上游没有返回用量时,按回答字数估算回答的token数"""
+        return chars / self.config.chars_per_token
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limits": [
+                {"key": f"{键[:4]}…{键[-4:]}" if len(键) > 8 else "…", "model": 模型, **额度.to_dict()}
+                for (键, 模型), 额度 in self._limits.items()
+            ],
+        }